@@ -0,0 +1,375 @@
+import base64
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow is optional; originals are served without it
+    Image = None
+
+# Default byte budget for the shared asset cache (encoded bytes kept in memory)
+ASSET_CACHE_MAX_BYTES = int(os.environ.get('ASSET_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# How images are delivered to the browser: 'auto' uses static URLs whenever
+# Streamlit's static file serving is enabled, 'static' forces URLs, 'inline'
+# always embeds data URIs
+ASSET_SERVING = os.environ.get('ASSET_SERVING', 'auto')
+
+# Assets at or below this size are still inlined; a data URI is cheaper than a request
+INLINE_MAX_BYTES = int(os.environ.get('ASSET_INLINE_MAX_BYTES', 2048))
+
+# Published copies live under ./static, which Streamlit serves at app/static/
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_ASSET_DIR = 'assets'
+
+# Resized/recompressed variants are written here, one folder per source hash
+VARIANT_ROOT = os.environ.get(
+    'ASSET_VARIANT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.asset_cache')
+)
+
+# Variants are rendered at this multiple of the CSS width to stay sharp on HiDPI screens
+VARIANT_SCALE = 2
+
+# Lossy quality per format; the background is drawn at 10% opacity so it can go lower
+VARIANT_QUALITY = {'webp': 80, 'avif': 60}
+BACKGROUND_QUALITY = {'webp': 50, 'avif': 35}
+
+# Formats every browser can display; AVIF is only ever served next to one of these
+FALLBACK_FORMATS = ('png', 'webp')
+FALLBACK_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+
+def file_fingerprint(file_path):
+    """
+    Return a (path, mtime, size) tuple identifying the current version of a file,
+    or None if the file does not exist.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+
+class AssetCache:
+    """
+    Process-wide LRU cache for encoded assets and text derived from them.
+
+    Streamlit re-executes main.py on every rerun, so this cache lives in an
+    imported module and is shared by every session in the process. Entries are
+    keyed by path, mtime and size, so an edited file is re-read automatically.
+    """
+
+    def __init__(self, max_bytes=ASSET_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def _store(self, key, value, stale_prefix):
+        size = len(value)
+        with self._lock:
+            # Drop older versions of the same entry (e.g. the file was edited)
+            for old_key in [k for k in self._entries if k[:len(stale_prefix)] == stale_prefix and k != key]:
+                self.current_bytes -= len(self._entries.pop(old_key))
+            if key in self._entries or size > self.max_bytes:
+                return
+            self._entries[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_base64(self, file_path):
+        """
+        Return the base64 encoded contents of a file, reading it only on a miss.
+        Returns an empty string if the file does not exist.
+        """
+        fingerprint = file_fingerprint(file_path)
+        if fingerprint is None:
+            return ''
+        key = ('base64',) + fingerprint
+        value = self._lookup(key)
+        if value is None:
+            with open(file_path, 'rb') as f:
+                value = base64.b64encode(f.read()).decode()
+            self._store(key, value, ('base64', fingerprint[0]))
+        return value
+
+    def get_derived(self, name, file_paths, builder):
+        """
+        Return text built from one or more files, e.g. a CSS block embedding an image.
+        The builder is only called again when one of the files changes.
+        """
+        key = ('derived', name, tuple(file_fingerprint(p) for p in file_paths))
+        value = self._lookup(key)
+        if value is None:
+            value = builder()
+            self._store(key, value, ('derived', name))
+        return value
+
+    def stats(self):
+        """
+        Return hit/miss counters and memory usage of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+# Shared instance used by every session in this process
+asset_cache = AssetCache()
+
+
+def _variant_formats():
+    formats = ['png']
+    if features.check('webp'):
+        formats.append('webp')
+    if features.check('avif'):
+        formats.append('avif')
+    return formats
+
+
+def _quality_tag(quality):
+    return '-'.join(f"{fmt}{value}" for fmt, value in sorted(quality.items()))
+
+
+def build_variant(file_path, width, quality=None):
+    """
+    Resize an image to the given pixel width and recompress it as optimized PNG,
+    WebP and AVIF (where Pillow supports them). Two results are kept: the
+    smallest one overall, and the smallest one in a format every browser can
+    display, to fall back on where AVIF is not supported.
+    Variants are stored under VARIANT_ROOT/<source hash>/ and reused on later calls.
+    Returns a (best, fallback) pair of paths; either may be the original file.
+    """
+    quality = quality or VARIANT_QUALITY
+    with open(file_path, 'rb') as f:
+        source = f.read()
+    digest = hashlib.sha256(source).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    variant_dir = os.path.join(VARIANT_ROOT, digest)
+    # The quality is part of the name, so changing it builds new variants
+    prefix = f"{stem}-{width}w-{_quality_tag(quality)}"
+    marker = os.path.join(variant_dir, f"{prefix}.best")
+
+    def resolve(name):
+        return os.path.join(variant_dir, name) if name else file_path
+
+    if os.path.exists(marker):
+        with open(marker) as f:
+            best, fallback = (f.read().split('\n') + [''])[:2]
+        return resolve(best), resolve(fallback)
+
+    os.makedirs(variant_dir, exist_ok=True)
+    with Image.open(file_path) as img:
+        img.load()
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA')
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.LANCZOS)
+        encoded = {}
+        for fmt in _variant_formats():
+            fd, tmp_path = tempfile.mkstemp(dir=variant_dir)
+            options = {'optimize': True} if fmt == 'png' else {'quality': quality[fmt]}
+            if fmt == 'webp':
+                options['method'] = 6
+            with os.fdopen(fd, 'wb') as f:
+                img.save(f, fmt.upper(), **options)
+            encoded[fmt] = (os.path.getsize(tmp_path), tmp_path)
+
+    # '' stands for the original file
+    original = (len(source), '')
+    fallback_choices = [encoded[fmt] + (fmt,) for fmt in FALLBACK_FORMATS if fmt in encoded]
+    if os.path.splitext(file_path)[1].lower() in FALLBACK_EXTENSIONS:
+        fallback_choices.append(original + ('',))
+    fallback = min(fallback_choices)
+    best = min([fallback] + [encoded[fmt] + (fmt,) for fmt in encoded])
+    for fmt, (_, tmp_path) in encoded.items():
+        if fmt in (best[2], fallback[2]):
+            os.replace(tmp_path, os.path.join(variant_dir, f"{prefix}.{fmt}"))
+        else:
+            os.remove(tmp_path)
+    names = [f"{prefix}.{choice[2]}" if choice[2] else '' for choice in (best, fallback)]
+    with open(marker, 'w') as f:
+        f.write('\n'.join(names))
+    return resolve(names[0]), resolve(names[1])
+
+
+def optimized_variants(file_path, width=None, quality=None):
+    """
+    Return the paths of an image sized for the given display width (in CSS
+    pixels), smallest first. The last path is always in a format every browser
+    can display; the list has a single entry when that is also the smallest.
+    Falls back to the original file when no width is given, Pillow is
+    unavailable or the variants cannot be built.
+    """
+    if width is None or Image is None or file_fingerprint(file_path) is None:
+        return [file_path]
+    pixel_width = width * VARIANT_SCALE
+    quality = quality or VARIANT_QUALITY
+
+    def build():
+        try:
+            best, fallback = build_variant(file_path, pixel_width, quality)
+        except (OSError, ValueError):
+            return file_path
+        return fallback if best == fallback else f"{best}\n{fallback}"
+
+    key = f"variant:{file_path}:{pixel_width}:{_quality_tag(quality)}"
+    return asset_cache.get_derived(key, [file_path], build).split('\n')
+
+
+def optimized_path(file_path, width=None, quality=None):
+    """
+    Return the path of the smallest variant of an image sized for the given
+    display width that every browser can display, for places that cannot
+    offer a fallback (st.image, a single data URI).
+    """
+    return optimized_variants(file_path, width, quality)[-1]
+
+
+def serving_mode():
+    """
+    Return 'static' if assets should be served by URL, otherwise 'inline'.
+    """
+    if ASSET_SERVING in ('static', 'inline'):
+        return ASSET_SERVING
+    try:
+        enabled = st.get_option('server.enableStaticServing')
+    except Exception:
+        enabled = False
+    return 'static' if enabled else 'inline'
+
+
+def publish_static(file_path):
+    """
+    Copy a file into the static folder under a content-hashed name and return
+    its URL. The name changes whenever the content does, so the URL can be
+    cached by the browser indefinitely.
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    stem, ext = os.path.splitext(os.path.basename(file_path))
+    name = f"{stem}.{digest}{ext}"
+    target_dir = os.path.join(STATIC_ROOT, STATIC_ASSET_DIR)
+    target = os.path.join(target_dir, name)
+    if not os.path.exists(target):
+        os.makedirs(target_dir, exist_ok=True)
+        # Write to a temp file first so concurrent sessions never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=target_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, target)
+        except OSError:
+            # Don't leave a partial copy behind, e.g. when the disk filled up mid-write
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return f"app/static/{STATIC_ASSET_DIR}/{name}"
+
+
+def _serve(file_path):
+    fingerprint = file_fingerprint(file_path)
+    if fingerprint is None:
+        return ''
+    if serving_mode() == 'static' and fingerprint[2] > INLINE_MAX_BYTES:
+
+        def publish():
+            try:
+                return publish_static(file_path)
+            except OSError:
+                # Cached as '' until the file changes, so a failed copy is not retried on every rerun
+                return ''
+
+        url = asset_cache.get_derived(f"url:{file_path}", [file_path], publish)
+        if url:
+            return url
+    return f"data:{_mime_type(file_path)};base64,{asset_cache.get_base64(file_path)}"
+
+
+def _mime_type(file_path):
+    return mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+
+
+def asset_url(file_path, width=None, quality=None):
+    """
+    Return a URL for an image that can be used in HTML or CSS.
+
+    The image is first swapped for a variant sized for the display width, in a
+    format every browser can display. In static mode this is a content-hashed
+    app/static/ URL; tiny assets, inline mode and a static folder that cannot
+    be written (read-only deploy, full disk) fall back to a base64 data URI.
+    """
+    return _serve(optimized_path(file_path, width, quality))
+
+
+def asset_sources(file_path, width=None, quality=None):
+    """
+    Return (url, mime type) pairs for an image, preferred first and ending with
+    one every browser can display. Inline mode only returns that last one: a
+    page embedding both would send the bytes of both.
+    """
+    paths = optimized_variants(file_path, width, quality)
+    if serving_mode() != 'static':
+        paths = paths[-1:]
+    return [(_serve(path), _mime_type(path)) for path in paths]
+
+
+def picture_html(file_path, width, quality=None):
+    """
+    Return a <picture> element showing an image at the given CSS width; the
+    browser picks the first source it supports and otherwise shows the <img>.
+    """
+    *preferred, (url, _) = asset_sources(file_path, width, quality)
+    sources = ''.join(f"<source srcset='{src}' type='{mime}'>" for src, mime in preferred)
+    return f"<picture>{sources}<img src='{url}' width='{width}'></picture>"
+
+
+def background_css(file_path, width, quality=None):
+    """
+    Return CSS declarations for a background image. Browsers that do not
+    understand image-set() with type() drop that declaration and keep the plain
+    url() before it.
+    """
+    sources = asset_sources(file_path, width, quality)
+    css = f"background-image: url('{sources[-1][0]}');"
+    if len(sources) > 1:
+        options = ', '.join(f"url('{src}') type('{mime}')" for src, mime in sources)
+        css += f"\n        background-image: image-set({options});"
+    return css
@@ -0,0 +1,576 @@
+import base64
+import csv
+import hashlib
+import io
+import math
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zipfile
+from collections import Counter
+from xml.etree.ElementTree import fromstring, iterparse
+
+from knowledge import BM25_B, BM25_K1, tokenize
+
+# On-disk location of the attachment store
+ATTACHMENTS_DB_PATH = os.environ.get(
+    'ATTACHMENTS_DB_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'attachments.sqlite3'),
+)
+
+# File types that can be attached to a conversation
+ATTACHMENT_TYPES = ('bas', 'cls', 'xlsm', 'xlsx', 'pq', 'm', 'csv')
+
+# Largest file accepted, and most rows read from one CSV file or worksheet
+ATTACHMENT_MAX_BYTES = int(os.environ.get('ATTACHMENT_MAX_BYTES', 50 * 1024 * 1024))
+ATTACHMENT_MAX_ROWS = int(os.environ.get('ATTACHMENT_MAX_ROWS', 20000))
+
+# Most characters of a workbook's shared string table kept in memory while its sheets are read
+ATTACHMENT_MAX_STRING_CHARS = int(os.environ.get('ATTACHMENT_MAX_STRING_CHARS', 4 * 1024 * 1024))
+
+# Parts of the attached files added to a question, and the minimum BM25 score for a part to count
+ATTACHMENT_TOP_K = int(os.environ.get('ATTACHMENT_TOP_K', 4))
+ATTACHMENT_MIN_SCORE = float(os.environ.get('ATTACHMENT_MIN_SCORE', 1.0))
+
+# Attachments unused this long are dropped from their session, and files no session uses are deleted
+ATTACHMENT_RETENTION_SECONDS = int(os.environ.get('ATTACHMENT_RETENTION_SECONDS', 90 * 24 * 60 * 60))
+
+# Target size of a part, in characters
+CHUNK_CHARS = 1500
+
+# Bytes read at a time while hashing, and parts written to the store at a time while ingesting
+_BLOCK_BYTES = 64 * 1024
+_WRITE_BATCH = 200
+
+_VBA_PROCEDURE_RE = re.compile(
+    r"^\s*(?:(?:Public|Private|Friend)\s+)?(?:Static\s+)?(Sub|Function|Property\s+(?:Get|Let|Set))\s+(\w+)",
+    re.IGNORECASE,
+)
+# A query of a section document (shared Sales = ...) or a step of a let expression (#"Changed Type" = ...)
+_M_STEP_RE = re.compile(r'^\s*(shared\s+)?(#"[^"]+"|[A-Za-z_][\w.]*)\s*=(?!=)')
+# Questions about "the attached file" or "this macro" get the start of the latest file if nothing else matches
+_REFERS_TO_ATTACHMENT_RE = re.compile(
+    r"\b(attach\w*|upload\w*|(this|the|my) (file|macro|module|script|query|workbook|sheet|code|csv))\b",
+    re.IGNORECASE,
+)
+_XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+def fingerprint(stream):
+    """
+    Return the SHA-256 and size of a binary stream, read in blocks.
+    """
+    digest, size = hashlib.sha256(), 0
+    for block in iter(lambda: stream.read(_BLOCK_BYTES), b''):
+        digest.update(block)
+        size += len(block)
+    return digest.hexdigest(), size
+
+
+def _text_stream(stream, newline=None):
+    """
+    Wrap a binary stream for reading text line by line. UTF-8 if the start of
+    the file is valid UTF-8, otherwise Windows-1252 (what the VBA editor exports).
+    """
+    start = stream.read(_BLOCK_BYTES)
+    stream.seek(0)
+    try:
+        # A character cut off at the end of the block is not an error
+        start.decode('utf-8')
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError as e:
+        encoding = 'utf-8-sig' if e.start >= len(start) - 3 else 'cp1252'
+    return io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline=newline)
+
+
+def _chunk_lines(lines, boundary=None, label=None):
+    """
+    Group lines into parts of about CHUNK_CHARS, yielding (title, text). A
+    part ends early before a line matching `boundary` (a new procedure or
+    query step) once it is half full; label(match) names the part.
+    """
+    current, size, title, last = [], 0, None, None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        match = boundary.match(line) if boundary is not None else None
+        if current and (size + len(line) > CHUNK_CHARS or (match and size > CHUNK_CHARS // 2)):
+            yield title or (f"{last} (continued)" if last else None), '\n'.join(current)
+            current, size, title = [], 0, None
+        if match and label is not None:
+            last = label(match)
+            title = title or last
+        # A single very long line (minified data, a huge formula) is cut into several parts
+        while len(line) > CHUNK_CHARS:
+            yield title or last, line[:CHUNK_CHARS]
+            line = line[CHUNK_CHARS:]
+        current.append(line)
+        size += len(line) + 1
+    if current and any(line.strip() for line in current):
+        yield title or (f"{last} (continued)" if last else None), '\n'.join(current)
+
+
+def _vba_chunks(lines):
+    return _chunk_lines(lines, _VBA_PROCEDURE_RE, lambda m: f"{m.group(1).title()} {m.group(2)}")
+
+
+def _m_chunks(lines):
+    return _chunk_lines(lines, _M_STEP_RE, lambda m: ('query ' if m.group(1) else 'step ') + m.group(2))
+
+
+def _row_chunks(rows, info, name=''):
+    """
+    Group table rows into parts of about CHUNK_CHARS as CSV text, with the
+    header row repeated at the top of each part. Reads at most
+    ATTACHMENT_MAX_ROWS rows.
+    """
+    prefix = f"{name}, " if name else ''
+    header, current, size, first = None, [], 0, 1
+    for number, row in enumerate(rows):
+        line = _csv_line(row)[:CHUNK_CHARS]
+        if header is None:
+            header = line[:CHUNK_CHARS // 2]
+            continue
+        if number > ATTACHMENT_MAX_ROWS:
+            info['notes'].append(f"{prefix}only the first {ATTACHMENT_MAX_ROWS:,} rows were read")
+            break
+        if current and size + len(line) > CHUNK_CHARS:
+            yield f"{prefix}rows {first}-{number - 1}", '\n'.join([header] + current)
+            current, size, first = [], 0, number
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        yield f"{prefix}rows {first}-{first + len(current) - 1}", '\n'.join([header] + current)
+
+
+def _csv_line(row):
+    output = io.StringIO()
+    csv.writer(output, lineterminator='').writerow(row)
+    return output.getvalue()
+
+
+def _column_index(reference):
+    # "AB12" -> 27
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+def _shared_strings(archive, info):
+    """
+    Return the workbook's shared string table, up to ATTACHMENT_MAX_STRING_CHARS
+    characters in all. Cells referring to strings past the limit are left empty.
+    """
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings, chars = [], 0
+    with archive.open('xl/sharedStrings.xml') as f:
+        for _, elem in iterparse(f):
+            if elem.tag == f"{_XLSX_NS}si":
+                text = ''.join(t.text or '' for t in elem.iter(f"{_XLSX_NS}t"))
+                elem.clear()
+                chars += len(text)
+                if chars > ATTACHMENT_MAX_STRING_CHARS:
+                    info['notes'].append(
+                        f"only the first {len(strings):,} shared strings were read; later text cells are empty"
+                    )
+                    break
+                strings.append(text)
+    return strings
+
+
+def _sheet_paths(archive):
+    """
+    Return (sheet name, part path) pairs in workbook order.
+    """
+    targets = {}
+    for rel in fromstring(archive.read('xl/_rels/workbook.xml.rels')).iter(f"{_PKG_REL_NS}Relationship"):
+        target = rel.get('Target')
+        targets[rel.get('Id')] = target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+    workbook = fromstring(archive.read('xl/workbook.xml'))
+    return [
+        (sheet.get('name'), targets.get(sheet.get(f"{_REL_NS}id")))
+        for sheet in workbook.iter(f"{_XLSX_NS}sheet")
+    ]
+
+
+def _sheet_rows(archive, path, strings):
+    """
+    Yield the rows of a worksheet as lists of strings, parsing its XML
+    incrementally. Cells with a formula show the formula.
+    """
+    with archive.open(path) as f:
+        for _, elem in iterparse(f):
+            if elem.tag != f"{_XLSX_NS}row":
+                continue
+            cells = {}
+            for cell in elem.iter(f"{_XLSX_NS}c"):
+                formula = cell.find(f"{_XLSX_NS}f")
+                value = cell.find(f"{_XLSX_NS}v")
+                kind = cell.get('t')
+                if formula is not None and formula.text:
+                    text = f"={formula.text}"
+                elif kind == 'inlineStr':
+                    text = ''.join(t.text or '' for t in cell.iter(f"{_XLSX_NS}t"))
+                elif value is None or value.text is None:
+                    continue
+                elif kind == 's':
+                    index = int(value.text)
+                    text = strings[index] if index < len(strings) else ''
+                elif kind == 'b':
+                    text = 'TRUE' if value.text == '1' else 'FALSE'
+                else:
+                    text = value.text
+                cells[_column_index(cell.get('r', 'A'))] = text
+            elem.clear()
+            if cells:
+                yield [cells.get(i, '') for i in range(max(cells) + 1)]
+
+
+def _power_queries(archive):
+    """
+    Yield the M code of the Power Queries stored in a workbook (its DataMashup part).
+    """
+    for name in archive.namelist():
+        if not (name.startswith('customXml/item') and name.endswith('.xml')):
+            continue
+        root = fromstring(archive.read(name))
+        if not root.tag.endswith('DataMashup') or not root.text:
+            continue
+        data = base64.b64decode(root.text)
+        # Version, then the length of the package part: a zip holding Formulas/Section1.m
+        length = struct.unpack_from('<I', data, 4)[0]
+        with zipfile.ZipFile(io.BytesIO(data[8:8 + length])) as package:
+            for formula in package.namelist():
+                if formula.startswith('Formulas/') and formula.endswith('.m'):
+                    yield formula[len('Formulas/'):], package.read(formula).decode('utf-8-sig', errors='replace')
+
+
+def _vba_modules(archive, info):
+    """
+    Yield (module name, code) for the VBA project of a macro workbook. Needs
+    the optional oletools package to decompress the project.
+    """
+    if 'xl/vbaProject.bin' not in archive.namelist():
+        return
+    try:
+        from oletools.olevba import VBA_Parser
+    except ImportError:
+        info['notes'].append("VBA modules were skipped (install oletools, or attach the exported .bas files)")
+        return
+    parser = VBA_Parser('vbaProject.bin', data=archive.read('xl/vbaProject.bin'))
+    try:
+        for _, _, module, code in parser.extract_macros():
+            yield module, code if isinstance(code, str) else code.decode('cp1252', errors='replace')
+    finally:
+        parser.close()
+
+
+def _workbook_chunks(stream, info):
+    with zipfile.ZipFile(stream) as archive:
+        for module, code in _vba_modules(archive, info):
+            for title, text in _vba_chunks(io.StringIO(code)):
+                yield f"VBA {module} › {title}" if title else f"VBA {module}", text
+        for query, code in _power_queries(archive):
+            for title, text in _m_chunks(io.StringIO(code)):
+                yield f"Power Query {query} › {title}" if title else f"Power Query {query}", text
+        strings = _shared_strings(archive, info)
+        for sheet, path in _sheet_paths(archive):
+            if path in archive.namelist():
+                yield from _row_chunks(_sheet_rows(archive, path, strings), info, f"sheet {sheet}")
+
+
+def parse_chunks(kind, stream, info):
+    """
+    Yield (title, text) parts of an attached file, reading it incrementally.
+    Notes about what was left out are appended to info['notes'].
+    """
+    if kind in ('xlsm', 'xlsx'):
+        yield from _workbook_chunks(stream, info)
+        return
+    text = _text_stream(stream, newline='' if kind == 'csv' else None)
+    try:
+        if kind == 'csv':
+            yield from _row_chunks(csv.reader(text), info)
+        elif kind in ('pq', 'm'):
+            yield from _m_chunks(text)
+        else:
+            yield from _vba_chunks(text)
+    finally:
+        # Leave the caller's stream open
+        text.detach()
+
+
+class AttachmentStore:
+    """
+    Files attached to conversations, stored once outside them.
+
+    An upload is hashed first: content that is already stored (the same
+    file attached again, or by another session) is only linked to the
+    session. New content is parsed incrementally into parts, which are
+    written in batches with an inverted index, so neither the file nor its
+    parts are held in memory. Part texts are stored by their own hash, so a
+    module that appears in several files is stored once. Each question then
+    carries only the parts most relevant to it (BM25 over the session's files).
+    """
+
+    def __init__(self, path=ATTACHMENTS_DB_PATH):
+        self.path = path
+        self.uploads = 0
+        self.duplicates = 0
+        self.searches = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        # Caller must hold self._lock
+        if self._conn is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                ' hash TEXT PRIMARY KEY, kind TEXT NOT NULL, size INTEGER NOT NULL,'
+                " chunks INTEGER NOT NULL, notes TEXT NOT NULL DEFAULT '', created REAL NOT NULL)"
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS file_chunks ('
+                ' file_hash TEXT NOT NULL, number INTEGER NOT NULL, digest TEXT NOT NULL,'
+                ' title TEXT NOT NULL, length INTEGER NOT NULL, PRIMARY KEY (file_hash, number))'
+            )
+            self._conn.execute('CREATE TABLE IF NOT EXISTS chunk_texts (digest TEXT PRIMARY KEY, text TEXT NOT NULL)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS postings ('
+                ' term TEXT NOT NULL, file_hash TEXT NOT NULL, number INTEGER NOT NULL, count INTEGER NOT NULL,'
+                ' PRIMARY KEY (term, file_hash, number)) WITHOUT ROWID'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS postings_file ON postings (file_hash)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS session_files ('
+                ' session_id TEXT NOT NULL, file_hash TEXT NOT NULL, name TEXT NOT NULL,'
+                ' last_used REAL NOT NULL, PRIMARY KEY (session_id, file_hash))'
+            )
+        return self._conn
+
+    def attach(self, session_id, name, stream):
+        """
+        Attach an uploaded file (a binary, seekable stream) to a session.
+        Returns (attachment, new), where new is False if the content was
+        already stored. Raises ValueError for unsupported or oversized files.
+        """
+        kind = os.path.splitext(name)[1].lower().lstrip('.')
+        if kind not in ATTACHMENT_TYPES:
+            raise ValueError(f"{name}: only {', '.join(ATTACHMENT_TYPES)} files can be attached.")
+        file_hash, size = fingerprint(stream)
+        if size > ATTACHMENT_MAX_BYTES:
+            raise ValueError(f"{name} is larger than {ATTACHMENT_MAX_BYTES // (1024 * 1024)} MB.")
+        with self._lock:
+            new = self._connect().execute('SELECT 1 FROM files WHERE hash = ?', (file_hash,)).fetchone() is None
+            self.uploads += 1
+            self.duplicates += int(not new)
+        if new:
+            stream.seek(0)
+            try:
+                self._ingest(file_hash, kind, size, stream)
+            except Exception as e:
+                # Whatever a damaged, encrypted or unusual file makes the parsers raise
+                # (malformed XML, corrupt or truncated parts, unsupported compression...)
+                raise ValueError(f"{name} could not be read: {e}") from e
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO session_files VALUES (?, ?, ?, ?)', (session_id, file_hash, name, now))
+            conn.commit()
+        return self._attachment(session_id, file_hash), new
+
+    def _ingest(self, file_hash, kind, size, stream):
+        info = {'notes': []}
+        number, batch = 0, []
+        try:
+            for title, text in parse_chunks(kind, stream, info):
+                batch.append((number, title or f"part {number + 1}", text))
+                number += 1
+                if len(batch) >= _WRITE_BATCH:
+                    self._write_chunks(file_hash, batch)
+                    batch = []
+            self._write_chunks(file_hash, batch)
+        except BaseException:
+            self._discard_partial(file_hash)
+            raise
+        with self._lock:
+            conn = self._connect()
+            # Written last: parts of a file are only used once it is complete
+            conn.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                (file_hash, kind, size, number, '; '.join(info['notes']), time.time()),
+            )
+            conn.commit()
+
+    def _discard_partial(self, file_hash):
+        """
+        Delete the parts written for a file whose ingestion failed. They have
+        no files row, so detach() would never find them.
+        """
+        with self._lock:
+            conn = self._connect()
+            # Another session may have stored the same content completely in the meantime
+            if conn.execute('SELECT 1 FROM files WHERE hash = ?', (file_hash,)).fetchone() is not None:
+                return
+            conn.execute('DELETE FROM postings WHERE file_hash = ?', (file_hash,))
+            conn.execute('DELETE FROM file_chunks WHERE file_hash = ?', (file_hash,))
+            conn.execute('DELETE FROM chunk_texts WHERE digest NOT IN (SELECT digest FROM file_chunks)')
+            conn.commit()
+
+    def _write_chunks(self, file_hash, batch):
+        chunks, texts, postings = [], [], []
+        for number, title, text in batch:
+            digest = hashlib.sha256(text.encode()).hexdigest()
+            counts = Counter(tokenize(f"{title}\n{text}"))
+            chunks.append((file_hash, number, digest, title, sum(counts.values())))
+            texts.append((digest, text))
+            postings.extend((term, file_hash, number, count) for term, count in counts.items())
+        with self._lock:
+            conn = self._connect()
+            # OR IGNORE: the same file may be ingested by two sessions at once
+            conn.executemany('INSERT OR IGNORE INTO file_chunks VALUES (?, ?, ?, ?, ?)', chunks)
+            conn.executemany('INSERT OR IGNORE INTO chunk_texts VALUES (?, ?)', texts)
+            conn.executemany('INSERT OR IGNORE INTO postings VALUES (?, ?, ?, ?)', postings)
+            conn.commit()
+
+    def _attachment(self, session_id, file_hash):
+        return next(a for a in self.attachments(session_id) if a['hash'] == file_hash)
+
+    def attachments(self, session_id):
+        """
+        Return the files attached to a session, in the order they were attached.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT s.file_hash, s.name, f.kind, f.size, f.chunks, f.notes FROM session_files s'
+                ' JOIN files f ON f.hash = s.file_hash WHERE s.session_id = ? ORDER BY s.rowid',
+                (session_id,),
+            ).fetchall()
+        return [
+            {'hash': h, 'name': name, 'kind': kind, 'size': size, 'chunks': chunks, 'notes': notes}
+            for h, name, kind, size, chunks, notes in rows
+        ]
+
+    def fingerprint(self, session_id):
+        """
+        Return a short hash of the files attached to a session ('' if none),
+        so cached answers are only reused with the same attachments.
+        """
+        with self._lock:
+            hashes = sorted(r[0] for r in self._connect().execute(
+                'SELECT file_hash FROM session_files WHERE session_id = ?', (session_id,)))
+        return hashlib.sha256(' '.join(hashes).encode()).hexdigest()[:16] if hashes else ''
+
+    def search(self, session_id, query, top_k=ATTACHMENT_TOP_K, min_score=ATTACHMENT_MIN_SCORE):
+        """
+        Return up to top_k (score, part) pairs of the session's files for the
+        query, best first. Each part is a dict with a title and its text.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            conn = self._connect()
+            files = dict(conn.execute(
+                'SELECT s.file_hash, s.name FROM session_files s JOIN files f ON f.hash = s.file_hash'
+                ' WHERE s.session_id = ? ORDER BY s.rowid', (session_id,)))
+            if not files:
+                return []
+            self.searches += 1
+            marks = ','.join('?' * len(files))
+            total, average = conn.execute(
+                f'SELECT COUNT(*), AVG(length) FROM file_chunks WHERE file_hash IN ({marks})', list(files)
+            ).fetchone()
+            scores = {}
+            for term in terms:
+                rows = conn.execute(
+                    'SELECT p.file_hash, p.number, p.count, c.length FROM postings p JOIN file_chunks c'
+                    ' ON c.file_hash = p.file_hash AND c.number = p.number'
+                    f' WHERE p.term = ? AND p.file_hash IN ({marks})',
+                    [term] + list(files),
+                ).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+                for file_hash, number, count, length in rows:
+                    norm = count + BM25_K1 * (1 - BM25_B + BM25_B * length / (average or 1.0))
+                    scores[file_hash, number] = scores.get((file_hash, number), 0.0) + idf * count * (BM25_K1 + 1) / norm
+            if total <= top_k:
+                # Small enough to send whole; scores on so few parts say little about relevance
+                parts = conn.execute(
+                    f'SELECT file_hash, number FROM file_chunks WHERE file_hash IN ({marks})', list(files)
+                ).fetchall()
+                best = sorted(((scores.get(tuple(k), 0.0), tuple(k)) for k in parts), reverse=True)
+            else:
+                best = sorted(((s, k) for k, s in scores.items() if s >= min_score), reverse=True)[:top_k]
+            if not best and _REFERS_TO_ATTACHMENT_RE.search(query):
+                # "Explain the attached macro": start of the latest file
+                latest = list(files)[-1]
+                best = [(0.0, (latest, number)) for number in range(min(top_k, total))]
+            results = []
+            for score, (file_hash, number) in best:
+                row = conn.execute(
+                    'SELECT c.title, t.text FROM file_chunks c JOIN chunk_texts t ON t.digest = c.digest'
+                    ' WHERE c.file_hash = ? AND c.number = ?', (file_hash, number),
+                ).fetchone()
+                if row is not None:
+                    results.append((score, {'title': f"{files[file_hash]} › {row[0]}", 'text': row[1]}))
+            conn.execute('UPDATE session_files SET last_used = ? WHERE session_id = ?', (time.time(), session_id))
+            conn.commit()
+        return results
+
+    def detach(self, session_id, file_hash=None):
+        """
+        Remove one file (or all files) from a session; content no session uses any more is deleted.
+        """
+        with self._lock:
+            conn = self._connect()
+            if file_hash is None:
+                conn.execute('DELETE FROM session_files WHERE session_id = ?', (session_id,))
+            else:
+                conn.execute('DELETE FROM session_files WHERE session_id = ? AND file_hash = ?', (session_id, file_hash))
+            conn.execute('DELETE FROM session_files WHERE last_used < ?', (time.time() - ATTACHMENT_RETENTION_SECONDS,))
+            for (orphan,) in conn.execute(
+                    'SELECT hash FROM files WHERE hash NOT IN (SELECT file_hash FROM session_files)').fetchall():
+                conn.execute('DELETE FROM postings WHERE file_hash = ?', (orphan,))
+                conn.execute('DELETE FROM file_chunks WHERE file_hash = ?', (orphan,))
+                conn.execute('DELETE FROM files WHERE hash = ?', (orphan,))
+            conn.execute('DELETE FROM chunk_texts WHERE digest NOT IN (SELECT digest FROM file_chunks)')
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            files, chunks = self._connect().execute(
+                'SELECT COUNT(*), COALESCE(SUM(chunks), 0) FROM files').fetchone()
+            return {
+                'files': files,
+                'chunks': chunks,
+                'uploads': self.uploads,
+                'duplicate_uploads': self.duplicates,
+                'searches': self.searches,
+            }
+
+
+def with_attachments(prompt, results):
+    """
+    Return the prompt prefixed with the relevant parts of the attached files.
+    """
+    excerpts = '\n\n'.join(f"From {chunk['title']}:\n{chunk['text']}" for _, chunk in results)
+    return (
+        "Excerpts from the files attached to this conversation (the parts relevant to the question):\n\n"
+        f"{excerpts}\n\n---\n\n{prompt}"
+    )
+
+
+# Shared instance used by every session in this process
+attachment_store = AttachmentStore()
@@ -0,0 +1,289 @@
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+from context_cache import context_cache
+from model_pool import MODEL_NAME, STRONG_MODEL_NAME, key_id, model_pool
+
+# Which backend answers chat requests: 'gemini' (the real API) or 'fake' (local stand-in)
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'gemini')
+
+# Model tiers the router chooses between
+FAST_TIER = 'fast'
+STRONG_TIER = 'strong'
+
+# Errors after which a key's cached server-side state is dropped: the key was
+# rejected, or the request named a cached context or model the service no longer
+# accepts. Timeouts and quota errors leave the cache alone.
+INVALIDATING_ERRORS = (
+    google_exceptions.Unauthenticated,
+    google_exceptions.PermissionDenied,
+    google_exceptions.NotFound,
+    google_exceptions.InvalidArgument,
+    google_exceptions.FailedPrecondition,
+)
+
+# Simulated behaviour of the fake backend
+FAKE_FIRST_TOKEN_SECONDS = float(os.environ.get('FAKE_FIRST_TOKEN_SECONDS', 0.4))
+FAKE_CHUNK_INTERVAL_SECONDS = float(os.environ.get('FAKE_CHUNK_INTERVAL_SECONDS', 0.05))
+FAKE_CHUNKS = int(os.environ.get('FAKE_CHUNKS', 20))
+FAKE_ERROR_RATE = float(os.environ.get('FAKE_ERROR_RATE', 0.0))
+FAKE_SEED = int(os.environ.get('FAKE_SEED', 0))
+# The fake strong tier is this many times slower than the fast one
+FAKE_STRONG_SLOWDOWN = float(os.environ.get('FAKE_STRONG_SLOWDOWN', 2.5))
+# Simulated connection setup, paid by the first request of each key unless warmed up
+FAKE_CONNECT_SECONDS = float(os.environ.get('FAKE_CONNECT_SECONDS', 0.3))
+
+
+class ModelBackend:
+    """
+    Interface between the chat pipeline and a model provider.
+
+    get_model() returns an object with generate_content(contents, stream=...,
+    request_options=...) returning a response in the google.generativeai
+    shape: iterable chunks with .text when streaming, and .text plus
+    .usage_metadata on the response.
+    """
+
+    name = None
+    model_name = None
+    # Model name per tier
+    tiers = {}
+
+    def __init__(self):
+        self.warm_ups = 0
+        self._warmed = set()
+        self._warm_lock = threading.Lock()
+
+    def get_model(self, api_key, system_prompt, tier=FAST_TIER):
+        """
+        Return (model, cache_mode) for an API key with the given system prompt,
+        using the model of the given tier.
+        """
+        raise NotImplementedError
+
+    def validate_key(self, api_key, timeout):
+        """
+        Check an API key cheaply; raise if it is rejected or the check fails.
+        """
+        raise NotImplementedError
+
+    def invalidate(self, api_key):
+        """
+        Forget cached server-side state for a key after a failed request.
+        """
+
+    def discard(self, api_key):
+        """
+        Release clients held for a key, e.g. after it failed validation.
+        """
+
+    def warm_up(self, api_key, system_prompt):
+        """
+        Prepare for the first question of a key: create its client and model
+        handle and open the connection, so the question does not pay for it.
+        """
+
+    def start_warm_up(self, api_key, system_prompt):
+        """
+        Run warm_up() on a background thread, once per key and process.
+        """
+        ident = key_id(api_key)
+        with self._warm_lock:
+            if ident in self._warmed:
+                return
+            self._warmed.add(ident)
+        threading.Thread(
+            target=self._warm_up_quietly, args=(api_key, system_prompt, ident), name='warm-up', daemon=True
+        ).start()
+
+    def _warm_up_quietly(self, api_key, system_prompt, ident):
+        try:
+            self.warm_up(api_key, system_prompt)
+            self.warm_ups += 1
+        except Exception:
+            # Nothing is lost: the first question sets everything up as before
+            with self._warm_lock:
+                self._warmed.discard(ident)
+
+
+class GeminiBackend(ModelBackend):
+    """
+    Google Gemini through google.generativeai, using the pooled per-key
+    clients and the system prompt context cache.
+    """
+
+    name = 'gemini'
+    model_name = MODEL_NAME
+    tiers = {FAST_TIER: MODEL_NAME, STRONG_TIER: STRONG_MODEL_NAME}
+
+    def get_model(self, api_key, system_prompt, tier=FAST_TIER):
+        return context_cache.get_model(api_key, system_prompt, self.tiers[tier])
+
+    def validate_key(self, api_key, timeout):
+        model_pool.get_client(api_key, 'model').get_model(
+            name=f"models/{self.model_name}", timeout=timeout, retry=None
+        )
+
+    def invalidate(self, api_key):
+        context_cache.invalidate(api_key)
+
+    def discard(self, api_key):
+        model_pool.discard(api_key)
+
+    def warm_up(self, api_key, system_prompt):
+        model, _ = context_cache.get_model(api_key, system_prompt, self.model_name)
+        # Counting tokens is free and opens the connection to the generation service
+        model.count_tokens('warm-up', request_options={'timeout': 10, 'retry': None})
+
+
+class _FakeUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.cached_content_token_count = 0
+
+
+class _FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeResponse:
+    def __init__(self, chunks, usage, sleep, first_delay, interval):
+        self._chunks = chunks
+        self._sleep = sleep
+        self._first_delay = first_delay
+        self._interval = interval
+        self.usage_metadata = usage
+
+    def __iter__(self):
+        for i, chunk in enumerate(self._chunks):
+            self._sleep(self._first_delay if i == 0 else self._interval)
+            yield _FakeChunk(chunk)
+
+    @property
+    def text(self):
+        return ''.join(self._chunks)
+
+
+class FakeModel:
+    """
+    Deterministic stand-in for a GenerativeModel. The answer is derived from a
+    hash of the request, so the same question always gets the same answer.
+    """
+
+    def __init__(self, backend, api_key, system_prompt, slowdown=1.0):
+        self.backend = backend
+        self.api_key = api_key
+        self.system_prompt = system_prompt
+        self.slowdown = slowdown
+
+    def generate_content(self, contents, stream=False, request_options=None):
+        backend = self.backend
+        backend.connect(self.api_key)
+        backend.maybe_fail()
+        if isinstance(contents, str):
+            texts = [contents]
+        else:
+            texts = [''.join(part.text for part in content.parts) for content in contents]
+        question = texts[-1] if texts else ''
+        digest = hashlib.sha256('\0'.join(texts).encode()).hexdigest()
+        words = [f"Simulated answer {digest[:8]} to: {question[:80]}"]
+        words += [f"step-{digest[i % 56:i % 56 + 8]}" for i in range(backend.chunks * 4)]
+        per_chunk = max(1, math.ceil(len(words) / backend.chunks))
+        chunks = [' '.join(words[i:i + per_chunk]) + ' ' for i in range(0, len(words), per_chunk)]
+        prompt_chars = len(self.system_prompt or '') + sum(len(t) for t in texts)
+        usage = _FakeUsage(math.ceil(prompt_chars / 4), math.ceil(sum(len(c) for c in chunks) / 4))
+        first_token = backend.first_token_seconds * self.slowdown
+        interval = backend.chunk_interval * self.slowdown
+        if stream:
+            return _FakeResponse(chunks, usage, backend.sleep, first_token, interval)
+        # Non-streaming calls wait for the whole answer before returning
+        backend.sleep(first_token + interval * (len(chunks) - 1))
+        return _FakeResponse(chunks, usage, lambda seconds: None, 0, 0)
+
+
+class FakeBackend(ModelBackend):
+    """
+    Offline backend simulating connection setup, first-token latency,
+    streaming chunk timing and an error rate, for load and latency
+    benchmarks without a network.
+    Randomness comes from a seeded generator, so runs are reproducible.
+    """
+
+    name = 'fake'
+    model_name = 'fake-fast'
+    tiers = {FAST_TIER: 'fake-fast', STRONG_TIER: 'fake-strong'}
+
+    def __init__(self, first_token_seconds=FAKE_FIRST_TOKEN_SECONDS, chunk_interval=FAKE_CHUNK_INTERVAL_SECONDS,
+                 chunks=FAKE_CHUNKS, error_rate=FAKE_ERROR_RATE, seed=FAKE_SEED, strong_slowdown=FAKE_STRONG_SLOWDOWN,
+                 connect_seconds=FAKE_CONNECT_SECONDS, sleep=time.sleep):
+        super().__init__()
+        self.first_token_seconds = first_token_seconds
+        self.chunk_interval = chunk_interval
+        self.chunks = chunks
+        self.error_rate = error_rate
+        self.strong_slowdown = strong_slowdown
+        self.connect_seconds = connect_seconds
+        self.sleep = sleep
+        self.calls = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._connections = {}
+
+    def connect(self, api_key):
+        """
+        Simulate opening a connection for a key; later calls wait for the first one.
+        """
+        with self._lock:
+            connected = self._connections.get(key_id(api_key))
+            opening = connected is None
+            if opening:
+                connected = self._connections[key_id(api_key)] = threading.Event()
+        if opening:
+            self.sleep(self.connect_seconds)
+            connected.set()
+        connected.wait()
+
+    def maybe_fail(self):
+        with self._lock:
+            self.calls += 1
+            roll = self._random.random()
+            if roll >= self.error_rate:
+                return
+            self.errors += 1
+        # Split simulated failures between quota errors and server errors
+        if roll < self.error_rate / 2:
+            raise google_exceptions.ResourceExhausted("Simulated quota exhausted")
+        raise google_exceptions.ServiceUnavailable("Simulated service unavailable")
+
+    def get_model(self, api_key, system_prompt, tier=FAST_TIER):
+        return FakeModel(self, api_key, system_prompt, self.strong_slowdown if tier == STRONG_TIER else 1.0), 'local'
+
+    def validate_key(self, api_key, timeout):
+        self.maybe_fail()
+
+    def warm_up(self, api_key, system_prompt):
+        self.connect(api_key)
+
+
+def create_backend(name=MODEL_BACKEND):
+    """
+    Return a new backend instance by name.
+    """
+    if name == 'gemini':
+        return GeminiBackend()
+    if name == 'fake':
+        return FakeBackend()
+    raise ValueError(f"Unknown model backend: {name!r}")
+
+
+# Shared instance used by every session in this process
+backend = create_backend()
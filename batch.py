@@ -0,0 +1,257 @@
+"""
+Batch mode: answer many independent questions at once.
+
+Questions come from an uploaded file or a pasted list and are dispatched
+concurrently through a bounded worker pool, each as a single-turn
+conversation with the shared system prompt. Results can be exported as CSV
+or JSON.
+
+Command line: python batch.py questions.txt [--api-key KEY] [--output results.csv]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from conversation import ContextWindow
+from generation import run_generation
+from jobs import Job
+
+# Worker threads shared by all batches in this process
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 4))
+
+# Largest number of questions accepted in one batch
+BATCH_MAX_QUESTIONS = int(os.environ.get('BATCH_MAX_QUESTIONS', 200))
+
+# Finished batches are dropped after this long
+ABANDONED_BATCH_SECONDS = 60 * 60
+
+EXPORT_FIELDS = ('index', 'question', 'status', 'answer', 'model', 'latency', 'cache', 'cost_usd', 'error')
+
+
+def parse_questions(text, filename=''):
+    """
+    Return the list of questions in a pasted list or an uploaded file.
+
+    .csv files use the 'question' column (or the first column), .json files a
+    list of strings or of objects with a 'question' key. Plain text holds one
+    question per line, or one per paragraph if it contains blank lines, so
+    multi-line questions (e.g. pasted M code) stay together.
+    """
+    filename = filename.lower()
+    if filename.endswith('.json'):
+        data = json.loads(text)
+        questions = [item['question'] if isinstance(item, dict) else item for item in data]
+    elif filename.endswith('.csv'):
+        rows = list(csv.reader(io.StringIO(text)))
+        column = 0
+        if rows and 'question' in [cell.strip().lower() for cell in rows[0]]:
+            column = [cell.strip().lower() for cell in rows[0]].index('question')
+            rows = rows[1:]
+        questions = [row[column] for row in rows if len(row) > column]
+    else:
+        text = text.replace('\r\n', '\n')
+        if '\n\n' in text.strip():
+            questions = text.split('\n\n')
+        else:
+            questions = text.split('\n')
+    return [str(q).strip() for q in questions if str(q).strip()]
+
+
+class BatchItem:
+    def __init__(self, index, question):
+        self.index = index
+        self.question = question
+        self.status = 'queued'
+        self.answer = ''
+        self.metrics = {}
+        self.job = None
+
+    def row(self):
+        return {
+            'index': self.index,
+            'question': self.question,
+            'status': self.status,
+            'answer': self.answer,
+            'model': self.metrics.get('model', ''),
+            'latency': round(self.metrics.get('total_latency', 0.0), 3),
+            'cache': self.metrics.get('response_cache', ''),
+            'cost_usd': self.metrics.get('cost_usd', 0.0),
+            'error': self.metrics.get('error') or '',
+        }
+
+
+class Batch:
+    """
+    A set of questions being answered on the batch pool. Items are updated
+    in place as they finish, so the page can show results while it runs.
+    """
+
+    def __init__(self, api_key, questions):
+        self.id = uuid.uuid4().hex
+        self.api_key = api_key
+        self.items = [BatchItem(i + 1, q) for i, q in enumerate(questions)]
+        self.created = time.monotonic()
+        self.finished = None
+        self.cancelled = False
+        self._remaining = len(self.items)
+        self._lock = threading.Lock()
+        self._done_event = threading.Event()
+        if not self.items:
+            self.finished = self.created
+            self._done_event.set()
+
+    @property
+    def done(self):
+        return self._done_event.is_set()
+
+    def wait(self, timeout=None):
+        return self._done_event.wait(timeout)
+
+    def progress(self):
+        with self._lock:
+            return len(self.items) - self._remaining, len(self.items)
+
+    def cancel(self):
+        """
+        Stop the batch: queued questions are skipped, running ones stop at their next chunk.
+        """
+        self.cancelled = True
+        for item in self.items:
+            if item.job is not None:
+                item.job.cancel()
+
+    def rows(self):
+        return [item.row() for item in self.items]
+
+    def _run_item(self, item):
+        if self.cancelled:
+            item.status = 'cancelled'
+        else:
+            item.status = 'running'
+            item.job = Job(self.id)
+            context = ContextWindow()
+            context.append('user', item.question)
+            try:
+                # Each question is answered on its own, without a conversation before it
+                run_generation(item.job, self.api_key, context, stream=False)
+                item.answer = item.job.text
+                item.metrics = item.job.metrics
+                if item.job.cancelled:
+                    item.status = 'cancelled'
+                else:
+                    item.status = 'error' if item.metrics.get('error') else 'done'
+            except Exception as e:
+                item.answer = f"Error: {e}"
+                item.metrics = {'error': type(e).__name__}
+                item.status = 'error'
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining == 0:
+                self.finished = time.monotonic()
+                self._done_event.set()
+
+    def to_csv(self):
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(self.rows())
+        return output.getvalue()
+
+    def to_json(self):
+        return json.dumps(self.rows(), indent=2, ensure_ascii=False)
+
+
+class BatchRunner:
+    """
+    Bounded worker pool shared by every batch in the process. Calls still go
+    through the scheduler, so batches respect the per-key rate limit.
+    """
+
+    def __init__(self, workers=BATCH_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch')
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def submit(self, api_key, questions):
+        """
+        Start answering questions and return the Batch.
+        """
+        if len(questions) > BATCH_MAX_QUESTIONS:
+            raise ValueError(f"A batch can hold at most {BATCH_MAX_QUESTIONS} questions, got {len(questions)}.")
+        batch = Batch(api_key, questions)
+        with self._lock:
+            self._purge_abandoned()
+            self._batches[batch.id] = batch
+        for item in batch.items:
+            self._executor.submit(batch._run_item, item)
+        return batch
+
+    def get(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def _purge_abandoned(self):
+        cutoff = time.monotonic() - ABANDONED_BATCH_SECONDS
+        for batch_id in [i for i, b in self._batches.items() if b.done and b.finished < cutoff]:
+            del self._batches[batch_id]
+
+    def stats(self):
+        with self._lock:
+            batches = list(self._batches.values())
+        return {
+            'batches': len(batches),
+            'running': sum(1 for b in batches if not b.done),
+            'questions': sum(len(b.items) for b in batches),
+        }
+
+
+# Shared instance used by every session in this process
+batch_runner = BatchRunner()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions with the CCMI assistant.")
+    parser.add_argument('questions', help="text, CSV or JSON file of questions ('-' reads stdin)")
+    parser.add_argument('--api-key', default=os.environ.get('GOOGLE_API_KEY', ''),
+                        help="Google API key (default: $GOOGLE_API_KEY)")
+    parser.add_argument('--output', help="write results here; the format follows the extension (.csv or .json)")
+    args = parser.parse_args()
+
+    try:
+        if args.questions == '-':
+            questions = parse_questions(sys.stdin.read())
+        else:
+            # utf-8-sig: Excel's "CSV UTF-8" files start with a byte order mark
+            with open(args.questions, encoding='utf-8-sig') as f:
+                questions = parse_questions(f.read(), args.questions)
+    except (ValueError, KeyError, TypeError) as e:
+        # UnicodeDecodeError and JSONDecodeError are ValueErrors too
+        parser.error(f"could not read the questions: {e}")
+    if not questions:
+        parser.error(f"no questions found in {args.questions}")
+    batch = batch_runner.submit(args.api_key, questions)
+    while not batch.wait(1):
+        finished, total = batch.progress()
+        print(f"{finished}/{total} answered", file=sys.stderr)
+
+    output = batch.to_json() if (args.output or '').lower().endswith('.json') else batch.to_csv()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
+    failed = sum(1 for item in batch.items if item.status != 'done')
+    print(f"{len(batch.items) - failed}/{len(batch.items)} answered in "
+          f"{batch.finished - batch.created:.1f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
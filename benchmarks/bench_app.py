@@ -0,0 +1,261 @@
+"""
+End-to-end load and latency benchmark of the chat app, driven headlessly
+through AppTest against the local fake model backend.
+
+Measures rerun wall time, payload bytes per rerun and memory per session as
+the conversation grows, the cost of get_base64/inject_css with a cold and a
+warm asset cache, the per-turn cost of building the model request, and turn
+latency and throughput with many sessions sending messages at once.
+Results are written as JSON so runs of different versions can be compared.
+
+Usage: python benchmarks/bench_app.py [--sessions 20] [--turns 3] [--output results.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# Never call the real API, and keep the benchmark's data out of the app's stores
+os.environ['MODEL_BACKEND'] = 'fake'
+os.environ.setdefault('RESPONSE_CACHE_PATH', ':memory:')
+os.environ.setdefault('CONVERSATION_DB_PATH', os.path.join(tempfile.mkdtemp(), 'conversations.sqlite3'))
+
+import streamlit
+from streamlit.testing.v1 import AppTest
+
+from assets import asset_cache
+from backends import backend
+from bench_rerun_payload import payload_bytes
+from conversation import ContextWindow, Message
+from jobs import job_manager
+from response_cache import response_cache
+from scheduler import scheduler
+
+MESSAGE = "To merge two tables in Power Query, use Home > Merge Queries and pick the key columns. " * 3
+
+# How often pending generations are checked while waiting for them
+POLL_SECONDS = 0.01
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+def distribution(samples):
+    """
+    Summarize latency samples (in seconds) as milliseconds.
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean_ms': milliseconds(statistics.fmean(ordered)),
+        'p50_ms': milliseconds(ordered[len(ordered) // 2]),
+        'p95_ms': milliseconds(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]),
+        'max_ms': milliseconds(ordered[-1]),
+    }
+
+
+def make_conversation(messages):
+    return [
+        Message("user" if i % 2 == 0 else "assistant", f"{i}: {MESSAGE}", i)
+        for i in range(messages)
+    ]
+
+
+def new_session(index, messages=0):
+    at = AppTest.from_file(os.path.join(ROOT, 'main.py'), default_timeout=600)
+    # Separate keys, so the per-key rate limit does not throttle the simulated users
+    at.session_state['api_key'] = f"benchmark-{index}"
+    at.session_state['conversation'] = make_conversation(messages)
+    return at
+
+
+def bench_assets():
+    """
+    Time get_base64 and inject_css on a cold and on a warm asset cache.
+    main.py is imported outside a script run, where st.* calls are no-ops.
+    """
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    import main as app
+    results = {}
+    for name, fn in (
+        ('get_base64', lambda: app.get_base64(app.BACKGROUND_IMAGE, app.BACKGROUND_WIDTH)),
+        ('inject_css', app.inject_css),
+    ):
+        asset_cache.clear()
+        start = time.perf_counter()
+        fn()
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(100):
+            fn()
+        warm = (time.perf_counter() - start) / 100
+        results[name] = {'cold_ms': milliseconds(cold), 'warm_ms': milliseconds(warm)}
+    return results
+
+
+def bench_prompt_build(lengths, repeat=200):
+    """
+    Time what send_message adds per turn: appending the new message to the
+    context window, and building the contents sent to the model.
+    """
+    results = []
+    for messages in lengths:
+        context = ContextWindow.restore(make_conversation(messages), '')
+        start = time.perf_counter()
+        for _ in range(repeat):
+            context.append('user', MESSAGE)
+        append = (time.perf_counter() - start) / repeat
+        start = time.perf_counter()
+        for _ in range(repeat):
+            context.contents()
+        contents = (time.perf_counter() - start) / repeat
+        results.append({
+            'messages': messages,
+            'append_us': round(append * 1e6, 3),
+            'contents_us': round(contents * 1e6, 3),
+        })
+    return results
+
+
+def bench_reruns(lengths, reruns=3, memory_sessions=3):
+    """
+    Rerun wall time, payload bytes and memory per session by conversation length.
+    """
+    results = []
+    for messages in lengths:
+        at = new_session(0, messages)
+        at.run()
+        start = time.perf_counter()
+        for _ in range(reruns):
+            at.run()
+        rerun = (time.perf_counter() - start) / reruns
+
+        # Memory held by live sessions: their state plus the last rendered tree
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        sessions = [new_session(i, messages) for i in range(memory_sessions)]
+        for session in sessions:
+            session.run()
+        memory = (tracemalloc.get_traced_memory()[0] - before) / memory_sessions
+        tracemalloc.stop()
+        del sessions
+
+        results.append({
+            'messages': messages,
+            'rerun_ms': milliseconds(rerun),
+            'payload_bytes': payload_bytes(at._tree),
+            'memory_bytes_per_session': int(memory),
+        })
+    return results
+
+
+def bench_load(sessions, turns, first_session=0):
+    """
+    Every session sends a message, then all answers are awaited, for `turns`
+    rounds. Generations run concurrently on the shared worker pool.
+    """
+    apps = [new_session(first_session + i) for i in range(sessions)]
+    for at in apps:
+        at.run()
+    submit_times, turn_latencies, first_tokens, collect_times = [], [], [], []
+    errors = 0
+    start = time.perf_counter()
+    for turn in range(turns):
+        pending = {}
+        for i, at in enumerate(apps):
+            submitted = time.perf_counter()
+            at.text_area[0].input(f"Session {i}, question {turn}: how do I merge two tables?").run()
+            submit_times.append(time.perf_counter() - submitted)
+            pending[i] = (job_manager.get(at.session_state['active_job']), submitted)
+        while pending:
+            for i, (job, submitted) in list(pending.items()):
+                if not job.done:
+                    continue
+                turn_latencies.append(time.perf_counter() - submitted)
+                del pending[i]
+                at = apps[i]
+                collected = time.perf_counter()
+                at.run()
+                collect_times.append(time.perf_counter() - collected)
+                last = at.session_state['conversation'][-1]
+                if last.content.startswith('Error:') or '\n\nError:' in last.content:
+                    errors += 1
+                first_tokens.append(at.session_state['turn_metrics'][-1]['time_to_first_token'])
+            time.sleep(POLL_SECONDS)
+    elapsed = time.perf_counter() - start
+    return {
+        'sessions': sessions,
+        'turns': turns,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_turns_per_s': round(sessions * turns / elapsed, 3),
+        'errors': errors,
+        'submit_rerun': distribution(submit_times),
+        'collect_rerun': distribution(collect_times),
+        'turn_latency': distribution(turn_latencies),
+        'time_to_first_token': distribution(first_tokens),
+        'scheduler': scheduler.stats(),
+        'response_cache': response_cache.stats(),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=20, help="simulated concurrent sessions")
+    parser.add_argument('--turns', type=int, default=3, help="messages sent by each session")
+    parser.add_argument('--lengths', default='10,100,1000', help="conversation lengths to measure")
+    parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+    lengths = [int(n) for n in args.lengths.split(',')]
+
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'streamlit': streamlit.__version__,
+            'backend': {
+                'name': backend.name,
+                'first_token_seconds': backend.first_token_seconds,
+                'chunk_interval_seconds': backend.chunk_interval,
+                'chunks': backend.chunks,
+                'error_rate': backend.error_rate,
+            },
+        },
+        'assets': bench_assets(),
+        'prompt_build': bench_prompt_build(lengths),
+        'reruns': bench_reruns(lengths),
+        'load': bench_load(args.sessions, args.turns),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
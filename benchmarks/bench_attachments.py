@@ -0,0 +1,138 @@
+"""
+Ingest large generated attachments (a VBA module, an M script, a CSV file
+and a macro workbook with a worksheet and a Power Query) and report the
+time and peak memory of ingesting each, the cost of attaching the same file
+again, search latency, and the characters sent with a question compared to
+pasting the whole file.
+
+Usage: python benchmarks/bench_attachments.py [--rows 200000]
+"""
+import argparse
+import base64
+import io
+import os
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from attachments import AttachmentStore, with_attachments
+
+XLSX_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+
+def vba_module(procedures):
+    lines = ['Attribute VB_Name = "Reports"', 'Option Explicit', '']
+    for i in range(procedures):
+        lines += [
+            f"Public Sub RefreshRegion{i}(ByVal ws As Worksheet)",
+            f"    ' Rebuild the summary for region {i} from the raw export",
+            "    Dim lastRow As Long, r As Long",
+            "    lastRow = ws.Cells(ws.Rows.Count, \"A\").End(xlUp).Row",
+            "    For r = 2 To lastRow",
+            f"        ws.Cells(r, {i % 20 + 2}).Value = ws.Cells(r, 1).Value * {i}",
+            "    Next r",
+            "End Sub",
+            "",
+        ]
+    return '\r\n'.join(lines).encode('cp1252')
+
+
+def m_script(steps):
+    lines = ['section Section1;', '', 'shared Sales = let',
+             '    Source = Csv.Document(File.Contents("C:\\exports\\sales.csv"), [Delimiter=","]),']
+    for i in range(steps):
+        lines.append(f'    #"Added Column {i}" = Table.AddColumn(Source, "Metric{i}", each [Amount] * {i}),')
+    lines += ['    Result = #"Added Column 0"', 'in', '    Result;']
+    return '\n'.join(lines)
+
+
+def csv_file(rows):
+    output = io.StringIO()
+    output.write('Date,Region,Product,Units,Amount\n')
+    for i in range(rows):
+        output.write(f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d},Region{i % 40},SKU{i % 997},{i % 50},{i * 1.5:.2f}\n")
+    return output.getvalue().encode()
+
+
+def workbook(rows, m_code):
+    """
+    A minimal macro-free .xlsm-style package with one worksheet and a DataMashup part.
+    """
+    sheet = io.StringIO()
+    sheet.write(f'<worksheet xmlns="{XLSX_NS}"><sheetData>')
+    sheet.write('<row r="1"><c r="A1" t="inlineStr"><is><t>Region</t></is></c>'
+                '<c r="B1" t="inlineStr"><is><t>Total</t></is></c></row>')
+    for i in range(2, rows + 2):
+        sheet.write(f'<row r="{i}"><c r="A{i}" t="s"><v>{i % 3}</v></c><c r="B{i}"><v>{i * 2}</v></c>'
+                    f'<c r="C{i}"><f>B{i}*2</f><v>{i * 4}</v></c></row>')
+    sheet.write('</sheetData></worksheet>')
+    package = io.BytesIO()
+    with zipfile.ZipFile(package, 'w') as pq:
+        pq.writestr('Formulas/Section1.m', m_code)
+    mashup = struct.pack('<II', 0, len(package.getvalue())) + package.getvalue() + struct.pack('<I', 0)
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('xl/workbook.xml', f'<workbook xmlns="{XLSX_NS}" xmlns:r="{REL_NS}"><sheets>'
+                                            '<sheet name="Data" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        archive.writestr('xl/_rels/workbook.xml.rels',
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>')
+        archive.writestr('xl/sharedStrings.xml', f'<sst xmlns="{XLSX_NS}"><si><t>North</t></si>'
+                                                 '<si><t>South</t></si><si><t>West</t></si></sst>')
+        archive.writestr('xl/worksheets/sheet1.xml', sheet.getvalue())
+        archive.writestr('customXml/item1.xml', '<DataMashup xmlns="http://schemas.microsoft.com/DataMashup">'
+                                                f'{base64.b64encode(mashup).decode()}</DataMashup>')
+    return data.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure ingestion and retrieval of attachments.")
+    parser.add_argument('--rows', type=int, default=200000, help="rows of the generated CSV file and worksheet")
+    args = parser.parse_args()
+
+    files = (
+        ('Reports.bas', vba_module(args.rows // 20), "Why is RefreshRegion137 slow on large sheets?"),
+        ('Sales.pq', m_script(args.rows // 100).encode(), 'What does the "Added Column 42" step compute?'),
+        ('sales.csv', csv_file(args.rows), "Which rows are for Region7 and SKU120?"),
+        ('Summary.xlsm', workbook(args.rows // 4, m_script(50)), "How is the Metric12 column calculated?"),
+    )
+    store = AttachmentStore(os.path.join(tempfile.mkdtemp(), 'attachments.sqlite3'))
+    print(f"{'file':<14} {'size KB':>9} {'parts':>6} {'ingest s':>9} {'peak MB':>8} {'again ms':>9} "
+          f"{'search ms':>10} {'pasted chars':>13} {'sent chars':>11}")
+    for name, data, question in files:
+        tracemalloc.start()
+        start = time.perf_counter()
+        attachment, _ = store.attach('bench', name, io.BytesIO(data))
+        ingest = time.perf_counter() - start
+        # The upload itself is already in memory; what ingesting adds on top of it
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        _, new = store.attach('other-session', name, io.BytesIO(data))
+        again = time.perf_counter() - start
+        assert not new
+
+        start = time.perf_counter()
+        for _ in range(20):
+            results = store.search('bench', question)
+        search = (time.perf_counter() - start) / 20
+        print(f"{name:<14} {len(data) / 1024:>9,.0f} {attachment['chunks']:>6,} {ingest:>9.2f} "
+              f"{peak / 1024 / 1024:>8.1f} {again * 1000:>9.1f} {search * 1000:>10.2f} "
+              f"{len(data) + len(question):>13,} {len(with_attachments(question, results)):>11,}")
+        if attachment['notes']:
+            print(f"  note: {attachment['notes']}")
+    print("\nTop parts for the last question:")
+    for score, chunk in results:
+        print(f"  {score:6.2f}  {chunk['title']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Measure rerun wall time and bytes sent per rerun as the chat history grows,
+rendering the full history versus the windowed view.
+
+Usage: python benchmarks/bench_chat_render.py
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from streamlit.testing.v1 import AppTest
+
+import chat_view
+from bench_rerun_payload import payload_bytes
+from conversation import Message
+
+MESSAGE = "To merge two tables in Power Query, use Home > Merge Queries and pick the key columns. " * 3
+
+
+def measure(messages, window_size, reruns=3):
+    chat_view.CHAT_WINDOW_SIZE = window_size
+    at = AppTest.from_file(os.path.join(ROOT, 'main.py'), default_timeout=600)
+    at.session_state['api_key'] = 'benchmark'
+    at.session_state['conversation'] = [
+        Message("user" if i % 2 == 0 else "assistant", f"{i}: {MESSAGE}")
+        for i in range(messages)
+    ]
+    at.run()
+    start = time.perf_counter()
+    for _ in range(reruns):
+        at.run()
+    elapsed = (time.perf_counter() - start) / reruns
+    return elapsed, payload_bytes(at._tree)
+
+
+def main():
+    window = chat_view.CHAT_WINDOW_SIZE
+    print(f"{'messages':>8} {'full ms':>10} {'full bytes':>12} {'window ms':>10} {'window bytes':>13}")
+    for messages in (50, 500, 5000):
+        full_time, full_bytes = measure(messages, messages + 1)
+        window_time, window_bytes = measure(messages, window)
+        print(f"{messages:>8} {full_time * 1000:>10.1f} {full_bytes:>12,} "
+              f"{window_time * 1000:>10.1f} {window_bytes:>13,}")
+
+
+if __name__ == '__main__':
+    main()
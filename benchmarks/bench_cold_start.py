@@ -0,0 +1,136 @@
+"""
+Measure cold start of the app in fresh processes: time to import the
+modules main.py depends on, time until the first element and the API key
+form reach the browser, and latency of the first answer after logging in.
+Uses the fake model backend, so no network is needed.
+
+The first question is asked after a pause standing in for the user
+pasting their key (--typing-seconds, 0 to log in at once).
+
+Usage: python benchmarks/bench_cold_start.py [--runs 5] [--typing-seconds 3]
+"""
+import argparse
+import ast
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def app_modules():
+    """
+    Return the top-level modules imported by main.py.
+    """
+    with open(os.path.join(ROOT, 'main.py'), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return [m for m in modules if m != 'streamlit']
+
+
+def measure_imports():
+    import streamlit  # Streamlit itself is loaded before any app code runs
+    start = time.perf_counter()
+    for module in app_modules():
+        importlib.import_module(module)
+    return {
+        'import_s': time.perf_counter() - start,
+        'genai_imported': 'google.generativeai' in sys.modules,
+    }
+
+
+def measure_app(typing_seconds):
+    from streamlit.runtime.forward_msg_queue import ForwardMsgQueue
+    from streamlit.testing.v1 import AppTest
+
+    marks = {}
+    enqueue = ForwardMsgQueue.enqueue
+
+    def timed_enqueue(queue, msg):
+        if msg.WhichOneof('type') == 'delta':
+            now = time.perf_counter()
+            marks.setdefault('first_element', now)
+            if msg.delta.new_element.WhichOneof('type') == 'text_input':
+                marks.setdefault('form', now)
+        return enqueue(queue, msg)
+
+    ForwardMsgQueue.enqueue = timed_enqueue
+    at = AppTest.from_file(os.path.join(ROOT, 'main.py'), default_timeout=120)
+    start = time.perf_counter()
+    at.run()
+    run = time.perf_counter() - start
+    ForwardMsgQueue.enqueue = enqueue
+
+    # Log in the way a user would, then ask the first question right away
+    time.sleep(typing_seconds)
+    at.text_input[0].input('benchmark-key')
+    at.button[0].click().run()
+    # The chat page replaces the form on the next rerun
+    at.run()
+    asked = time.perf_counter()
+    at.text_area[0].input("How do I merge two tables in Power Query?").run()
+    from jobs import job_manager
+    job_manager.get(at.session_state['active_job']).wait()
+    first_answer = time.perf_counter() - asked
+    return {
+        'first_element_s': marks['first_element'] - start,
+        'form_s': marks['form'] - start,
+        'first_run_s': run,
+        'first_answer_s': first_answer,
+    }
+
+
+def child():
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    result = measure_imports() if sys.argv[2] == 'imports' else measure_app(float(sys.argv[3]))
+    print(json.dumps(result))
+
+
+def run_child(kind, typing_seconds):
+    env = dict(
+        os.environ,
+        MODEL_BACKEND='fake',
+        RESPONSE_CACHE_PATH=':memory:',
+        CONVERSATION_DB_PATH=os.path.join(tempfile.mkdtemp(), 'conversations.sqlite3'),
+    )
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', kind, str(typing_seconds)],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold start of the chat app.")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--typing-seconds', type=float, default=3.0)
+    args = parser.parse_args()
+    samples = {}
+    for _ in range(args.runs):
+        for kind in ('imports', 'app'):
+            for key, value in run_child(kind, args.typing_seconds).items():
+                samples.setdefault(key, []).append(value)
+    for key, values in samples.items():
+        if isinstance(values[0], bool):
+            print(f"{key:<18} {values[0]}")
+        else:
+            print(f"{key:<18} median {statistics.median(values) * 1000:8.1f} ms   "
+                  f"min {min(values) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        child()
+    else:
+        main()
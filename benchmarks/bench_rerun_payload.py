@@ -0,0 +1,51 @@
+"""
+Measure how many bytes each rerun of the app sends to the browser, with
+images inlined as data URIs versus served as static URLs.
+
+Usage: python benchmarks/bench_rerun_payload.py
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from streamlit.testing.v1 import AppTest
+
+import assets
+
+
+def payload_bytes(node):
+    """
+    Sum the serialized size of every element below a node of the element tree.
+    """
+    children = getattr(node, 'children', None)
+    if children is not None:
+        return sum(payload_bytes(child) for child in children.values())
+    proto = getattr(node, 'proto', None)
+    return proto.ByteSize() if proto is not None else 0
+
+
+def measure(mode, logged_in):
+    assets.ASSET_SERVING = mode
+    at = AppTest.from_file(os.path.join(ROOT, 'main.py'), default_timeout=60)
+    if logged_in:
+        at.session_state['api_key'] = 'benchmark'
+    at.run()
+    # The second rerun is what every keystroke-triggered rerun costs
+    at.run()
+    return payload_bytes(at._tree)
+
+
+def main():
+    print(f"{'page':<10} {'inline':>12} {'static':>12} {'saved':>8}")
+    for page, logged_in in (('login', False), ('chat', True)):
+        inline = measure('inline', logged_in)
+        static = measure('static', logged_in)
+        saved = 1 - static / inline if inline else 0.0
+        print(f"{page:<10} {inline:>12,} {static:>12,} {saved:>8.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare the prompt sent per question with the whole knowledge base in the
+system prompt versus the base prompt plus the top-k retrieved chunks, and
+time building, loading and searching the knowledge index.
+
+Usage: python benchmarks/bench_retrieval.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from knowledge import BASE_PROMPT, KnowledgeIndex, with_knowledge
+from prompts import SYSTEM_PROMPT
+
+QUESTIONS = (
+    "hi",
+    "How do I merge two tables in Power Query?",
+    "My Power BI dataflow for CCMIPBDS123 is not refreshing, what should I check?",
+    "What does the server role do with Task Till Dawn?",
+    "How can I make this VBA macro run faster? It loops over 50,000 rows.",
+    "Who handles ZohoDesk tickets this week?",
+)
+
+
+def main():
+    index_dir = tempfile.mkdtemp()
+    index = KnowledgeIndex(index_dir=index_dir)
+    start = time.perf_counter()
+    index.ensure()
+    build = time.perf_counter() - start
+    reloaded = KnowledgeIndex(index_dir=index_dir)
+    start = time.perf_counter()
+    reloaded.ensure()
+    load = time.perf_counter() - start
+    print(f"{len(index.chunks)} chunks, {index.stats()['terms']} terms: "
+          f"build {build * 1000:.2f} ms, reload via mmap {load * 1000:.2f} ms\n")
+
+    print(f"{'question':<48} {'full chars':>10} {'retrieval':>10} {'chunks':>7} {'search us':>10}")
+    for question in QUESTIONS:
+        start = time.perf_counter()
+        for _ in range(1000):
+            results = reloaded.search(question)
+        search = (time.perf_counter() - start) / 1000
+        full = len(SYSTEM_PROMPT) + len(question)
+        retrieved = len(BASE_PROMPT) + len(with_knowledge(question, results) if results else question)
+        print(f"{question[:48]:<48} {full:>10,} {retrieved:>10,} {len(results):>7} {search * 1e6:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Compare the per-turn cost of building the model request: the old approach
+re-concatenated the whole conversation into one prompt string every turn,
+the structured approach appends one role-tagged Content per message.
+
+Usage: python benchmarks/bench_turn_build.py
+"""
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from conversation import to_content
+from prompts import SYSTEM_PROMPT
+
+MESSAGE = "How can I loop through all cells in a range using VBA? " * 4
+
+
+def make_conversation(turns):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": MESSAGE}
+        for i in range(turns)
+    ]
+
+
+def legacy_build(conversation):
+    # The prompt assembly send_message() used to run on every turn
+    conversation_history = SYSTEM_PROMPT
+    for message in conversation:
+        if message['role'] == 'user':
+            conversation_history += f"\nUser: {message['content']}"
+        else:
+            conversation_history += f"\nAssistant: {message['content']}"
+    conversation_history += "\nAssistant:"
+    return conversation_history
+
+
+def main():
+    print(f"{'turns':>6} {'legacy (us)':>12} {'structured (us)':>16}")
+    for turns in (10, 100, 1000):
+        conversation = make_conversation(turns)
+        contents = [to_content(m['role'], m['content']) for m in conversation]
+        number = max(10, 10000 // turns)
+
+        legacy = timeit.timeit(lambda: legacy_build(conversation), number=number) / number
+
+        def structured():
+            contents.append(to_content('user', MESSAGE))
+            contents.pop()
+
+        structured_time = timeit.timeit(structured, number=number) / number
+        print(f"{turns:>6} {legacy * 1e6:>12.1f} {structured_time * 1e6:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Throughput scaling from 1 to N worker processes sharing state.
+
+A fixed number of simulated users (AppTest sessions against the fake model
+backend) is split across 1, 2, ... N worker processes that share rate
+limits, conversations and cached responses through SQLite, as they would
+under serve.py. Every user sends --turns messages; the workers start
+together and throughput is the total number of turns over the time the
+slowest worker took.
+
+Usage: python benchmarks/bench_workers.py [--workers 4] [--sessions 24] [--turns 3]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(first_session, sessions, turns):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from bench_app import bench_load
+
+    # Imports are done; wait for the other workers
+    print('ready', flush=True)
+    sys.stdin.readline()
+    print(json.dumps(bench_load(sessions, turns, first_session)), flush=True)
+
+
+def run_workers(workers, sessions, turns):
+    directory = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        MODEL_BACKEND='fake',
+        SHARED_STATE_URL=f"sqlite://{os.path.join(directory, 'shared.sqlite3')}",
+        CONVERSATION_DB_PATH=os.path.join(directory, 'conversations.sqlite3'),
+        RESPONSE_CACHE_PATH=os.path.join(directory, 'responses.sqlite3'),
+    )
+    shares = [sessions // workers + (1 if i < sessions % workers else 0) for i in range(workers)]
+    processes = []
+    for i, share in enumerate(shares):
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--child', str(sum(shares[:i])), str(share), str(turns)],
+            env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            stderr=open(os.path.join(directory, f"worker-{i}.log"), 'w'),
+        ))
+    for process in processes:
+        line = ''
+        while line != 'ready':
+            line = process.stdout.readline()
+            if not line:
+                raise RuntimeError(f"A worker exited before it was ready, see {directory}")
+            line = line.strip()
+    for process in processes:
+        process.stdin.write('go\n')
+        process.stdin.flush()
+    results = []
+    for process in processes:
+        output, _ = process.communicate()
+        if process.returncode:
+            raise RuntimeError(f"A worker failed, see {directory}")
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    elapsed = max(r['elapsed_s'] for r in results)
+    return {
+        'workers': workers,
+        'sessions': sessions,
+        'turns': sessions * turns,
+        'elapsed_s': elapsed,
+        'throughput_turns_per_s': round(sessions * turns / elapsed, 3),
+        'errors': sum(r['errors'] for r in results),
+        'turn_latency_p50_ms': max(r['turn_latency']['p50_ms'] for r in results),
+        'turn_latency_p95_ms': max(r['turn_latency']['p95_ms'] for r in results),
+        'submit_rerun_p50_ms': max(r['submit_rerun']['p50_ms'] for r in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure throughput scaling across worker processes.")
+    parser.add_argument('--workers', type=int, default=4, help="largest number of workers")
+    parser.add_argument('--sessions', type=int, default=24, help="simulated users, split across the workers")
+    parser.add_argument('--turns', type=int, default=3, help="messages sent by each user")
+    parser.add_argument('--output', help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    counts = sorted({1, args.workers} | {n for n in (2, 4, 8, 16) if n < args.workers})
+    results = []
+    print(f"{'workers':>7} {'turns/s':>8} {'speedup':>8} {'p50 ms':>8} {'p95 ms':>8} {'rerun ms':>9} {'errors':>6}")
+    for workers in counts:
+        result = run_workers(workers, args.sessions, args.turns)
+        results.append(result)
+        speedup = result['throughput_turns_per_s'] / results[0]['throughput_turns_per_s']
+        print(f"{workers:>7} {result['throughput_turns_per_s']:>8.2f} {speedup:>7.2f}x "
+              f"{result['turn_latency_p50_ms']:>8.0f} {result['turn_latency_p95_ms']:>8.0f} "
+              f"{result['submit_rerun_p50_ms']:>9.1f} {result['errors']:>6}")
+    print(f"({os.cpu_count()} CPU cores)")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cpu_count': os.cpu_count(), 'results': results}, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 4 and sys.argv[1] == '--child':
+        child(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main()
@@ -0,0 +1,32 @@
+import os
+from functools import lru_cache
+
+# Number of most recent messages shown; older ones appear via "Load earlier messages"
+CHAT_WINDOW_SIZE = int(os.environ.get('CHAT_WINDOW_SIZE', 50))
+
+# Rendered message HTML kept per process (messages are immutable once sent)
+MESSAGE_HTML_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=MESSAGE_HTML_CACHE_SIZE)
+def message_html(role, content, avatar_url):
+    """
+    Return the HTML for a single chat message. Memoized, so re-displaying a
+    message on later reruns costs a dictionary lookup.
+    """
+    return f"""
+                <div class='message-row {role}'>
+                    <img src="{avatar_url}" class='profile-pic' />
+                    <div class='message-text'>{content}</div>
+                </div>
+                """
+
+
+def visible_window(conversation, window_size):
+    """
+    Return (hidden_count, messages) for the newest window_size loaded messages.
+    The hidden count includes stored messages that have not been loaded yet.
+    """
+    start = max(0, len(conversation) - window_size)
+    not_loaded = (conversation[0].seq or 0) if conversation else 0
+    return start + not_loaded, conversation[start:]
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import threading
+import time
+
+from model_pool import MODEL_NAME, STRONG_MODEL_NAME, key_id, model_pool
+from shared_state import shared_state
+
+# How long a cached system prompt is kept, on the server and in the local fallback
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get('CONTEXT_CACHE_TTL_SECONDS', 60 * 60))
+
+# Server-side caching needs an explicit model version
+CONTEXT_CACHE_MODEL = os.environ.get('CONTEXT_CACHE_MODEL', 'models/gemini-1.5-flash-001')
+CONTEXT_CACHE_STRONG_MODEL = os.environ.get('CONTEXT_CACHE_STRONG_MODEL', 'models/gemini-1.5-pro-001')
+
+# Cached content can only be used with the model version it was created for
+_CACHE_MODELS = {MODEL_NAME: CONTEXT_CACHE_MODEL, STRONG_MODEL_NAME: CONTEXT_CACHE_STRONG_MODEL}
+
+# Recreate server caches this many seconds before they expire
+_EXPIRY_MARGIN_SECONDS = 60
+
+
+class _CacheEntry:
+    def __init__(self, prompt_hash, mode, expires_at, cached_content=None):
+        self.prompt_hash = prompt_hash
+        self.mode = mode
+        self.expires_at = expires_at
+        self.cached_content = cached_content
+
+
+class ContextCache:
+    """
+    Serve the system prompt from a context cache instead of resending it in
+    the contents of every turn.
+
+    For each API key and prompt hash, a server-side CachedContent is created
+    where the API accepts it (it enforces a minimum prompt size). Otherwise
+    the prompt is passed as the model's system_instruction and the fallback
+    is remembered locally until the TTL runs out, so the server is not asked
+    again on every turn.
+
+    Names of server caches are also kept in the shared store, so worker
+    processes reuse one cache per key and prompt instead of each creating
+    their own.
+    """
+
+    def __init__(self, ttl_seconds=CONTEXT_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.server_creates = 0
+        self.server_failures = 0
+        self.shared_reuses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_model(self, api_key, system_prompt, model_name=MODEL_NAME):
+        """
+        Return a (model, mode) tuple, where mode is 'server' if the system prompt
+        is served from server-side cached content and 'local' otherwise.
+        """
+        prompt_hash = hashlib.sha256(system_prompt.encode()).hexdigest()
+        cache_key = (key_id(api_key), prompt_hash, model_name)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+        if entry is None or entry.expires_at <= now:
+            # Created outside the lock so a slow API call does not block other sessions
+            entry = self._shared_entry(api_key, system_prompt, prompt_hash, model_name, now)
+            with self._lock:
+                self._entries[cache_key] = entry
+                for key in [k for k, e in self._entries.items() if e.expires_at <= now]:
+                    del self._entries[key]
+
+        if entry.mode == 'server':
+            return model_pool.get_cached_model(api_key, entry.cached_content), 'server'
+        return model_pool.get_model(api_key, model_name, system_instruction=system_prompt), 'local'
+
+    def _shared_entry(self, api_key, system_prompt, prompt_hash, model_name, now):
+        if model_name not in _CACHE_MODELS:
+            return _CacheEntry(prompt_hash, 'local', now + self.ttl_seconds)
+        name = _shared_key(key_id(api_key), prompt_hash, model_name)
+        # One worker creates the cache while the others wait for its name
+        with shared_state.lock(f"{name}:lock", timeout=30, sleep=0.05):
+            shared = shared_state.get(name)
+            if shared is not None:
+                cached_name, expires_at = shared.decode().split()
+                entry = self._fetch_entry(api_key, prompt_hash, cached_name, float(expires_at))
+                if entry is not None:
+                    return entry
+            entry = self._create_entry(api_key, system_prompt, prompt_hash, model_name, now)
+            if entry.mode == 'server':
+                shared_state.set(
+                    name, f"{entry.cached_content.name} {entry.expires_at}", ex=max(1, int(entry.expires_at - now))
+                )
+        return entry
+
+    def _fetch_entry(self, api_key, prompt_hash, cached_name, expires_at):
+        from google.generativeai import caching
+        try:
+            response = model_pool.get_client(api_key, 'cache').get_cached_content(
+                name=cached_name, timeout=10, retry=None
+            )
+        except Exception:
+            # Deleted or expired early; a new one is created
+            return None
+        self.shared_reuses += 1
+        return _CacheEntry(prompt_hash, 'server', expires_at, caching.CachedContent._from_obj(response))
+
+    def _create_entry(self, api_key, system_prompt, prompt_hash, model_name, now):
+        from google.generativeai import caching
+        try:
+            request = caching.CachedContent._prepare_create_request(
+                model=_CACHE_MODELS[model_name],
+                display_name=f"system-prompt-{prompt_hash[:12]}",
+                system_instruction=system_prompt,
+                ttl=self.ttl_seconds,
+            )
+            response = model_pool.get_client(api_key, 'cache').create_cached_content(request, timeout=10, retry=None)
+            self.server_creates += 1
+            return _CacheEntry(
+                prompt_hash,
+                'server',
+                now + self.ttl_seconds - _EXPIRY_MARGIN_SECONDS,
+                caching.CachedContent._from_obj(response),
+            )
+        except Exception:
+            # Typically the prompt is below the minimum cacheable size
+            self.server_failures += 1
+            return _CacheEntry(prompt_hash, 'local', now + self.ttl_seconds)
+
+    def invalidate(self, api_key):
+        """
+        Forget cache entries for an API key, e.g. after a cached content expired early.
+        """
+        ident = key_id(api_key)
+        with self._lock:
+            keys = [k for k in self._entries if k[0] == ident]
+            for key in keys:
+                del self._entries[key]
+        if keys:
+            shared_state.delete(*[_shared_key(*key) for key in keys])
+
+    def stats(self):
+        with self._lock:
+            modes = [e.mode for e in self._entries.values()]
+        return {
+            'entries': len(modes),
+            'server_entries': modes.count('server'),
+            'server_creates': self.server_creates,
+            'server_failures': self.server_failures,
+            'shared_reuses': self.shared_reuses,
+        }
+
+
+def _shared_key(ident, prompt_hash, model_name):
+    return f"context_cache:{ident}:{prompt_hash[:16]}:{model_name}"
+
+
+def cache_savings(response, mode):
+    """
+    Return a per-turn report of how many prompt tokens were served from the cache.
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+    cached_tokens = getattr(usage, 'cached_content_token_count', 0) or 0
+    return {
+        'cache_mode': mode,
+        'prompt_tokens': prompt_tokens,
+        'cached_tokens': cached_tokens,
+    }
+
+
+# Shared instance used by every session in this process
+context_cache = ContextCache()
@@ -0,0 +1,207 @@
+import hashlib
+import math
+import os
+import sys
+
+# Token budget for the history sent with each turn (summary plus verbatim messages)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 8000))
+
+# Number of most recent messages that are always sent verbatim
+CONTEXT_KEEP_RECENT = int(os.environ.get('CONTEXT_KEEP_RECENT', 6))
+
+# When compacting, fold old messages until the window is below this share of the budget,
+# so the summarizer does not have to run again on the very next turn
+CONTEXT_COMPACT_TARGET = 0.75
+
+# Rough characters-per-token ratio for Gemini models on English text and code
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a CCMI team member and their AI assistant.
+Keep every fact, decision, file name, CCMI ID, code snippet name and open question that may matter later. Be concise.
+
+Current summary:
+{summary}
+
+New messages to fold in:
+{messages}
+
+Updated summary:"""
+
+
+class Message:
+    """
+    A chat message as kept in session state. Slots and interned role strings
+    keep the per-message overhead small for long-lived sessions.
+    """
+
+    __slots__ = ('role', 'content', 'seq')
+
+    def __init__(self, role, content, seq=None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.seq = seq
+
+
+def to_content(role, text):
+    """
+    Convert a chat message to a role-tagged Content for the model.
+    The app's 'assistant' role maps to the API's 'model' role.
+    """
+    # Imported here: loading google.generativeai takes most of a second
+    from google.generativeai import protos
+    return protos.Content(role='user' if role == 'user' else 'model', parts=[protos.Part(text=text)])
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens in a piece of text without calling the API.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class ContextWindow:
+    """
+    The history sent to the model, kept within a token budget.
+
+    Token counts are computed once per message when it is appended. Recent
+    messages are always sent verbatim; once the budget is exceeded, the oldest
+    ones are folded into a rolling summary that is sent ahead of them.
+    """
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, keep_recent=CONTEXT_KEEP_RECENT):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.messages = []  # (Content, tokens, seq) triples sent verbatim
+        self.window_tokens = 0
+        self.summary = ''
+        self.summary_tokens = 0
+        self.summarized_messages = 0
+        # Store sequence number of the newest message folded into the summary
+        self.summarized_seq = None
+        # Running hash of the whole conversation, and of everything before the last message
+        self.history_hash = ''
+        self.prefix_hash = ''
+
+    def append(self, role, text, seq=None):
+        tokens = estimate_tokens(text)
+        self.messages.append((to_content(role, text), tokens, seq))
+        self.window_tokens += tokens
+        self.prefix_hash = self.history_hash
+        self.history_hash = hashlib.sha256(f"{self.history_hash}\0{role}\0{text}".encode()).hexdigest()
+
+    @property
+    def last_text(self):
+        """
+        Text of the most recent message, normally the question being answered.
+        """
+        if not self.messages:
+            return ''
+        return ''.join(part.text for part in self.messages[-1][0].parts)
+
+    @classmethod
+    def restore(cls, messages, summary='', summarized_seq=None):
+        """
+        Rebuild a context window from persisted messages and rolling summary.
+        `messages` are the ones after summarized_seq, the last message folded
+        into the summary.
+        """
+        context = cls()
+        context.summary = summary
+        context.summary_tokens = estimate_tokens(summary)
+        context.summarized_seq = summarized_seq
+        if summarized_seq is not None:
+            # Sequence numbers of a session start at 0 and have no gaps
+            context.summarized_messages = summarized_seq + 1
+        for message in messages:
+            context.append(message.role, message.content, message.seq)
+        return context
+
+    @property
+    def total_tokens(self):
+        return self.window_tokens + self.summary_tokens
+
+    def over_budget(self):
+        return self.total_tokens > self.budget
+
+    def compact(self, summarize):
+        """
+        Fold the oldest verbatim messages into the rolling summary until the
+        window fits the budget again. summarize(summary, contents) must return
+        the updated summary text.
+        """
+        if not self.over_budget():
+            return False
+        target = self.budget * CONTEXT_COMPACT_TARGET
+        folded = 0
+        tokens = self.total_tokens
+        # The latest message (the question being answered) is always kept
+        keep = max(self.keep_recent, 1)
+        while tokens > target and len(self.messages) - folded > keep:
+            tokens -= self.messages[folded][1]
+            folded += 1
+        # Start the verbatim part on a user turn so roles keep alternating after the summary;
+        # step back rather than forward, so no more than keep_recent messages are folded away
+        while folded and self.messages[folded][0].role == 'model':
+            folded -= 1
+        if not folded:
+            return False
+        old = [content for content, _, _ in self.messages[:folded]]
+        self.summary = summarize(self.summary, old)
+        self.summary_tokens = estimate_tokens(self.summary)
+        self.window_tokens -= sum(tokens for _, tokens, _ in self.messages[:folded])
+        if self.messages[folded - 1][2] is not None:
+            self.summarized_seq = self.messages[folded - 1][2]
+        del self.messages[:folded]
+        self.summarized_messages += folded
+        return True
+
+    def contents(self):
+        """
+        Return the contents to send to the model: the summary (if any) followed
+        by the verbatim messages.
+        """
+        head = []
+        if self.summary:
+            head = [
+                to_content('user', f"Summary of our earlier conversation:\n{self.summary}"),
+                to_content('assistant', "Understood, I'll keep that context in mind."),
+            ]
+        return head + [content for content, _, _ in self.messages]
+
+    def report(self):
+        """
+        Return per-turn token counts showing how the budget is being enforced.
+        """
+        return {
+            'context_tokens': self.total_tokens,
+            'summary_tokens': self.summary_tokens,
+            'context_budget': self.budget,
+            'verbatim_messages': len(self.messages),
+            'summarized_messages': self.summarized_messages,
+        }
+
+
+def format_messages(contents):
+    lines = []
+    for content in contents:
+        speaker = 'User' if content.role == 'user' else 'Assistant'
+        lines.append(f"{speaker}: {''.join(part.text for part in content.parts)}")
+    return '\n'.join(lines)
+
+
+def summarize_with_model(generate, summary, contents, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Fold messages into the running summary using the model; generate(prompt)
+    must return a model response. If the call fails, fall back to a truncated
+    transcript so the window's token budget is still enforced.
+    """
+    messages = format_messages(contents)
+    try:
+        response = generate(SUMMARY_PROMPT.format(summary=summary or '(none)', messages=messages))
+        if response and response.text:
+            return response.text.strip()
+    except Exception:
+        pass
+    excerpt = '\n'.join(line[:200] for line in messages.split('\n'))
+    # Keep the newest part so the fallback summary cannot outgrow half the budget
+    return f"{summary}\n{excerpt}".strip()[-(budget * CHARS_PER_TOKEN // 2):]
@@ -0,0 +1,228 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from conversation import Message, estimate_tokens
+
+# On-disk location of the conversation store
+CONVERSATION_DB_PATH = os.environ.get(
+    'CONVERSATION_DB_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'conversations.sqlite3'),
+)
+
+# Sessions idle this long are compacted into one compressed row; idle this long are deleted
+COMPACT_AFTER_SECONDS = int(os.environ.get('CONVERSATION_COMPACT_AFTER_SECONDS', 7 * 24 * 60 * 60))
+RETENTION_SECONDS = int(os.environ.get('CONVERSATION_RETENTION_SECONDS', 90 * 24 * 60 * 60))
+
+# How often the background compaction pass runs
+COMPACTION_INTERVAL_SECONDS = 60 * 60
+
+# Workers share the file; an append that collides with another worker's is retried this often
+APPEND_ATTEMPTS = 5
+
+
+class ConversationStore:
+    """
+    Persistent, append-only store of chat messages in SQLite.
+
+    Each message is written once as it is sent; sessions only load the
+    visible window into memory and page older messages in on demand. A
+    background pass compacts the messages of idle sessions into a single
+    zlib-compressed row (expanded again if the session comes back) and
+    deletes sessions past the retention period.
+    """
+
+    def __init__(self, path=CONVERSATION_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._compactor = None
+
+    def _connect(self):
+        # Caller must hold self._lock
+        if self._conn is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            # Wait for other workers' writes instead of failing with 'database is locked'
+            self._conn.execute('PRAGMA busy_timeout = 5000')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                ' id TEXT PRIMARY KEY, created REAL NOT NULL, last_active REAL NOT NULL,'
+                " summary TEXT NOT NULL DEFAULT '', archive BLOB, summary_seq INTEGER)"
+            )
+            if 'summary_seq' not in {row[1] for row in self._conn.execute('PRAGMA table_info(sessions)')}:
+                try:
+                    # Stores created before the summary recorded which messages it covers
+                    self._conn.execute('ALTER TABLE sessions ADD COLUMN summary_seq INTEGER')
+                except sqlite3.OperationalError:
+                    # Added by another worker in the meantime
+                    pass
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                ' session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL,'
+                ' content TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (session_id, seq))'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active)')
+        return self._conn
+
+    def _expand(self, conn, session_id):
+        # Restore message rows of a compacted session before reading or appending
+        row = conn.execute('SELECT archive FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        if row is None or row[0] is None:
+            return
+        messages = json.loads(zlib.decompress(row[0]))
+        conn.executemany(
+            'INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?)',
+            [(session_id, seq, role, content, created) for seq, role, content, created in messages],
+        )
+        conn.execute('UPDATE sessions SET archive = NULL WHERE id = ?', (session_id,))
+
+    def append(self, session_id, role, content):
+        """
+        Append a message to a session and return it as a Message with its sequence number.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            for attempt in range(APPEND_ATTEMPTS):
+                try:
+                    # Take the write lock before reading MAX(seq): other workers may append to this session too
+                    conn.execute('BEGIN IMMEDIATE')
+                    self._expand(conn, session_id)
+                    conn.execute(
+                        'INSERT INTO sessions (id, created, last_active) VALUES (?, ?, ?)'
+                        ' ON CONFLICT (id) DO UPDATE SET last_active = excluded.last_active',
+                        (session_id, now, now),
+                    )
+                    seq = conn.execute(
+                        'SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE session_id = ?', (session_id,)
+                    ).fetchone()[0]
+                    conn.execute('INSERT INTO messages VALUES (?, ?, ?, ?, ?)', (session_id, seq, role, content, now))
+                    conn.commit()
+                    break
+                except (sqlite3.IntegrityError, sqlite3.OperationalError):
+                    conn.rollback()
+                    if attempt == APPEND_ATTEMPTS - 1:
+                        raise
+                    time.sleep(0.05 * (attempt + 1))
+        return Message(role, content, seq)
+
+    def load_page(self, session_id, before_seq=None, limit=50):
+        """
+        Return up to `limit` messages preceding `before_seq` (or the newest ones),
+        oldest first.
+        """
+        with self._lock:
+            conn = self._connect()
+            self._expand(conn, session_id)
+            conn.commit()
+            rows = conn.execute(
+                'SELECT seq, role, content FROM messages WHERE session_id = ? AND seq < ?'
+                ' ORDER BY seq DESC LIMIT ?',
+                (session_id, before_seq if before_seq is not None else 2 ** 62, limit),
+            ).fetchall()
+        return [Message(role, content, seq) for seq, role, content in reversed(rows)]
+
+    def load_context(self, session_id, token_budget):
+        """
+        Return (summary, summarized_seq, messages) to rebuild a session's model
+        context: the rolling summary, the sequence number of the last message
+        it covers, and the messages after that one, oldest first. Only the
+        newest messages that fit the token budget next to the summary are
+        returned, starting on a user message.
+        """
+        with self._lock:
+            conn = self._connect()
+            self._expand(conn, session_id)
+            conn.commit()
+            row = conn.execute('SELECT summary, summary_seq FROM sessions WHERE id = ?', (session_id,)).fetchone()
+            summary, summarized_seq = row if row else ('', None)
+            tokens = estimate_tokens(summary)
+            messages = []
+            for seq, role, content in conn.execute(
+                    'SELECT seq, role, content FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq DESC',
+                    (session_id, summarized_seq if summarized_seq is not None else -1)):
+                tokens += estimate_tokens(content)
+                if tokens > token_budget and messages:
+                    break
+                messages.append(Message(role, content, seq))
+        messages.reverse()
+        while len(messages) > 1 and messages[0].role != 'user':
+            messages.pop(0)
+        return summary, summarized_seq, messages
+
+    def save_summary(self, session_id, summary, summarized_seq=None):
+        """
+        Persist the rolling summary of the older part of a conversation and
+        the sequence number of the last message it covers.
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'UPDATE sessions SET summary = ?, summary_seq = ? WHERE id = ?', (summary, summarized_seq, session_id)
+            )
+            conn.commit()
+
+    def delete_session(self, session_id):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+            conn.commit()
+
+    def compact(self, now=None):
+        """
+        Compact idle sessions and delete expired ones. Returns (compacted, deleted).
+        """
+        now = now or time.time()
+        with self._lock:
+            conn = self._connect()
+            expired = [r[0] for r in conn.execute(
+                'SELECT id FROM sessions WHERE last_active < ?', (now - RETENTION_SECONDS,))]
+            for session_id in expired:
+                conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+                conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+            idle = [r[0] for r in conn.execute(
+                'SELECT id FROM sessions WHERE last_active < ? AND archive IS NULL',
+                (now - COMPACT_AFTER_SECONDS,))]
+            for session_id in idle:
+                rows = conn.execute(
+                    'SELECT seq, role, content, created FROM messages WHERE session_id = ? ORDER BY seq',
+                    (session_id,),
+                ).fetchall()
+                archive = zlib.compress(json.dumps(rows).encode(), 9)
+                conn.execute('UPDATE sessions SET archive = ? WHERE id = ?', (archive, session_id))
+                conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+            conn.commit()
+            if expired or idle:
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return len(idle), len(expired)
+
+    def start_compaction(self, interval=COMPACTION_INTERVAL_SECONDS):
+        """
+        Start the background compaction thread (once per process).
+        """
+        with self._lock:
+            if self._compactor is not None:
+                return
+            self._compactor = threading.Thread(
+                target=self._compaction_loop, args=(interval,), name='conversation-compaction', daemon=True
+            )
+        self._compactor.start()
+
+    def _compaction_loop(self, interval):
+        while True:
+            try:
+                self.compact()
+            except sqlite3.Error:
+                pass
+            time.sleep(interval)
+
+
+# Shared instance used by every session in this process
+conversation_store = ConversationStore()
@@ -0,0 +1,335 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+
+from attachments import attachment_store, with_attachments
+from backends import FAST_TIER, INVALIDATING_ERRORS, backend
+from context_cache import cache_savings
+from conversation import summarize_with_model, to_content
+from knowledge import RETRIEVAL_ENABLED, active_system_prompt, knowledge_index, with_knowledge
+from metrics import metrics
+from response_cache import response_cache
+from router import FALLBACK_ERRORS, ROUTER_PRIMARY_DEADLINE_SECONDS, model_router
+from scheduler import DEFAULT_DEADLINE_SECONDS, DeadlineExceeded, request_options, scheduler
+from single_flight import single_flight
+
+# Stream responses chunk by chunk instead of waiting for the full answer
+STREAM_RESPONSES = os.environ.get('STREAM_RESPONSES', '1') != '0'
+
+EMPTY_RESPONSE = "I'm sorry, I couldn't generate a response."
+
+# How often a request joined to another one's model call checks whether it was stopped
+FOLLOW_POLL_SECONDS = 0.25
+
+
+def chunk_text(chunk):
+    """
+    Return the text of a response chunk; chunks without text parts (e.g. a
+    final chunk carrying only usage data) yield an empty string.
+    """
+    try:
+        return chunk.text or ''
+    except ValueError:
+        return ''
+
+
+def cancel_stream(response):
+    """
+    Best-effort cancellation of the underlying streaming call.
+    """
+    cancel = getattr(getattr(response, '_iterator', None), 'cancel', None)
+    if cancel is not None:
+        try:
+            cancel()
+        except Exception:
+            pass
+
+
+def start_stream(start_call, seconds):
+    """
+    Start a streaming call and wait at most `seconds` for its first chunk,
+    raising DeadlineExceeded if none arrived by then. Return the response and
+    an iterator over all of its chunks, the first one included.
+
+    start_call(abandoned) is passed an event that is set when the call is
+    given up on, so the scheduler stops retrying it; a call that only starts
+    after that is cancelled.
+    """
+    started = threading.Event()
+    abandoned = threading.Event()
+    lock = threading.Lock()
+    result = {}
+
+    def run():
+        try:
+            response = start_call(abandoned)
+            chunks = iter(response)
+            first = next(chunks, None)
+            result['value'] = response, itertools.chain([] if first is None else [first], chunks)
+        except Exception as e:
+            result['error'] = e
+        with lock:
+            started.set()
+        if abandoned.is_set() and 'value' in result:
+            cancel_stream(result['value'][0])
+
+    threading.Thread(target=run, name='first-chunk', daemon=True).start()
+    started.wait(max(0.0, seconds))
+    with lock:
+        if not started.is_set():
+            abandoned.set()
+            raise DeadlineExceeded(f"The model did not start answering within {seconds:.0f}s.")
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+def cache_scope(context, attachments=''):
+    """
+    Return the response cache context for the latest question: the model, the
+    system prompt (and knowledge index), the attached files and the
+    conversation before the question. First questions without attachments
+    share an empty history, so they are answered from cache across users.
+    """
+    knowledge = ''
+    if RETRIEVAL_ENABLED:
+        knowledge_index.ensure()
+        knowledge = knowledge_index.fingerprint
+    prompt_hash = hashlib.sha256(f"{active_system_prompt()}\0{knowledge}".encode()).hexdigest()[:16]
+    return f"{backend.model_name}:{prompt_hash}:{attachments}:{context.prefix_hash}"
+
+
+def run_generation(job, api_key, context, stream=STREAM_RESPONSES):
+    """
+    Generate the assistant's reply to the latest message in the context window.
+
+    Runs on the worker pool, outside the Streamlit script thread, so it must
+    not touch st.* APIs. Streamed text is appended to job.text as it arrives;
+    errors are reported in the text, as the chat has always shown them.
+    """
+    start = time.perf_counter()
+    question = context.last_text
+    scope = cache_scope(context, attachment_store.fingerprint(job.session_id))
+    with metrics.timer('stage_seconds', stage='response_cache'):
+        cached = response_cache.lookup(question, scope)
+    metrics.inc('response_cache', tier=cached.tier if cached is not None else 'miss')
+    if cached is not None:
+        job.text = cached.text
+        metrics.inc('turns', outcome='cached')
+        elapsed = time.perf_counter() - start
+        job.metrics = {
+            "time_to_first_token": elapsed,
+            "total_latency": elapsed,
+            "response_cache": cached.tier,
+            "latency_saved": cached.latency_saved,
+        }
+        return
+
+    # Share the model call of the same question if it is already being answered
+    flight, leader = single_flight.join(question, scope, job)
+    if leader:
+        try:
+            answer_question(job, api_key, context, stream, start, question, scope, flight)
+        except BaseException:
+            single_flight.finish(flight)
+            raise
+    follow_flight(job, flight, start, leader)
+
+
+def answer_question(job, api_key, context, stream, start, question, scope, flight):
+    """
+    Build the prompt for the latest question, then start the model call on a
+    thread owned by the flight, which publishes the text to every job waiting
+    on it, the leader's included. Stopping the leader's job therefore only
+    stops its copy, like any other; the call goes on while others wait.
+    """
+    # Pick the model tier from the question, falling back to the other tier below
+    route = model_router.route(question)
+    system_prompt = active_system_prompt()
+    knowledge = []
+    attached = []
+    contents = None
+    prepare_error = None
+    # Every model call made for this answer shares one deadline
+    deadline = time.monotonic() + DEFAULT_DEADLINE_SECONDS
+
+    def generate(model, contents, stream=False, deadline=deadline, abandoned=None):
+        return scheduler.call(
+            api_key,
+            lambda timeout: model.generate_content(
+                contents, stream=stream, request_options=request_options(timeout)
+            ),
+            deadline,
+            abandoned,
+        )
+
+    try:
+        def summarize(summary, old):
+            # Summaries are simple enough for the fast tier
+            summary_model = backend.get_model(api_key, system_prompt, FAST_TIER)[0]
+            return summarize_with_model(
+                lambda prompt: generate(summary_model, prompt), summary, old, context.budget
+            )
+
+        # Fold old turns into the rolling summary if the window is over budget.
+        # This changes the session's context, so it stays on the job's thread.
+        with metrics.timer('stage_seconds', stage='compaction'):
+            context.compact(summarize)
+
+        with metrics.timer('stage_seconds', stage='prompt_build'):
+            contents = context.contents()
+        prompt = question
+        if RETRIEVAL_ENABLED:
+            with metrics.timer('stage_seconds', stage='retrieval'):
+                knowledge = knowledge_index.search(question)
+            if knowledge:
+                prompt = with_knowledge(question, knowledge)
+        with metrics.timer('stage_seconds', stage='attachments'):
+            attached = attachment_store.search(job.session_id, question)
+        if attached:
+            prompt = with_attachments(prompt, attached)
+        if prompt != question:
+            # Only this request carries the knowledge and excerpts; the conversation keeps the plain question
+            contents[-1] = to_content('user', prompt)
+        metrics.inc('knowledge_chunks', len(knowledge))
+        metrics.inc('attachment_chunks', len(attached))
+        if metrics.enabled:
+            metrics.inc('prompt_chars', sum(len(part.text) for content in contents for part in content.parts))
+            metrics.inc('prompt_tokens_estimated', context.total_tokens)
+    except Exception as e:
+        prepare_error = e
+
+    def call_model():
+        response = None
+        cache_mode = None
+        complete = False
+        error = None
+        tier = route.tier
+        fallback = False
+        try:
+            if prepare_error is not None:
+                raise prepare_error
+            model_start = time.perf_counter()
+            # Get a model handle with the system prompt served from the context cache
+            model, cache_mode = backend.get_model(api_key, system_prompt, tier)
+            try:
+                if stream:
+                    # The call runs under the turn's deadline; only its first chunk is held to the tier's budget
+                    response, chunks = start_stream(
+                        lambda abandoned: generate(model, contents, stream, abandoned=abandoned),
+                        min(ROUTER_PRIMARY_DEADLINE_SECONDS, deadline - time.monotonic()),
+                    )
+                else:
+                    response = generate(model, contents)
+                    chunks = [response]
+            except FALLBACK_ERRORS:
+                # Timed out or out of quota on this tier: let the other tier answer
+                model_router.record_failure(tier)
+                metrics.inc('tier_fallbacks', tier=tier)
+                tier, fallback = model_router.fallback(tier), True
+                model, cache_mode = backend.get_model(api_key, system_prompt, tier)
+                response = generate(model, contents, stream)
+                chunks = response if stream else [response]
+            metrics.inc('context_cache', mode=cache_mode)
+            for chunk in chunks:
+                # Keep going while anyone is waiting for the answer
+                if flight.cancelled:
+                    cancel_stream(response)
+                    break
+                text = chunk_text(chunk)
+                if text:
+                    flight.publish(flight.text + text)
+
+            metrics.observe('stage_seconds', time.perf_counter() - model_start, stage='model_call')
+
+            if flight.cancelled:
+                answer = f"{flight.text.strip()}\n\n*(stopped)*".strip()
+                flight.outcome = 'stopped'
+            else:
+                answer = flight.text.strip() or EMPTY_RESPONSE
+                complete = answer != EMPTY_RESPONSE
+                flight.outcome = 'complete' if complete else 'empty'
+        except Exception as e:
+            error = type(e).__name__
+            flight.outcome = 'error'
+            metrics.inc('errors', error=type(e).__name__)
+            if isinstance(e, INVALIDATING_ERRORS):
+                # A server-side cache may have expired early; recreate it next turn
+                backend.invalidate(api_key)
+            # Keep whatever was already streamed before the error
+            answer = f"{flight.text}\n\nError: {e}" if flight.text else f"Error: {e}"
+
+        total_latency = time.perf_counter() - start
+        if complete:
+            # Only complete answers are cached, never errors or stopped generations
+            response_cache.store(question, scope, answer, total_latency)
+        savings = cache_savings(response, cache_mode)
+        response_tokens = getattr(getattr(response, 'usage_metadata', None), 'candidates_token_count', 0) or 0
+        cost = 0.0
+        if response is not None:
+            cost = model_router.record(tier, total_latency, savings['prompt_tokens'], response_tokens, fallback)
+            metrics.observe('tier_turn_seconds', total_latency, tier=tier)
+        metrics.inc('prompt_tokens', savings['prompt_tokens'])
+        metrics.inc('cached_prompt_tokens', savings['cached_tokens'])
+        metrics.inc('response_tokens', response_tokens)
+        flight.answer = answer
+        flight.metrics = {
+            "response_cache": 'miss',
+            "model_tier": tier,
+            "model": backend.tiers[tier],
+            "routing": route.reasons,
+            "fallback": fallback,
+            "cost_usd": cost,
+            "error": error,
+            "knowledge": [chunk['title'] for _, chunk in knowledge],
+            "attachments": [chunk['title'] for _, chunk in attached],
+            **savings,
+        }
+        flight.tokens = savings['prompt_tokens'] + response_tokens
+        flight.cost = cost
+
+    def run_flight():
+        try:
+            call_model()
+        finally:
+            single_flight.finish(flight)
+
+    threading.Thread(target=run_flight, name=f"flight-{job.id[:8]}", daemon=True).start()
+
+
+def follow_flight(job, flight, start, leader=False):
+    """
+    Answer from a model call in progress, mirroring its text into the job as
+    it streams in. Stopping the job only stops this copy; the call goes on
+    while others are waiting for it.
+    """
+    if not leader:
+        metrics.inc('coalesced_requests')
+    time_to_first_token = None
+    text, done = '', False
+    while not done and not job.cancelled:
+        text, done = flight.wait(text, FOLLOW_POLL_SECONDS)
+        if text and time_to_first_token is None:
+            time_to_first_token = time.perf_counter() - start
+            metrics.observe('time_to_first_token_seconds', time_to_first_token)
+        job.text = text
+
+    if job.cancelled:
+        job.text = f"{job.text.strip()}\n\n*(stopped)*".strip()
+        metrics.inc('turns', outcome='stopped')
+    else:
+        # The leader may have failed before setting the answer
+        job.text = flight.answer if flight.answer is not None else (text.strip() or EMPTY_RESPONSE)
+        metrics.inc('turns', outcome=flight.outcome if leader else 'coalesced')
+    total_latency = time.perf_counter() - start
+    metrics.observe('turn_seconds', total_latency)
+    job.metrics = {
+        **flight.metrics,
+        "time_to_first_token": time_to_first_token if time_to_first_token is not None else total_latency,
+        "total_latency": total_latency,
+    }
+    if not leader:
+        # The leader's turn carries the cost of the call
+        job.metrics.update(response_cache='coalesced', cost_usd=0.0)
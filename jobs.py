@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads shared by all sessions for model calls
+GENERATION_WORKERS = int(os.environ.get('GENERATION_WORKERS', 16))
+
+# Maximum number of in-flight generations per session
+MAX_JOBS_PER_SESSION = int(os.environ.get('MAX_JOBS_PER_SESSION', 1))
+
+# Finished jobs nobody collected (e.g. the tab was closed) are dropped after this long
+ABANDONED_JOB_SECONDS = 10 * 60
+
+
+class TooManyJobs(Exception):
+    """
+    Raised when a session already has MAX_JOBS_PER_SESSION generations in flight.
+    """
+
+
+class Job:
+    """
+    A generation running on the worker pool. The worker appends streamed text
+    to `text` and checks `cancelled` between chunks; the page polls the job
+    and collects the result once `done` is set.
+    """
+
+    def __init__(self, session_id):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.status = 'queued'
+        self.text = ''
+        self.error = None
+        self.metrics = {}
+        self.created = time.monotonic()
+        # Set when a worker picks the job up; stays None for a job stopped while queued
+        self.started = None
+        self.finished = None
+        self.future = None
+        self._cancel_event = threading.Event()
+        self._done_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def done(self):
+        return self._done_event.is_set()
+
+    def wait(self, timeout=None):
+        return self._done_event.wait(timeout)
+
+    def cancel(self):
+        self._cancel_event.set()
+
+
+class JobManager:
+    """
+    Bounded worker pool running generations off the Streamlit script thread,
+    with per-session job IDs, a per-session concurrency cap and cancellation.
+    """
+
+    def __init__(self, workers=GENERATION_WORKERS, max_per_session=MAX_JOBS_PER_SESSION):
+        self.max_per_session = max_per_session
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='generation')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, fn, *args):
+        """
+        Run fn(job, *args) on the pool and return the Job. Raises TooManyJobs if
+        the session is already at its cap.
+        """
+        with self._lock:
+            self._purge_abandoned()
+            active = [j for j in self._jobs.values() if j.session_id == session_id and not j.done]
+            if len(active) >= self.max_per_session:
+                raise TooManyJobs(f"{len(active)} request(s) already in progress")
+            job = Job(session_id)
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        if job.cancelled:
+            job.status = 'cancelled'
+        else:
+            job.status = 'running'
+            job.started = time.monotonic()
+            try:
+                fn(job, *args)
+                job.status = 'cancelled' if job.cancelled else 'done'
+            except Exception as e:
+                job.error = e
+                job.status = 'error'
+        job.finished = time.monotonic()
+        # A job stopped while queued, or one that failed, may not have recorded its timings
+        job.metrics.setdefault('time_to_first_token', job.finished - job.created)
+        job.metrics.setdefault('total_latency', job.finished - job.created)
+        job._done_event.set()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Ask a job to stop. A queued job never starts; a running job stops at its next chunk.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    def pop(self, job_id):
+        """
+        Remove a finished job once its result has been collected.
+        """
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def _purge_abandoned(self):
+        cutoff = time.monotonic() - ABANDONED_JOB_SECONDS
+        for job_id in [i for i, j in self._jobs.items() if j.done and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            statuses = [j.status for j in self._jobs.values()]
+        return {status: statuses.count(status) for status in ('queued', 'running', 'done', 'cancelled', 'error')}
+
+
+# Shared instance used by every session in this process
+job_manager = JobManager()
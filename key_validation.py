@@ -0,0 +1,106 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+from backends import backend
+from scheduler import scheduler
+
+# How long validation results are remembered (failures for less time than successes)
+VALIDATION_TTL_SECONDS = int(os.environ.get('KEY_VALIDATION_TTL_SECONDS', 10 * 60))
+INVALID_TTL_SECONDS = 60
+
+# Validation gives up after this long instead of holding up the login form
+VALIDATION_TIMEOUT_SECONDS = float(os.environ.get('KEY_VALIDATION_TIMEOUT_SECONDS', 5))
+
+# Errors meaning the key itself was rejected (as opposed to a network problem)
+_REJECTED = (
+    google_exceptions.InvalidArgument,
+    google_exceptions.PermissionDenied,
+    google_exceptions.Unauthenticated,
+)
+
+
+class KeyValidator:
+    """
+    Validate API keys with a metadata call (fetching the model description),
+    which is fast and not billed, instead of a full generation.
+
+    Results are remembered for a short TTL keyed by an HMAC of the key with a
+    per-process random salt, so the raw key is never stored and the hashes
+    are useless outside this process.
+    """
+
+    def __init__(self, ttl_seconds=VALIDATION_TTL_SECONDS, timeout=VALIDATION_TIMEOUT_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.timeout = timeout
+        self.cache_hits = 0
+        self.calls = 0
+        self.total_latency = 0.0
+        self.last_latency = None
+        self._salt = secrets.token_bytes(16)
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, api_key):
+        return hmac.new(self._salt, api_key.encode(), hashlib.sha256).hexdigest()
+
+    def validate(self, api_key):
+        """
+        Return (valid, message) for an API key.
+        """
+        if not api_key.strip():
+            return False, "Please enter an API key."
+        fingerprint = self._fingerprint(api_key)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._results.get(fingerprint)
+            if cached is not None and cached[0] > now:
+                self.cache_hits += 1
+                return cached[1], cached[2]
+
+        start = time.perf_counter()
+        try:
+            scheduler.call(
+                api_key,
+                lambda timeout: backend.validate_key(api_key, timeout),
+                time.monotonic() + self.timeout,
+            )
+            result = (True, f"API key successfully validated in {time.perf_counter() - start:.2f}s.")
+            ttl = self.ttl_seconds
+        except _REJECTED as e:
+            result = (False, f"API key validation error: {e.message}")
+            ttl = INVALID_TTL_SECONDS
+        except Exception as e:
+            # Network problems, timeouts and an open circuit say nothing about the key,
+            # so they are not cached
+            result = (False, f"API key validation error: {e}")
+            ttl = 0
+        latency = time.perf_counter() - start
+
+        with self._lock:
+            self.calls += 1
+            self.total_latency += latency
+            self.last_latency = latency
+            if ttl:
+                self._results[fingerprint] = (now + ttl, result[0], result[1])
+            for key in [k for k, v in self._results.items() if v[0] <= now]:
+                del self._results[key]
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'cache_hits': self.cache_hits,
+                'average_latency': self.total_latency / self.calls if self.calls else 0.0,
+                'last_latency': self.last_latency,
+            }
+
+
+# Shared instance used by every session in this process
+key_validator = KeyValidator()
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import Counter
+
+from prompts import SYSTEM_PROMPT
+
+# Retrieve relevant team knowledge per question instead of sending all of it in the system prompt
+RETRIEVAL_ENABLED = os.environ.get('RETRIEVAL_ENABLED', '1') != '0'
+
+# Number of knowledge chunks added to a question, and the minimum BM25 score for a chunk to count
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', 3))
+RETRIEVAL_MIN_SCORE = float(os.environ.get('RETRIEVAL_MIN_SCORE', 2.0))
+
+# Optional folder of team docs and macros indexed alongside the built-in knowledge
+KNOWLEDGE_DIR = os.environ.get(
+    'KNOWLEDGE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowledge')
+)
+KNOWLEDGE_EXTENSIONS = ('.md', '.txt', '.bas', '.cls', '.vba', '.m', '.pq', '.dax')
+
+# On-disk location of the index
+KNOWLEDGE_INDEX_DIR = os.environ.get(
+    'KNOWLEDGE_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'knowledge')
+)
+
+# Target size of a chunk from a file in KNOWLEDGE_DIR, in characters
+CHUNK_CHARS = 1200
+
+# Sections of the system prompt that are always sent; the others become retrievable chunks
+BASE_SECTIONS = ('Guidelines for Responses', 'Final Instructions')
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Bump when the on-disk format or the chunking changes, so old indexes are rebuilt
+_INDEX_VERSION = 1
+
+# Each posting is a chunk number and its precomputed BM25 weight for the term
+_POSTING = struct.Struct('<If')
+
+_TOKEN_RE = re.compile(r"[a-z]+|\d+")
+# A top-level list item of a prompt section: "- **Server Role**:" or "1. **VBA Optimization**:"
+_ITEM_RE = re.compile(r"^(- |\d+\. )(?=\*\*)")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in into is it its me my of on or so that the "
+    "their then there these this to use using was what when where which why will with you your".split()
+)
+
+
+def tokenize(text):
+    """
+    Lowercase word and number tokens without stopwords. Placeholder IDs such
+    as CCMIPBDSxxx reduce to their prefix, so they match concrete IDs.
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token.endswith('xxx') and len(token) > 3:
+            token = token[:-3]
+        if token not in _STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+def _split_sections(prompt):
+    """
+    Split a markdown prompt into (heading, body) pairs on '### ' headings;
+    the text before the first heading has an empty heading.
+    """
+    sections = []
+    heading, lines = '', []
+    for line in prompt.strip().split('\n'):
+        if line.startswith('### '):
+            sections.append((heading, '\n'.join(lines).strip()))
+            heading, lines = line[4:].strip('* '), []
+        else:
+            lines.append(line)
+    sections.append((heading, '\n'.join(lines).strip()))
+    return sections
+
+
+def _prompt_chunks(sections):
+    """
+    Chunk the knowledge sections of the system prompt by their top-level
+    items (one role, one scenario...), each prefixed with its section heading
+    and introduction.
+    """
+    chunks = []
+    for heading, body in sections:
+        intro, items = [], []
+        for line in body.split('\n'):
+            if _ITEM_RE.match(line):
+                items.append([line])
+            elif items:
+                items[-1].append(line)
+            else:
+                intro.append(line)
+        header = '\n'.join([f"### {heading}"] + intro).strip()
+        for item in items or [[]]:
+            text = '\n'.join(item).strip()
+            title = _ITEM_RE.sub('', item[0]).strip('*: ') if item else ''
+            chunks.append({
+                'source': 'system prompt',
+                'title': f"{heading} › {title}" if title else heading,
+                'text': f"{header}\n\n{text}" if text else header,
+            })
+    return chunks
+
+
+def _file_chunks(path, root):
+    """
+    Chunk a doc or macro file on blank lines into pieces of about CHUNK_CHARS.
+    """
+    with open(path, encoding='utf-8', errors='replace') as f:
+        text = f.read().replace('\r\n', '\n')
+    name = os.path.relpath(path, root)
+    chunks, current = [], ''
+    for block in re.split(r"\n\s*\n", text):
+        if current and len(current) + len(block) > CHUNK_CHARS:
+            chunks.append(current)
+            current = ''
+        current = f"{current}\n\n{block}" if current else block
+    if current.strip():
+        chunks.append(current)
+    return [
+        {'source': name, 'title': f"{name} ({i + 1}/{len(chunks)})", 'text': f"From {name}:\n{chunk.strip()}"}
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+def _knowledge_files(directory):
+    if not os.path.isdir(directory):
+        return []
+    paths = []
+    for dirpath, _, filenames in os.walk(directory):
+        paths.extend(
+            os.path.join(dirpath, name) for name in filenames if name.lower().endswith(KNOWLEDGE_EXTENSIONS)
+        )
+    return sorted(paths)
+
+
+# The always-sent part of the system prompt, used when retrieval is enabled
+_SECTIONS = _split_sections(SYSTEM_PROMPT)
+BASE_PROMPT = '\n\n'.join(
+    (f"### {heading}\n{body}" if heading else body) for heading, body in _SECTIONS
+    if not heading or heading in BASE_SECTIONS
+)
+
+
+def active_system_prompt():
+    """
+    Return the system prompt to send: the base prompt with retrieval, the full one without.
+    """
+    return BASE_PROMPT if RETRIEVAL_ENABLED else SYSTEM_PROMPT
+
+
+class KnowledgeIndex:
+    """
+    BM25 index over the team knowledge: the knowledge sections of the
+    system prompt plus any docs and macros in KNOWLEDGE_DIR.
+
+    The index is built once and written to KNOWLEDGE_INDEX_DIR as a JSON
+    manifest (chunks and vocabulary) and a binary postings file with
+    precomputed BM25 weights. Later processes map the postings file with
+    mmap instead of rebuilding, as long as the sources are unchanged.
+    """
+
+    def __init__(self, directory=KNOWLEDGE_DIR, index_dir=KNOWLEDGE_INDEX_DIR):
+        self.directory = directory
+        self.index_dir = index_dir
+        self.fingerprint = None
+        self.chunks = []
+        self.built = False
+        self.searches = 0
+        self._vocabulary = {}
+        self._postings = None
+        self._lock = threading.Lock()
+
+    def _source_fingerprint(self):
+        digest = hashlib.sha256(f"{_INDEX_VERSION}\0{SYSTEM_PROMPT}\0{BASE_SECTIONS}".encode())
+        for path in _knowledge_files(self.directory):
+            stat = os.stat(path)
+            digest.update(f"\0{os.path.relpath(path, self.directory)}\0{stat.st_mtime_ns}\0{stat.st_size}".encode())
+        return digest.hexdigest()[:16]
+
+    def _postings_path(self, fingerprint):
+        # Postings are named by fingerprint, so a manifest never points at another build's postings
+        return os.path.join(self.index_dir, f"postings-{fingerprint}.bin")
+
+    def ensure(self):
+        """
+        Load the index from disk, building it first if the sources changed.
+        """
+        with self._lock:
+            if self._postings is not None:
+                return
+            fingerprint = self._source_fingerprint()
+            manifest_path = os.path.join(self.index_dir, 'manifest.json')
+            manifest = None
+            if os.path.exists(manifest_path) and os.path.exists(self._postings_path(fingerprint)):
+                with open(manifest_path, encoding='utf-8') as f:
+                    manifest = json.load(f)
+            if manifest is None or manifest.get('fingerprint') != fingerprint:
+                manifest = self._build(fingerprint, manifest_path)
+                self.built = True
+            self.fingerprint = fingerprint
+            self.chunks = manifest['chunks']
+            self._vocabulary = manifest['vocabulary']
+            with open(self._postings_path(fingerprint), 'rb') as f:
+                # An empty file cannot be mapped (no knowledge at all)
+                self._postings = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._vocabulary else b''
+
+    def _build(self, fingerprint, manifest_path):
+        chunks = _prompt_chunks([(h, b) for h, b in _SECTIONS if h and h not in BASE_SECTIONS])
+        for path in _knowledge_files(self.directory):
+            chunks.extend(_file_chunks(path, self.directory))
+
+        term_counts = [Counter(tokenize(f"{chunk['title']}\n{chunk['text']}")) for chunk in chunks]
+        lengths = [sum(counts.values()) for counts in term_counts]
+        average = sum(lengths) / len(lengths) if lengths else 1.0
+        postings = {}
+        for number, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((number, count))
+
+        vocabulary, data, offset = {}, bytearray(), 0
+        for term in sorted(postings):
+            entries = postings[term]
+            idf = math.log(1 + (len(chunks) - len(entries) + 0.5) / (len(entries) + 0.5))
+            for number, count in entries:
+                norm = count + BM25_K1 * (1 - BM25_B + BM25_B * lengths[number] / average)
+                data += _POSTING.pack(number, idf * count * (BM25_K1 + 1) / norm)
+            vocabulary[term] = [offset, len(entries)]
+            offset += len(entries)
+
+        manifest = {'fingerprint': fingerprint, 'chunks': chunks, 'vocabulary': vocabulary}
+        os.makedirs(self.index_dir, exist_ok=True)
+        # Write under temporary names first, so readers never see half an index
+        postings_path = self._postings_path(fingerprint)
+        with open(f"{postings_path}.{os.getpid()}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{postings_path}.{os.getpid()}.tmp", postings_path)
+        with open(f"{manifest_path}.{os.getpid()}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(f"{manifest_path}.{os.getpid()}.tmp", manifest_path)
+        for name in os.listdir(self.index_dir):
+            if name.startswith('postings-') and name.endswith('.bin') and name != os.path.basename(postings_path):
+                os.remove(os.path.join(self.index_dir, name))
+        return manifest
+
+    def search(self, query, top_k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE):
+        """
+        Return up to top_k (score, chunk) pairs for the query, best first.
+        """
+        self.ensure()
+        scores = {}
+        for term in set(tokenize(query)):
+            entry = self._vocabulary.get(term)
+            if entry is None:
+                continue
+            offset, count = entry
+            view = memoryview(self._postings)[offset * _POSTING.size:(offset + count) * _POSTING.size]
+            for number, weight in _POSTING.iter_unpack(view):
+                scores[number] = scores.get(number, 0.0) + weight
+            view.release()
+        with self._lock:
+            self.searches += 1
+        best = sorted(((s, n) for n, s in scores.items() if s >= min_score), reverse=True)[:top_k]
+        return [(score, self.chunks[number]) for score, number in best]
+
+    def stats(self):
+        return {
+            'chunks': len(self.chunks),
+            'terms': len(self._vocabulary),
+            'searches': self.searches,
+        }
+
+
+def with_knowledge(question, results):
+    """
+    Return the question prefixed with the retrieved knowledge chunks.
+    """
+    knowledge = '\n\n'.join(chunk['text'] for _, chunk in results)
+    return (
+        "Relevant CCMI team knowledge (use it where it applies):\n\n"
+        f"{knowledge}\n\n---\n\nQuestion: {question}"
+    )
+
+
+# Shared instance used by every session in this process
+knowledge_index = KnowledgeIndex()
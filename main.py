@@ -1,31 +1,95 @@
 import streamlit as st
-import google.generativeai as genai
-import base64
-import os
+import re
+import uuid
+
+from attachments import ATTACHMENT_TYPES, attachment_store
+from assets import BACKGROUND_QUALITY, asset_cache, asset_url, background_css, optimized_path, picture_html, serving_mode
+from backends import backend
+from batch import batch_runner, parse_questions
+from chat_view import CHAT_WINDOW_SIZE, message_html, visible_window
+from conversation import CONTEXT_TOKEN_BUDGET, ContextWindow, Message
+from conversation_store import conversation_store
+from generation import run_generation
+from jobs import TooManyJobs, job_manager
+from key_validation import key_validator
+from knowledge import RETRIEVAL_ENABLED, active_system_prompt, knowledge_index
+from metrics import metrics
+from model_pool import preload
+from response_cache import response_cache
+from router import model_router
+from scheduler import scheduler
+from single_flight import single_flight
 
 # Initialize session state variables
 if 'api_key' not in st.session_state:
     st.session_state['api_key'] = ''
+if 'session_id' not in st.session_state:
+    # The conversation is identified by ?sid= so it survives reloads and server restarts
+    session_id = st.query_params.get('sid', '')
+    if not re.fullmatch(r'[0-9a-f]{32}', session_id):
+        session_id = uuid.uuid4().hex
+        st.query_params['sid'] = session_id
+    st.session_state['session_id'] = session_id
+    conversation_store.start_compaction()
+    for name, collector in (
+        ('jobs', job_manager.stats),
+        ('scheduler', scheduler.stats),
+        ('response_cache', response_cache.stats),
+        ('asset_cache', asset_cache.stats),
+        ('key_validation', key_validator.stats),
+        ('router', model_router.stats),
+        ('batch', batch_runner.stats),
+        ('knowledge', knowledge_index.stats),
+        ('single_flight', single_flight.stats),
+        ('attachments', attachment_store.stats),
+    ):
+        metrics.register_collector(name, collector)
+    metrics.start_exporters()
+    if RETRIEVAL_ENABLED:
+        # Build or map the knowledge index now rather than on the first question
+        knowledge_index.ensure()
 if 'conversation' not in st.session_state:
-    st.session_state['conversation'] = []
+    # Only the visible window is loaded; older messages are paged in on demand
+    st.session_state['conversation'] = conversation_store.load_page(st.session_state['session_id'], limit=CHAT_WINDOW_SIZE)
 if 'input' not in st.session_state:
     st.session_state['input'] = ''
-
-def get_base64(file_path):
+if 'context' not in st.session_state:
+    # Restored on first use by get_context(), after the page has rendered
+    st.session_state['context'] = None
+if 'active_job' not in st.session_state:
+    st.session_state['active_job'] = None
+if 'history_window' not in st.session_state:
+    st.session_state['history_window'] = CHAT_WINDOW_SIZE
+if 'turn_metrics' not in st.session_state:
+    st.session_state['turn_metrics'] = []
+if 'batch' not in st.session_state:
+    st.session_state['batch'] = None
+if 'attachment_uploader' not in st.session_state:
+    # Bumped after each upload, which replaces the uploader and frees the uploaded files
+    st.session_state['attachment_uploader'] = 0
+
+# How often the page polls an in-flight generation for new text, in seconds
+JOB_POLL_SECONDS = 0.3
+# How often the batch results table is refreshed while a batch runs, in seconds
+BATCH_POLL_SECONDS = 1.0
+
+BACKGROUND_IMAGE = 'images/background-image.png'
+# CSS width the background variant is sized for (it is stretched to cover the page)
+BACKGROUND_WIDTH = 960
+
+def get_base64(file_path, width=None):
     """
     Read an image and return its base64 encoded string.
+    If a display width is given, a resized variant of the image is encoded instead.
+    Served from the process-wide asset cache, so the file is only read once.
     """
-    if os.path.exists(file_path):
-        with open(file_path, 'rb') as f:
-            data = f.read()
-        return base64.b64encode(data).decode()
-    return ''
+    return asset_cache.get_base64(optimized_path(file_path, width))
 
-def inject_css():
+def build_css():
     """
-    Inject custom CSS to style the chatbot messages and interface.
+    Build the custom CSS block, including the embedded background image.
     """
-    st.markdown(f"""
+    return f"""
     <style>
     /* General styling to match the theme */
     body {{
@@ -40,7 +104,7 @@ def inject_css():
 
     .block-container::before {{
         content: "";
-        background-image: url('data:image/png;base64,{get_base64('images/background-image.png')}');
+        {background_css(BACKGROUND_IMAGE, BACKGROUND_WIDTH, BACKGROUND_QUALITY)}
         background-size: cover;
         background-repeat: no-repeat;
         background-position: center;
@@ -164,239 +228,392 @@ def inject_css():
     }}
 
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def inject_css():
+    """
+    Inject custom CSS to style the chatbot messages and interface.
+    The CSS block is built once per process and shared by all sessions.
+    """
+    css = asset_cache.get_derived(f"css:{serving_mode()}", [BACKGROUND_IMAGE], build_css)
+    st.markdown(css, unsafe_allow_html=True)
 
 def test_api_key(api_key):
     """
-    Test the provided API key by making a simple request.
+    Test the provided API key with a lightweight metadata request.
     Returns True if the key is valid, False otherwise.
+    Recently validated keys are answered from a short-lived cache.
     """
-    try:
-        # Configure the Generative AI client with the API key
-        genai.configure(api_key=api_key)
-        
-        # Initialize the Generative Model
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        
-        # Define a sample prompt
-        prompt = "Hello, this is a test prompt to validate the API key."
-        
-        # Generate content based on the prompt
-        response = model.generate_content(prompt)
-        
-        if response and response.text:
-            return True, "API key successfully validated."
-        else:
-            return False, "API key validation failed. No response received."
-    except Exception as e:
-        return False, f"API key validation error: {e}"
+    valid, message = key_validator.validate(api_key)
+    if not valid:
+        backend.discard(api_key)
+    else:
+        # Open the connection and prepare the model while the user reads the page
+        backend.start_warm_up(api_key, active_system_prompt())
+    return valid, message
+
+def get_context():
+    """
+    Return the session's context window, restoring it from the stored
+    summary and the messages after it on first use, independently of how
+    many messages are displayed. Restoring converts messages to model
+    contents, which loads the client library, so it is not done before the
+    page has rendered.
+    """
+    if st.session_state['context'] is None:
+        summary, summarized_seq, messages = conversation_store.load_context(
+            st.session_state['session_id'], CONTEXT_TOKEN_BUDGET
+        )
+        st.session_state['context'] = ContextWindow.restore(messages, summary, summarized_seq)
+    return st.session_state['context']
 
 def reset_conversation():
     """
     Resets the conversation history.
     """
+    if st.session_state['active_job'] is not None:
+        job_manager.cancel(st.session_state['active_job'])
+        job_manager.pop(st.session_state['active_job'])
+        st.session_state['active_job'] = None
+    conversation_store.delete_session(st.session_state['session_id'])
+    attachment_store.detach(st.session_state['session_id'])
     st.session_state['conversation'] = []
+    st.session_state['context'] = ContextWindow()
+    st.session_state['history_window'] = CHAT_WINDOW_SIZE
+    st.session_state['turn_metrics'] = []
+
+def append_message(role, content):
+    """
+    Append a message to the displayed conversation and to the structured
+    contents sent to the model. Only the new message is converted, so the
+    per-turn cost does not grow with the length of the conversation.
+    The message is also written to the persistent conversation store.
+    """
+    context = get_context()
+    conversation = st.session_state['conversation']
+    conversation.append(conversation_store.append(st.session_state['session_id'], role, content))
+    context.append(role, content, conversation[-1].seq)
+    # Older messages stay in the store; only keep what can be displayed in memory
+    excess = len(conversation) - st.session_state['history_window'] - CHAT_WINDOW_SIZE
+    if excess > 0:
+        del conversation[:excess]
+
+def record_turn_metrics(metrics):
+    """
+    Record perceived latency for the latest turn: time until the first chunk
+    arrived and time until the full answer was received, in seconds, plus how
+    many prompt tokens the context cache saved.
+    Token counts of the context window are recorded alongside.
+    """
+    st.session_state['turn_metrics'].append({
+        **metrics,
+        **get_context().report(),
+    })
 
 def send_message():
     """
     Sends the user's message to the AI model and updates the conversation.
+    The model call runs on the background worker pool; the page polls the job
+    in render_active_job() and appends the answer once it is finished.
     """
     user_input = st.session_state['input']
     if user_input.strip() != '':
-        # Append user message to conversation
-        st.session_state['conversation'].append({"role": "user", "content": user_input})
-        # Clear the input box
-        st.session_state['input'] = ''
-        try:
-            # Configure the Generative AI client with the API key
-            genai.configure(api_key=st.session_state['api_key'])
-
-            # Initialize the Generative Model
-            model = genai.GenerativeModel("gemini-1.5-flash")
-
-            # Build the prompt by concatenating conversation history
-            conversation_history = ''
-            # Define the enhanced initial system prompt
-            initial_prompt = """
-            You are an AI assistant embedded within the **CCMI Team**—a dedicated group of six data analysts specializing in **automation solutions**, **SharePoint integration**, **Power Automate workflows**, **Power BI reporting**, **VBA scripting**, **advanced Excel functions**, and **Power Apps development**. Your primary objective is to provide **clear, precise, and actionable guidance** tailored to the team's unique workflows and technical requirements.
-            
-            ### **Team Structure and Roles**
-            
-            The CCMI Team operates on a rotating schedule where members assume different roles each week:
-            
-            - **Server Role**:
-              - **Responsibilities**:
-                - Oversee the **prod server**, which runs **Task Till Dawn**—a scheduler executing Excel workbooks (templates with unique **CCMIxxx** IDs).
-                - Manage VBA macros within these workbooks to automate:
-                  - Data refreshes.
-                  - Execution of SAP scripts via SAP GUI.
-                  - Uploading data to SharePoint as **CCMIPBDSxxx** files.
-                  - Sending internal emails to the team, triggering Power Automate workflows to update **MIRA**, a Power App listing daily tasks.
-                - **Ensure** that all automated processes run smoothly without errors, addressing any runtime issues promptly.
-              - **Key Tools**: Task Till Dawn, VBA, SAP GUI, SharePoint, Power Automate, MIRA.
-            
-            - **Manual Role**:
-              - **Responsibilities**:
-                - Handle reports and processes that cannot be fully automated or require manual intervention.
-                - Run and debug Excel macros, ensuring data integrity and accuracy.
-              - **Key Tools**: Excel, VBA.
-            
-            - **Customer Support Role**:
-              - **Responsibilities**:
-                - Manage **ZohoDesk** to address and resolve inquiries from other teams.
-                - Provide timely and effective support, ensuring customer satisfaction.
-              - **Key Tools**: ZohoDesk.
-            
-            - **Buffer Role**:
-              - **Responsibilities**:
-                - Provide coverage for team members in the Server or Manual roles as needed.
-                - Ensure continuity of operations during absences such as sickness or vacations.
-              - **Key Tools**: All team tools as necessary.
-            
-            - **Development Projects**:
-              - **Responsibilities**:
-                - Work on assignments given by the team leader to enhance existing systems or develop new solutions.
-                - Innovate and implement improvements to streamline workflows and reporting capabilities.
-              - **Key Tools**: Power Apps, Power BI, SharePoint, VBA, Power Automate.
-            
-            ### **Reporting and Data Flow**
-            
-            - **Excel Templates**:
-              - Each template is identified by a unique **CCMIxxx** ID.
-              - Templates are run daily, weekly, or monthly, depending on their purpose.
-              - Most templates upload data to SharePoint as **CCMIPBDSxxx** files, which are used by Power BI dataflows.
-            
-            - **Power BI Integration**:
-              - **Power BI Reports**:
-                - Identified by **CCMIPBIxxx** IDs.
-                - Scheduled to refresh in the Power BI workspace.
-                - While the majority derive data from CCMI reports, some use SharePoint lists, direct SAP connections, or external data uploads.
-              - **Dataflows**:
-                - Correspond to **CCMIPBDSxxx** files, ensuring synchronized data updates.
-            
-            ### **AI Assistant's Role**
-            
-            As the AI assistant for the CCMI Team, leverage your deep understanding of the team's workflows, tools, and systems to provide **clear, precise, and actionable guidance**. Your responsibilities include:
-            
-            - **Coding**:
-              - Offer solutions and optimizations for various programming tasks.
-              - *Example*: Suggesting more efficient VBA scripts to reduce runtime.
-            
-            - **Excel Queries**:
-              - Help design and troubleshoot complex Excel functions and formulas.
-              - *Example*: Creating dynamic dashboards using advanced Excel features.
-            
-            - **VBA Scripts**:
-              - Aid in writing, debugging, and enhancing VBA macros.
-              - *Example*: Automating error handling within existing macros.
-            
-            - **Power Query & M Code**:
-              - Support data transformation and manipulation within Power BI.
-              - *Example*: Developing custom M scripts to clean and shape data for reporting.
-            
-            - **Automation Strategies**:
-              - Suggest improvements to existing workflows and automation processes.
-              - *Example*: Integrating new APIs to streamline data acquisition from external sources.
-            
-            - **Troubleshooting**:
-              - Diagnose and resolve issues in automated processes.
-              - *Example*: Identifying why a scheduled task failed and proposing fixes.
-            
-            - **Enhancing Reporting Capabilities**:
-              - Provide strategies to improve the accuracy, efficiency, and effectiveness of reports.
-              - *Example*: Implementing advanced visualization techniques in Power BI.
-            
-            - **Seamless Integration**:
-              - Ensure solutions integrate smoothly with existing systems and workflows.
-              - *Example*: Coordinating between SharePoint uploads and Power BI dataflows to maintain data consistency.
-            
-            ### **Guidelines for Responses**
-            
-            - **Professional and Approachable Tone**: Maintain a balance between professionalism and approachability to foster effective collaboration.
-              
-            - **Conciseness and Clarity**: Provide information in a clear and concise manner, avoiding unnecessary jargon unless contextually appropriate.
-            
-            - **Context Awareness**: Always consider the current context of the conversation, referencing relevant team roles, tools, and processes as needed.
-            
-            - **Proactive Assistance**: Anticipate potential follow-up questions or issues, offering additional insights or suggestions where applicable.
-            
-            - **Error Handling**: If unable to resolve a query, suggest next steps or recommend escalating the issue to a human team member.
-            
-            ### **Example Scenarios**
-            
-            1. **VBA Optimization**:
-               - **User Query**: "How can I optimize this VBA script to reduce runtime?"
-               - **AI Response**: "To optimize your VBA script, consider the following strategies:
-                 - **Disable Screen Updating**: Add `Application.ScreenUpdating = False` at the beginning and `Application.ScreenUpdating = True` at the end of your script.
-                 - **Use Efficient Loops**: Replace `For Each` loops with `For` loops where possible.
-                 - **Avoid Selecting Objects**: Directly reference objects instead of using `.Select` and `.Activate`.
-                 - **Example**:
-                   ```vba
-                   Sub OptimizedScript()
-                       Application.ScreenUpdating = False
-                       Dim i As Long
-                       For i = 1 To 1000
-                           ' Your code here
-                       Next i
-                       Application.ScreenUpdating = True
-                   End Sub
-                   ```
-                 - These changes can significantly reduce the execution time of your script."
-            
-            2. **Power BI Dataflow Issue**:
-               - **User Query**: "My Power BI dataflow isn't refreshing. What could be the issue?"
-               - **AI Response**: "There are several potential reasons why your Power BI dataflow isn't refreshing:
-                 - **Data Source Connectivity**: Ensure that the data sources are accessible and that there are no network issues.
-                 - **Credentials**: Verify that the credentials used for the data sources are up-to-date and have the necessary permissions.
-                 - **Scheduled Refresh Settings**: Check the refresh schedule in the Power BI workspace to ensure it's correctly configured.
-                 - **Error Logs**: Review the refresh history and error logs in Power BI to identify specific error messages.
-                 - **Resource Limits**: Ensure that your Power BI capacity isn't exceeding resource limits.
-                 - **Action Steps**:
-                   1. Navigate to the Power BI workspace and select the problematic dataflow.
-                   2. Check the refresh history for error details.
-                   3. Verify data source credentials under **Settings > Data Source Credentials**.
-                   4. Test the data source connections to ensure they're operational.
-                   5. If the issue persists, consider reaching out to the team lead for further assistance."
-            
-            ### **Final Instructions**
-            
-            Your responses should be **tailored to the CCMI Team's unique environment and challenges**, making team members feel as if you are an integral part of the team who comprehends every aspect of their work. Always strive to enhance the team's workflow and reporting capabilities through your guidance and support.
-            
-            """
-            
-            # Add the initial system prompt to the conversation history
-            conversation_history += initial_prompt
+        if st.session_state['active_job'] is not None:
+            # Keep the text in the box so it can be sent once the current answer is done
+            st.toast("Please wait for the current answer to finish, or stop it.")
+            return
+        with metrics.timer('stage_seconds', stage='send_message'):
+            # Append user message to conversation
+            append_message('user', user_input)
+            # Clear the input box
+            st.session_state['input'] = ''
+            try:
+                job = job_manager.submit(
+                    st.session_state['session_id'],
+                    run_generation,
+                    st.session_state['api_key'],
+                    get_context(),
+                )
+                st.session_state['active_job'] = job.id
+            except TooManyJobs as e:
+                metrics.inc('errors', error=type(e).__name__)
+                append_message('assistant', f"Error: {e}")
+
+def finish_job(job):
+    """
+    Append a finished job's answer to the conversation and record its metrics.
+    A job stopped before it started has no answer and leaves no turn behind.
+    """
+    job_manager.pop(job.id)
+    st.session_state['active_job'] = None
+    if job.started is None and job.error is None:
+        return
+    append_message('assistant', job.text if job.error is None else f"Error: {job.error}")
+    record_turn_metrics(job.metrics)
+    if get_context().summary:
+        conversation_store.save_summary(
+            st.session_state['session_id'], get_context().summary, get_context().summarized_seq
+        )
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_active_job():
+    """
+    Poll the in-flight generation and render its text as it streams in.
+    Only this fragment reruns while waiting; the full page reruns once the
+    answer is complete.
+    """
+    job_id = st.session_state['active_job']
+    job = job_manager.get(job_id) if job_id else None
+    if job is None:
+        # Nothing to poll, e.g. the job was collected by another rerun
+        st.session_state['active_job'] = None
+        return
+    if job.done:
+        finish_job(job)
+        st.rerun()
+    st.markdown(render_message('assistant', (job.text or '...') + ' ▌'), unsafe_allow_html=True)
+    if st.button("⏹ Stop generating", key=f"cancel_{job.id}"):
+        job_manager.cancel(job.id)
+
+def render_message(role, content):
+    """
+    Return the HTML for a single chat message.
+    """
+    avatar = 'images/assistant_profile.png' if role == 'assistant' else 'images/user_profile.png'
+    return message_html(role, content, asset_url(avatar, 40))
 
-            for message in st.session_state['conversation']:
-                if message['role'] == 'user':
-                    conversation_history += f"\nUser: {message['content']}"
-                else:
-                    conversation_history += f"\nAssistant: {message['content']}"
-            # Append current user input
-            conversation_history += "\nAssistant:"
+def render_turn_metrics():
+    """
+    Show perceived latency, cache and context usage of the last answer,
+    and which model tier answered it.
+    """
+    if not st.session_state['turn_metrics']:
+        return
+    last_turn = st.session_state['turn_metrics'][-1]
+    st.caption(
+        f"Last answer: first token after {last_turn.get('time_to_first_token', 0.0):.2f}s, "
+        f"complete after {last_turn.get('total_latency', 0.0):.2f}s"
+    )
+    if last_turn.get('response_cache') in ('exact', 'semantic'):
+        st.caption(
+            f"Answered from the {last_turn['response_cache']} response cache, "
+            f"saving {last_turn['latency_saved']:.2f}s"
+        )
+    if last_turn.get('response_cache') == 'coalesced':
+        st.caption("Shared the answer to the same question asked by someone else at the same time")
+    if last_turn.get('model'):
+        fallback = ", after the other tier failed" if last_turn['fallback'] else ""
+        st.caption(
+            f"Model: {last_turn['model']} ({last_turn['model_tier']} tier{fallback}), "
+            f"estimated cost ${last_turn['cost_usd']:.5f}"
+        )
+    if last_turn.get('knowledge'):
+        st.caption(f"Team knowledge used: {'; '.join(last_turn['knowledge'])}")
+    if last_turn.get('attachments'):
+        st.caption(f"Attachment parts used: {'; '.join(last_turn['attachments'])}")
+    if last_turn.get('prompt_tokens'):
+        st.caption(
+            f"Prompt cache ({last_turn['cache_mode']}): {last_turn['cached_tokens']:,} of "
+            f"{last_turn['prompt_tokens']:,} prompt tokens served from cache"
+        )
+    st.caption(
+        f"Context: {last_turn['context_tokens']:,} of {last_turn['context_budget']:,} tokens, "
+        f"{last_turn['summarized_messages']} earlier messages summarized"
+    )
+
+def load_earlier_messages():
+    """
+    Extend the displayed history window by another page of messages,
+    loading them from the conversation store if they are not in memory.
+    """
+    conversation = st.session_state['conversation']
+    st.session_state['history_window'] += CHAT_WINDOW_SIZE
+    missing = st.session_state['history_window'] - len(conversation)
+    first_seq = conversation[0].seq if conversation else None
+    if missing > 0 and first_seq:
+        conversation[:0] = conversation_store.load_page(
+            st.session_state['session_id'], before_seq=first_seq, limit=missing
+        )
+
+@st.fragment
+def render_chat():
+    """
+    Render the chat history window, the in-flight answer and the input box.
+    Running as a fragment, sending a message only reruns this part of the
+    page; the sidebar, CSS and header are not re-sent.
+    """
+    with metrics.timer('stage_seconds', stage='render_chat'):
+        render_chat_window()
 
-            # Generate AI response
-            response = model.generate_content(conversation_history)
+def render_chat_window():
+    """
+    Body of render_chat(), timed as one stage.
+    """
+    # Container for chat messages
+    st.markdown("<div class='chat-container'>", unsafe_allow_html=True)
+    hidden, messages = visible_window(st.session_state['conversation'], st.session_state['history_window'])
+    if hidden:
+        st.button(f"⬆ Load earlier messages ({hidden} hidden)", on_click=load_earlier_messages)
+    for chat in messages:
+        st.markdown(render_message(chat.role, chat.content), unsafe_allow_html=True)
+    if st.session_state['active_job'] is not None:
+        render_active_job()
+    st.markdown("</div>", unsafe_allow_html=True)
+
+    # Input for user to send messages
+    # Placed directly under the chat container without fixed positioning
+    st.markdown("<div class='input-box'>", unsafe_allow_html=True)
+    st.text_area("Type your message", key='input', on_change=send_message, height=150)
+    st.markdown("</div>", unsafe_allow_html=True)
+    render_attachments()
+    render_turn_metrics()
+
+    # Automatically scroll to the latest message
+    if st.session_state['conversation']:
+        st.markdown(
+            """
+            <script>
+            const chatContainer = document.querySelector('.chat-container');
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+            </script>
+            """,
+            unsafe_allow_html=True
+        )
+
+def attach_files():
+    """
+    Store the files picked in the attachment uploader, then replace the
+    uploader so the uploads are not kept in session memory.
+    """
+    for uploaded in st.session_state.get(f"attachments_{st.session_state['attachment_uploader']}") or []:
+        try:
+            attachment, new = attachment_store.attach(st.session_state['session_id'], uploaded.name, uploaded)
+        except ValueError as e:
+            st.toast(str(e))
+            continue
+        if new:
+            st.toast(f"Attached {uploaded.name} ({attachment['chunks']:,} parts).")
+        else:
+            st.toast(f"Attached {uploaded.name} (already stored, reused).")
+    st.session_state['attachment_uploader'] += 1
 
-            ai_response = response.text.strip() if response and response.text else "I'm sorry, I couldn't generate a response."
+def detach_file(file_hash):
+    attachment_store.detach(st.session_state['session_id'], file_hash)
 
-            # Append AI response to conversation
-            st.session_state['conversation'].append({"role": "assistant", "content": ai_response})
+def render_attachments():
+    """
+    Attach VBA modules, workbooks, M scripts and CSV files to the conversation.
+    They are stored once, outside the conversation; each question only
+    carries the parts of them relevant to it.
+    """
+    attachments = attachment_store.attachments(st.session_state['session_id'])
+    with st.expander(f"📎 Attachments ({len(attachments)})" if attachments else "📎 Attach files"):
+        st.file_uploader(
+            "VBA modules (.bas, .cls), workbooks (.xlsm, .xlsx), M scripts (.pq, .m) or CSV files",
+            type=list(ATTACHMENT_TYPES),
+            accept_multiple_files=True,
+            key=f"attachments_{st.session_state['attachment_uploader']}",
+            on_change=attach_files,
+        )
+        for attachment in attachments:
+            name_column, button_column = st.columns([5, 1])
+            name_column.caption(
+                f"{attachment['name']}: {max(attachment['size'] / 1024, 1):,.0f} KB, {attachment['chunks']:,} parts"
+                + (f" ({attachment['notes']})" if attachment['notes'] else "")
+            )
+            button_column.button(
+                "Remove", key=f"detach_{attachment['hash']}", on_click=detach_file, args=(attachment['hash'],)
+            )
 
-        except Exception as e:
-            st.session_state['conversation'].append({"role": "assistant", "content": f"Error: {e}"})
+def start_batch(uploaded, pasted):
+    """
+    Parse the uploaded file (or else the pasted list) and start answering its questions.
+    """
+    try:
+        if uploaded is not None:
+            # utf-8-sig: Excel's "CSV UTF-8" files start with a byte order mark
+            questions = parse_questions(uploaded.getvalue().decode('utf-8-sig'), uploaded.name)
+        else:
+            questions = parse_questions(pasted)
+    except (ValueError, KeyError, TypeError, UnicodeDecodeError) as e:
+        st.error(f"Could not read the questions: {e}")
+        return
+    if not questions:
+        st.warning("Please upload or paste at least one question.")
+        return
+    try:
+        batch = batch_runner.submit(st.session_state['api_key'], questions)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    st.session_state['batch'] = batch.id
+
+def render_batch_table(batch):
+    """
+    Show the batch results as a table, with a progress bar while it runs.
+    """
+    finished, total = batch.progress()
+    if not batch.done:
+        st.progress(finished / total if total else 1.0, text=f"{finished} of {total} questions answered")
+    st.dataframe(
+        [{key: row[key] for key in ('index', 'status', 'question', 'answer', 'model', 'latency')} for row in batch.rows()],
+        hide_index=True,
+    )
+
+@st.fragment(run_every=BATCH_POLL_SECONDS)
+def render_batch_progress():
+    """
+    Poll the running batch and refresh its results as questions finish.
+    The full page reruns once the batch is complete, to offer the exports.
+    """
+    batch = batch_runner.get(st.session_state['batch'])
+    if batch is None or batch.done:
+        st.rerun()
+    render_batch_table(batch)
+    if st.button("⏹ Stop batch", key=f"cancel_batch_{batch.id}"):
+        batch.cancel()
+
+def render_batch():
+    """
+    Batch mode: answer an uploaded file or pasted list of questions
+    concurrently and export the results as CSV or JSON.
+    """
+    st.subheader("Batch Questions")
+    batch = batch_runner.get(st.session_state['batch']) if st.session_state['batch'] else None
+    running = batch is not None and not batch.done
+    uploaded = st.file_uploader("Upload questions (.txt, .csv or .json)", type=['txt', 'csv', 'json'])
+    pasted = st.text_area(
+        "Or paste them, one per line (separate multi-line questions with a blank line)",
+        key='batch_input',
+        height=150,
+    )
+    if st.button("Run batch", disabled=running):
+        start_batch(uploaded, pasted)
+        batch = batch_runner.get(st.session_state['batch']) if st.session_state['batch'] else None
+        running = batch is not None and not batch.done
+
+    if batch is None:
+        return
+    if running:
+        render_batch_progress()
+        return
+    render_batch_table(batch)
+    answered = sum(1 for item in batch.items if item.status == 'done')
+    st.caption(f"{answered} of {len(batch.items)} questions answered in {batch.finished - batch.created:.1f}s")
+    col_csv, col_json = st.columns(2)
+    col_csv.download_button("Download CSV", batch.to_csv(), file_name='batch_results.csv', mime='text/csv')
+    col_json.download_button("Download JSON", batch.to_json(), file_name='batch_results.json', mime='application/json')
 
 def main():
     st.set_page_config(page_title="CCMI Gen AI Assistant", layout="wide")
-    inject_css()
 
     st.title("🗨️ CCMI Gen AI Assistant")
     # Display the image using st.image
-    st.image('images/teamlogo.png', width=100)
+    st.image(optimized_path('images/teamlogo.png', 200), width=100)
 
     # Sidebar content
     # Display the logo using st.sidebar.image
-    st.sidebar.image('images/teamlogo.png', width=200)
+    st.sidebar.image(optimized_path('images/teamlogo.png', 200), width=200)
 
     if not st.session_state['api_key']:
         st.subheader("🔑 Enter Your Google API Key")
@@ -415,30 +632,30 @@ def main():
         with st.expander("📖 Follow these steps to obtain an API key:"):
             # Step 1
             st.markdown("<div class='instructions-step'>1. Go to the <a class='instructions-link' href='https://console.cloud.google.com' target='_blank'>Google Cloud Console</a></div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='instructions-image'><img src='data:image/png;base64,{get_base64('api_pics/step1.png')}' width='200'></div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='instructions-image'>{picture_html('api_pics/step1.png', 200)}</div>", unsafe_allow_html=True)
 
             # Step 2
             st.markdown("<div class='instructions-step'>2. Create a new project, <b>choose a name</b>, and click <b>'Create'</b></div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='instructions-image'><img src='data:image/png;base64,{get_base64('api_pics/step2.png')}' width='200'></div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='instructions-image'>{picture_html('api_pics/step2.png', 200)}</div>", unsafe_allow_html=True)
 
             # Step 3
             st.markdown("<div class='instructions-step'>3. Now go to the <a class='instructions-link' href='https://aistudio.google.com/' target='_blank'>Google AI Studio</a></div>", unsafe_allow_html=True)
 
             # Step 4
             st.markdown("<div class='instructions-step'>4. Click <b>'Get API Key'</b></div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='instructions-image'><img src='data:image/png;base64,{get_base64('api_pics/step3.png')}' width='200'></div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='instructions-image'>{picture_html('api_pics/step3.png', 200)}</div>", unsafe_allow_html=True)
 
             # Step 5
             st.markdown("<div class='instructions-step'>5. Click <b>'Create API Key'</b></div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='instructions-image'><img src='data:image/png;base64,{get_base64('api_pics/step4.png')}' width='200'></div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='instructions-image'>{picture_html('api_pics/step4.png', 200)}</div>", unsafe_allow_html=True)
 
             # Step 6
             st.markdown("<div class='instructions-step'>6. Select the project you created earlier</div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='instructions-image'><img src='data:image/png;base64,{get_base64('api_pics/step5.png')}' width='200'></div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='instructions-image'>{picture_html('api_pics/step5.png', 200)}</div>", unsafe_allow_html=True)
 
             # Step 7
             st.markdown("<div class='instructions-step'>7. Click <b>'Create API Key...'</b></div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='instructions-image'><img src='data:image/png;base64,{get_base64('api_pics/step6.png')}' width='200'></div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='instructions-image'>{picture_html('api_pics/step6.png', 200)}</div>", unsafe_allow_html=True)
 
             # Step 8
             st.markdown("<div class='instructions-step'>8. Copy the API key and <b>store it securely</b></div>", unsafe_allow_html=True)
@@ -484,11 +701,10 @@ def main():
             </div>
         """, unsafe_allow_html=True)
 
-        image_base64 = get_base64('images/banner.png')
         st.sidebar.markdown(f"""
             <br>
             <div style='text-align: center;'>
-                <img src="data:image/png;base64,{image_base64}" width="300">
+                {picture_html('images/banner.png', 300)}
             </div>
         """, unsafe_allow_html=True)
 
@@ -498,6 +714,7 @@ def main():
     else:
         # Sidebar content for the main chat interface
         st.sidebar.header("🔧 Settings")
+        mode = st.sidebar.radio("Mode", ["Chat", "Batch"], horizontal=True)
         if st.sidebar.button("Reset Conversation"):
             reset_conversation()
             st.sidebar.success("Conversation has been reset.")
@@ -559,63 +776,37 @@ def main():
             </div>
         """, unsafe_allow_html=True)
 
-        image_base64 = get_base64('images/banner.png')
         st.sidebar.markdown(f"""
             <br>
             <div style='text-align: center;'>
-                <img src="data:image/png;base64,{image_base64}" width="300">
+                {picture_html('images/banner.png', 300)}
             </div>
         """, unsafe_allow_html=True)
 
 
         
-        # Welcome message
-        st.subheader("Start Chatting with CCMI Gen AI")
-
-        # Add initial greeting message if conversation is empty
-        if not st.session_state['conversation']:
-            initial_message = {
-                "role": "assistant",
-                "content": "👋 Hello! I'm your Generative AI assistant, developed by Naadir, here to assist you with coding challenges, Excel queries, VBA scripts, Power Query, M code, and more. Feel free to ask me anything to streamline your data analysis tasks!"
-            }
-            st.session_state['conversation'].append(initial_message)
-
-        # Container for chat messages
-        st.markdown("<div class='chat-container'>", unsafe_allow_html=True)
-        for chat in st.session_state['conversation']:
-            if chat['role'] == 'assistant':
-                st.markdown(f"""
-                <div class='message-row assistant'>
-                    <img src="data:image/png;base64,{get_base64('images/assistant_profile.png')}" class='profile-pic' />
-                    <div class='message-text'>{chat['content']}</div>
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.markdown(f"""
-                <div class='message-row user'>
-                    <img src="data:image/png;base64,{get_base64('images/user_profile.png')}" class='profile-pic' />
-                    <div class='message-text'>{chat['content']}</div>
-                </div>
-                """, unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-
-        # Input for user to send messages
-        # Placed directly under the chat container without fixed positioning
-        st.markdown("<div class='input-box'>", unsafe_allow_html=True)
-        st.text_area("Type your message", key='input', on_change=send_message, height=150)
-        st.markdown("</div>", unsafe_allow_html=True)
-
-        # Automatically scroll to the latest message
-        if st.session_state['conversation']:
-            st.markdown(
-                """
-                <script>
-                const chatContainer = document.querySelector('.chat-container');
-                chatContainer.scrollTop = chatContainer.scrollHeight;
-                </script>
-                """,
-                unsafe_allow_html=True
-            )
+        if mode == "Batch":
+            render_batch()
+        else:
+            # Welcome message
+            st.subheader("Start Chatting with CCMI Gen AI")
+
+            # Add initial greeting message if conversation is empty
+            # (display only; it is not part of the contents sent to the model)
+            if not st.session_state['conversation']:
+                initial_message = Message(
+                    "assistant",
+                    "👋 Hello! I'm your Generative AI assistant, developed by Naadir, here to assist you with coding challenges, Excel queries, VBA scripts, Power Query, M code, and more. Feel free to ask me anything to streamline your data analysis tasks!",
+                )
+                st.session_state['conversation'].append(initial_message)
+
+            render_chat()
+
+    # The CSS (with its background image) is sent after the page content so it
+    # does not hold up the first paint, then the client library is loaded in the background
+    inject_css()
+    preload()
 
 if __name__ == "__main__":
-    main()
+    with metrics.timer('stage_seconds', stage='render_page'):
+        main()
@@ -0,0 +1,234 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Instrumentation is off unless enabled; when off, every call returns immediately
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+
+# Port of the Prometheus text endpoint (0 disables it) and interval of the JSON log (0 disables it)
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9464))
+
+# Interface the endpoint listens on; only this machine by default. Set to 0.0.0.0
+# to let a Prometheus server elsewhere scrape it.
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_LOG_INTERVAL_SECONDS = float(os.environ.get('METRICS_LOG_INTERVAL_SECONDS', 60))
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_PREFIX = 'assistant_'
+
+logger = logging.getLogger('metrics')
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{str(v)}"' for k, v in pairs) + '}'
+
+
+class Metrics:
+    """
+    Process-wide counters and latency histograms for the chat pipeline.
+
+    Stages are timed with `with metrics.timer('stage_seconds', stage=...)`;
+    sizes and events are counted with inc(). Stats of the shared caches and
+    pools are pulled from registered collectors only when metrics are read.
+    Everything is exposed as Prometheus text on METRICS_PORT and/or logged
+    as JSON every METRICS_LOG_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+        self._exporting = False
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram.count += 1
+            histogram.sum += seconds
+
+    def timer(self, name, **labels):
+        """
+        Context manager recording the time spent in its block.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def register_collector(self, name, fn):
+        """
+        Register fn() returning a dict of numeric stats, exported as gauges named `<name>_<key>`.
+        """
+        with self._lock:
+            self._collectors[name] = fn
+
+    def _gauges(self):
+        with self._lock:
+            collectors = list(self._collectors.items())
+        gauges = {}
+        for name, fn in collectors:
+            try:
+                stats = fn()
+            except Exception:
+                continue
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[f"{name}_{key}"] = value
+        return gauges
+
+    def snapshot(self):
+        """
+        Return all metrics as a JSON-serializable dict.
+        """
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(key), 'value': value}
+                for (name, key), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {'name': name, 'labels': dict(key), 'count': h.count, 'sum': round(h.sum, 6)}
+                for (name, key), h in sorted(self._histograms.items())
+            ]
+        return {'time': time.time(), 'counters': counters, 'histograms': histograms, 'gauges': self._gauges()}
+
+    def render_prometheus(self):
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (name, key, list(h.buckets), h.count, h.sum) for (name, key), h in self._histograms.items()
+            )
+        typed = set()
+        for (name, key), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {_PREFIX}{name}_total counter")
+                typed.add(name)
+            lines.append(f"{_PREFIX}{name}_total{_format_labels(key)} {value}")
+        for name, key, buckets, count, total in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {_PREFIX}{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += n
+                lines.append(f"{_PREFIX}{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{_PREFIX}{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{_PREFIX}{name}_count{_format_labels(key)} {count}")
+        for name, value in sorted(self._gauges().items()):
+            lines.append(f"# TYPE {_PREFIX}{name} gauge")
+            lines.append(f"{_PREFIX}{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def start_exporters(self, port=METRICS_PORT, log_interval=METRICS_LOG_INTERVAL_SECONDS, host=METRICS_HOST):
+        """
+        Start the HTTP endpoint and the periodic JSON log (once per process, only when enabled).
+        If the port cannot be bound (e.g. it is already in use), the failure is
+        logged and the app runs without the endpoint.
+        """
+        with self._lock:
+            if not self.enabled or self._exporting:
+                return
+            self._exporting = True
+        if not logger.handlers:
+            logger.addHandler(logging.StreamHandler())
+            logger.setLevel(logging.INFO)
+        if port:
+            try:
+                server = ThreadingHTTPServer((host, port), _handler(self))
+            except OSError as e:
+                logger.warning("Metrics endpoint not started on %s:%s: %s", host, port, e)
+            else:
+                threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        if log_interval:
+            threading.Thread(target=self._log_loop, args=(log_interval,), name='metrics-log', daemon=True).start()
+
+    def _log_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            logger.info(json.dumps(self.snapshot()))
+
+
+def _handler(metrics):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+
+# Shared instance used by every session in this process
+metrics = Metrics()
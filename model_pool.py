@@ -0,0 +1,173 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Model used for most chat turns and for API key validation
+MODEL_NAME = "gemini-1.5-flash"
+
+# Stronger model used for turns the router classifies as complex
+STRONG_MODEL_NAME = os.environ.get('STRONG_MODEL_NAME', 'gemini-1.5-pro')
+
+# Maximum number of API keys with live clients, and how long an unused one is kept
+MODEL_POOL_MAX_KEYS = int(os.environ.get('MODEL_POOL_MAX_KEYS', 64))
+MODEL_POOL_IDLE_SECONDS = float(os.environ.get('MODEL_POOL_IDLE_SECONDS', 30 * 60))
+
+
+def key_id(api_key):
+    """
+    Return a stable identifier for an API key that does not reveal the key.
+    """
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+def _genai():
+    # google.generativeai takes most of a second to import, so it is only
+    # loaded when first needed (or ahead of time by preload())
+    import google.generativeai as genai
+    return genai
+
+
+_preload_started = threading.Event()
+
+
+def preload():
+    """
+    Import google.generativeai on a background thread (once per process), so
+    the page can render first and the first key check or question does not
+    wait for the import.
+    """
+    if _preload_started.is_set():
+        return
+    _preload_started.set()
+    threading.Thread(target=_genai, name='genai-preload', daemon=True).start()
+
+
+class _PoolEntry:
+    def __init__(self, api_key):
+        from google.generativeai.client import _ClientManager
+        # A private client manager keeps this key's clients and transport
+        # separate from genai.configure(), which is process-global
+        self.client_manager = _ClientManager()
+        self.client_manager.configure(api_key=api_key)
+        self.models = {}
+        self.last_used = time.monotonic()
+
+    def close(self):
+        for client in self.client_manager.clients.values():
+            transport = getattr(client, 'transport', None)
+            if transport is not None:
+                try:
+                    transport.close()
+                except Exception:
+                    pass
+        self.client_manager.clients = {}
+        self.models = {}
+
+
+class ModelPool:
+    """
+    Bounded pool of Gemini clients and model handles, one client per API key.
+
+    Each key gets its own client (and so its own reusable, kept-alive
+    transport), and model handles are bound to that client directly instead
+    of going through the global genai.configure(). Concurrent sessions with
+    different keys therefore never race on shared state. Keys that have not
+    been used for MODEL_POOL_IDLE_SECONDS, or that fall out of the LRU bound,
+    are evicted and their transports closed.
+    """
+
+    def __init__(self, max_keys=MODEL_POOL_MAX_KEYS, idle_seconds=MODEL_POOL_IDLE_SECONDS):
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, api_key):
+        # Caller must hold self._lock
+        ident = key_id(api_key)
+        self._evict_idle()
+        entry = self._entries.get(ident)
+        if entry is None:
+            entry = _PoolEntry(api_key)
+            self._entries[ident] = entry
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)[1].close()
+                self.evicted += 1
+        self._entries.move_to_end(ident)
+        entry.last_used = time.monotonic()
+        return entry
+
+    def _bound_model(self, api_key, handle_key, factory):
+        with self._lock:
+            entry = self._entry(api_key)
+            model = entry.models.get(handle_key)
+            if model is None:
+                self.created += 1
+                model = factory()
+                model._client = entry.client_manager.get_default_client('generative')
+                entry.models[handle_key] = model
+            else:
+                self.reused += 1
+            return model
+
+    def get_model(self, api_key, model_name=MODEL_NAME, system_instruction=None):
+        """
+        Return a GenerativeModel bound to the client for this API key.
+        """
+        instruction_hash = hashlib.sha256(system_instruction.encode()).hexdigest() if system_instruction else None
+        return self._bound_model(
+            api_key,
+            (model_name, instruction_hash),
+            lambda: _genai().GenerativeModel(model_name, system_instruction=system_instruction),
+        )
+
+    def get_cached_model(self, api_key, cached_content):
+        """
+        Return a GenerativeModel that uses server-side cached content, bound to
+        the client for this API key.
+        """
+        return self._bound_model(
+            api_key,
+            ('cached', cached_content.name),
+            lambda: _genai().GenerativeModel.from_cached_content(cached_content),
+        )
+
+    def get_client(self, api_key, service):
+        """
+        Return the pooled low-level client for a service (e.g. 'cache') for this API key.
+        """
+        with self._lock:
+            return self._entry(api_key).client_manager.get_default_client(service)
+
+    def discard(self, api_key):
+        """
+        Drop the client for an API key, e.g. after it failed validation.
+        """
+        with self._lock:
+            entry = self._entries.pop(key_id(api_key), None)
+        if entry is not None:
+            entry.close()
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for ident in [i for i, e in self._entries.items() if e.last_used < cutoff]:
+            self._entries.pop(ident).close()
+            self.evicted += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'keys': len(self._entries),
+                'models_created': self.created,
+                'models_reused': self.reused,
+                'evicted': self.evicted,
+            }
+
+
+# Shared instance used by every session in this process
+model_pool = ModelPool()
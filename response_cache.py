@@ -0,0 +1,185 @@
+import array
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# On-disk location of the response cache
+RESPONSE_CACHE_PATH = os.environ.get(
+    'RESPONSE_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'responses.sqlite3'),
+)
+
+# Entries expire after this long, and the least recently used are evicted beyond the cap
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', 7 * 24 * 60 * 60))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 5000))
+
+# Optional similarity tier: a local hashed bag-of-words embedding and a cosine threshold
+RESPONSE_CACHE_SEMANTIC = os.environ.get('RESPONSE_CACHE_SEMANTIC', '0') == '1'
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get('RESPONSE_CACHE_SIMILARITY', 0.92))
+
+# Number of dimensions of the local embedding, and how many candidates the similarity tier scans
+EMBEDDING_DIMENSIONS = 256
+SEMANTIC_SCAN_LIMIT = 500
+
+_WORD_RE = re.compile(r"[a-z0-9_]+")
+
+
+def normalize_prompt(text):
+    """
+    Normalize a question so trivial differences (case, whitespace, trailing
+    punctuation) map to the same cache key.
+    """
+    return ' '.join(text.lower().split()).rstrip('?!. ')
+
+
+def embed(text):
+    """
+    Return a unit-length hashed bag-of-words embedding (unigrams and bigrams).
+    Purely local and deterministic, good enough to catch rephrasings.
+    """
+    words = _WORD_RE.findall(text.lower())
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], 'little') % EMBEDDING_DIMENSIONS
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return array.array('f', (v / norm for v in vector))
+
+
+class CachedResponse:
+    def __init__(self, text, tier, latency_saved):
+        self.text = text
+        self.tier = tier
+        self.latency_saved = latency_saved
+
+
+class ResponseCache:
+    """
+    Two-tier cache of model answers in front of the model call.
+
+    The exact tier is keyed on the normalized question plus a hash of the
+    conversation before it (and the system prompt/model, via `scope`). The
+    optional similarity tier compares local embeddings of questions asked in
+    the same context. Entries live in SQLite with TTL expiry and LRU eviction.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES, semantic=RESPONSE_CACHE_SEMANTIC,
+                 similarity=RESPONSE_CACHE_SIMILARITY):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.semantic = semantic
+        self.similarity = similarity
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        # Caller must hold self._lock
+        if self._conn is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                ' key TEXT PRIMARY KEY, context TEXT NOT NULL, question TEXT NOT NULL,'
+                ' embedding BLOB, response TEXT NOT NULL, latency REAL NOT NULL,'
+                ' created REAL NOT NULL, last_used REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS responses_context ON responses (context, last_used)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        return self._conn
+
+    @staticmethod
+    def _key(question, context):
+        return hashlib.sha256(f"{context}\0{normalize_prompt(question)}".encode()).hexdigest()
+
+    def lookup(self, question, context):
+        """
+        Return a CachedResponse for the question asked in this context, or None.
+        """
+        now = time.time()
+        expired = now - self.ttl_seconds
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT key, response, latency FROM responses WHERE key = ? AND created > ?',
+                (self._key(question, context), expired),
+            ).fetchone()
+            tier = 'exact'
+            if row is None and self.semantic:
+                row = self._similar(conn, question, context, expired)
+                tier = 'semantic'
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (now, row[0]))
+            conn.commit()
+            if tier == 'exact':
+                self.exact_hits += 1
+            else:
+                self.semantic_hits += 1
+            self.latency_saved += row[2]
+            return CachedResponse(row[1], tier, row[2])
+
+    def _similar(self, conn, question, context, expired):
+        query = embed(normalize_prompt(question))
+        best, best_score = None, self.similarity
+        rows = conn.execute(
+            'SELECT key, response, latency, embedding FROM responses'
+            ' WHERE context = ? AND created > ? ORDER BY last_used DESC LIMIT ?',
+            (context, expired, SEMANTIC_SCAN_LIMIT),
+        )
+        for key, response, latency, blob in rows:
+            candidate = array.array('f')
+            candidate.frombytes(blob)
+            score = sum(a * b for a, b in zip(query, candidate))
+            if score >= best_score:
+                best, best_score = (key, response, latency), score
+        return best
+
+    def store(self, question, context, response, latency):
+        """
+        Store a complete answer together with the time it took to generate.
+        """
+        now = time.time()
+        embedding = embed(normalize_prompt(question)).tobytes()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (self._key(question, context), context, normalize_prompt(question), embedding,
+                 response, latency, now, now),
+            )
+            conn.execute('DELETE FROM responses WHERE created <= ?', (now - self.ttl_seconds,))
+            conn.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM responses'
+                ' ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,),
+            )
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                'exact_hits': self.exact_hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+                'latency_saved': self.latency_saved,
+            }
+
+
+# Shared instance used by every session in this process
+response_cache = ResponseCache()
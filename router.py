@@ -0,0 +1,161 @@
+import os
+import re
+import threading
+
+from google.api_core import exceptions as google_exceptions
+
+from backends import FAST_TIER, STRONG_TIER
+from scheduler import DeadlineExceeded
+
+# 'auto' routes by complexity; 'fast' or 'strong' send every turn to one tier
+ROUTER_MODE = os.environ.get('ROUTER_MODE', 'auto')
+
+# A question scoring at least this much goes to the strong tier
+ROUTER_STRONG_SCORE = int(os.environ.get('ROUTER_STRONG_SCORE', 3))
+
+# Questions longer than this many characters, or with this many lines of code, count as complex
+ROUTER_LONG_CHARS = int(os.environ.get('ROUTER_LONG_CHARS', 1500))
+ROUTER_CODE_LINES = int(os.environ.get('ROUTER_CODE_LINES', 8))
+
+# Time the first tier gets to stream the first chunk of an answer before the other tier is tried;
+# once it has started, the answer has the rest of the turn's deadline
+ROUTER_PRIMARY_DEADLINE_SECONDS = float(os.environ.get('ROUTER_PRIMARY_DEADLINE_SECONDS', 30))
+
+# USD per million prompt and response tokens (Gemini 1.5 list prices for prompts up to 128k tokens)
+TIER_PRICES = {
+    FAST_TIER: (0.075, 0.30),
+    STRONG_TIER: (1.25, 5.00),
+}
+
+# Errors after which the other tier is tried: timeouts and quota exhaustion
+FALLBACK_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.DeadlineExceeded,
+    DeadlineExceeded,
+    TimeoutError,
+)
+
+_CODE_LINE_RE = re.compile(
+    r"^\s*(sub |end sub|function |end function|dim |set |if .* then|for each |next\b|let\b|in\b|#\"|=\s*table\.|"
+    r"calculate\(|var |return\b|[a-z_][\w.]*\s*=\s*\S)",
+    re.IGNORECASE,
+)
+_DOMAIN_RE = re.compile(r"\b(vba|macros?|m code|power query|dax|measures?|pivot|userform|api)\b", re.IGNORECASE)
+_TASK_RE = re.compile(
+    r"\b(debug|fix|error|bug|optimi[sz]e|refactor|rewrite|convert|translate|explain (this|the) code)\b",
+    re.IGNORECASE,
+)
+
+
+class Route:
+    def __init__(self, tier, score, reasons):
+        self.tier = tier
+        self.score = score
+        self.reasons = reasons
+
+
+def classify(text):
+    """
+    Return a Route for a question, scored cheaply and locally: long
+    questions, pasted code, domain keywords (VBA, M code, DAX...) and
+    debugging/rewriting tasks push it towards the strong tier.
+    """
+    score, reasons = 0, []
+    if len(text) >= ROUTER_LONG_CHARS:
+        score += 2
+        reasons.append('long')
+    code_lines = sum(1 for line in text.splitlines() if _CODE_LINE_RE.match(line))
+    if '```' in text or code_lines >= ROUTER_CODE_LINES:
+        score += 2
+        reasons.append('code')
+    domains = {m.lower() for m in _DOMAIN_RE.findall(text)}
+    if domains:
+        score += 1
+        reasons.append('domain')
+    tasks = {m[0].lower() for m in _TASK_RE.findall(text)}
+    if tasks:
+        score += min(2, len(tasks))
+        reasons.append('task')
+    return Route(STRONG_TIER if score >= ROUTER_STRONG_SCORE else FAST_TIER, score, reasons)
+
+
+class _TierStats:
+    def __init__(self):
+        self.routed = 0
+        self.calls = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self.latency = 0.0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.cost = 0.0
+
+
+class ModelRouter:
+    """
+    Choose the model tier for each turn and keep per-tier latency, token and
+    cost totals, so the thresholds can be tuned against real traffic.
+    """
+
+    def __init__(self, mode=ROUTER_MODE):
+        self.mode = mode
+        self._tiers = {tier: _TierStats() for tier in TIER_PRICES}
+        self._lock = threading.Lock()
+
+    def route(self, text):
+        route = classify(text) if self.mode == 'auto' else Route(self.mode, 0, ['forced'])
+        with self._lock:
+            self._tiers[route.tier].routed += 1
+        return route
+
+    @staticmethod
+    def fallback(tier):
+        """
+        Return the tier to try when `tier` times out or runs out of quota.
+        """
+        return STRONG_TIER if tier == FAST_TIER else FAST_TIER
+
+    @staticmethod
+    def cost(tier, prompt_tokens, response_tokens):
+        prompt_price, response_price = TIER_PRICES[tier]
+        return (prompt_tokens * prompt_price + response_tokens * response_price) / 1_000_000
+
+    def record(self, tier, latency, prompt_tokens, response_tokens, fallback=False):
+        """
+        Record a turn answered by `tier` and return its estimated cost in USD.
+        """
+        cost = self.cost(tier, prompt_tokens, response_tokens)
+        with self._lock:
+            stats = self._tiers[tier]
+            stats.calls += 1
+            stats.fallbacks += int(fallback)
+            stats.latency += latency
+            stats.prompt_tokens += prompt_tokens
+            stats.response_tokens += response_tokens
+            stats.cost += cost
+        return cost
+
+    def record_failure(self, tier):
+        with self._lock:
+            self._tiers[tier].failures += 1
+
+    def stats(self):
+        with self._lock:
+            report = {}
+            for tier, stats in self._tiers.items():
+                report.update({
+                    f"{tier}_routed": stats.routed,
+                    f"{tier}_calls": stats.calls,
+                    f"{tier}_fallbacks": stats.fallbacks,
+                    f"{tier}_failures": stats.failures,
+                    f"{tier}_average_latency": stats.latency / stats.calls if stats.calls else 0.0,
+                    f"{tier}_prompt_tokens": stats.prompt_tokens,
+                    f"{tier}_response_tokens": stats.response_tokens,
+                    f"{tier}_cost_usd": stats.cost,
+                })
+            return report
+
+
+# Shared instance used by every session in this process
+model_router = ModelRouter()
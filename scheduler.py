@@ -0,0 +1,307 @@
+import os
+import random
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+from model_pool import key_id
+from shared_state import shared_state
+
+# Requests per minute allowed per API key, and how many may be sent in a burst
+RATE_LIMIT_RPM = float(os.environ.get('RATE_LIMIT_RPM', 15))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 5))
+
+# Retry policy for transient failures: exponential backoff with full jitter
+MAX_ATTEMPTS = int(os.environ.get('SCHEDULER_MAX_ATTEMPTS', 5))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+
+# The circuit opens after this many consecutive transient failures and stays open this long
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_COOLDOWN_SECONDS = float(os.environ.get('CIRCUIT_COOLDOWN_SECONDS', 30))
+
+# Default time budget for a request, including queueing and retries
+DEFAULT_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', 120))
+
+# Per-key state unused for this long is dropped
+_IDLE_STATE_SECONDS = 60 * 60
+
+# Quota errors are retried but do not count towards opening the circuit
+_THROTTLED = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+_TRANSIENT = (
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class CircuitOpen(Exception):
+    """
+    Raised without calling the model while the circuit breaker for a key is open.
+    """
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a request cannot be sent or retried within its deadline.
+    """
+
+
+class TokenBucket:
+    """
+    Classic token bucket. reserve() takes a token and returns how long the
+    caller has to wait for it, so waiting callers are served in order.
+    """
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, now):
+        with self._lock:
+            return self._reserve(now)
+
+    def refund(self):
+        with self._lock:
+            self._refund()
+
+    def _reserve(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def _refund(self):
+        self.tokens += 1
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket kept in the shared store, so all workers draw on one rate
+    limit per key. Uses wall-clock time, which the workers agree on, instead
+    of the caller's time.monotonic().
+    """
+
+    def __init__(self, store, name, rate_per_minute, burst):
+        super().__init__(rate_per_minute, burst)
+        self.store = store
+        self.name = name
+
+    def _update(self, fn):
+        # Threads of this worker queue on the local lock rather than polling the shared one
+        with self._lock, self.store.lock(f"{self.name}:lock", timeout=5, sleep=0.002):
+            state = self.store.get(self.name)
+            if state is None:
+                self.tokens, self.updated = float(self.capacity), time.time()
+            else:
+                self.tokens, self.updated = map(float, state.split())
+            result = fn()
+            self.store.set(self.name, f"{self.tokens} {self.updated}", ex=_IDLE_STATE_SECONDS)
+        return result
+
+    def reserve(self, now):
+        return self._update(lambda: self._reserve(time.time()))
+
+    def refund(self):
+        self._update(self._refund)
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after consecutive failures -> half-open after the cooldown,
+    when a single trial request decides whether it closes again.
+    """
+
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD, cooldown=CIRCUIT_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def allow(self, now):
+        if self.opened_at is None:
+            return True
+        if now - self.opened_at >= self.cooldown and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def retry_after(self, now):
+        return max(0.0, self.cooldown - (now - self.opened_at)) if self.opened_at is not None else 0.0
+
+    def release_trial(self):
+        """
+        Give up a trial that was allowed but never sent, so the next request can be the trial.
+        """
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self, now):
+        self.failures += 1
+        if self.trial_in_flight or self.failures >= self.threshold:
+            self.opened_at = now
+        self.trial_in_flight = False
+
+
+class _KeyState:
+    def __init__(self, ident):
+        if shared_state.shared:
+            self.bucket = SharedTokenBucket(shared_state, f"ratelimit:{ident}", RATE_LIMIT_RPM, RATE_LIMIT_BURST)
+        else:
+            self.bucket = TokenBucket(RATE_LIMIT_RPM, RATE_LIMIT_BURST)
+        self.breaker = CircuitBreaker()
+        self.last_used = time.monotonic()
+
+
+class RequestScheduler:
+    """
+    Wraps every model call with per-key rate limiting, retries with
+    exponential backoff and jitter, deadline propagation and a circuit breaker.
+
+    The wrapped function receives the remaining time budget in seconds and
+    should pass it on as the request timeout, so no attempt outlives the
+    request's deadline.
+    """
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, sleep=time.sleep):
+        self.max_attempts = max_attempts
+        self._sleep = sleep
+        self._states = {}
+        self._lock = threading.Lock()
+        self.queue_depth = 0
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def _state(self, api_key, now):
+        # Caller must hold self._lock
+        ident = key_id(api_key)
+        state = self._states.get(ident)
+        if state is None:
+            for stale in [k for k, s in self._states.items() if now - s.last_used > _IDLE_STATE_SECONDS]:
+                del self._states[stale]
+            state = self._states[ident] = _KeyState(ident)
+        state.last_used = now
+        return state
+
+    def call(self, api_key, fn, deadline=None, abandoned=None):
+        """
+        Call fn(timeout) for this API key and return its result.
+        deadline is an absolute time.monotonic() value; defaults to
+        DEFAULT_DEADLINE_SECONDS from now. abandoned is an optional
+        threading.Event set by a caller that stopped waiting for the result;
+        no further attempt is made once it is set.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + DEFAULT_DEADLINE_SECONDS
+        attempt = 0
+        while True:
+            attempt += 1
+            if abandoned is not None and abandoned.is_set():
+                raise DeadlineExceeded("The request was given up on before it could be sent.")
+            self._acquire(api_key, deadline)
+            remaining = deadline - time.monotonic()
+            try:
+                result = fn(remaining)
+            except _THROTTLED + _TRANSIENT as e:
+                now = time.monotonic()
+                with self._lock:
+                    state = self._state(api_key, now)
+                    if isinstance(e, _THROTTLED):
+                        self.throttled += 1
+                        # Quota errors do not mean the service is down, but a failed
+                        # half-open trial must still release the breaker
+                        if state.breaker.trial_in_flight:
+                            state.breaker.record_failure(now)
+                    else:
+                        state.breaker.record_failure(now)
+                    self.failures += 1
+                backoff = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+                if attempt >= self.max_attempts or now + backoff >= deadline:
+                    raise
+                if abandoned is not None and abandoned.is_set():
+                    raise
+                with self._lock:
+                    self.retries += 1
+                self._sleep(backoff)
+                continue
+            except Exception:
+                # Not transient (e.g. invalid request): the service answered, so the circuit stays healthy
+                with self._lock:
+                    self._state(api_key, time.monotonic()).breaker.record_success()
+                raise
+            with self._lock:
+                self._state(api_key, time.monotonic()).breaker.record_success()
+            return result
+
+    def _acquire(self, api_key, deadline):
+        now = time.monotonic()
+        with self._lock:
+            self.calls += 1
+            state = self._state(api_key, now)
+            if not state.breaker.allow(now):
+                self.rejected += 1
+                raise CircuitOpen(
+                    "The model service is failing repeatedly; "
+                    f"retrying in {state.breaker.retry_after(now):.0f}s."
+                )
+        try:
+            # Outside the scheduler lock: a shared bucket waits on other workers and the store,
+            # which must not hold up calls for other keys or stats()
+            wait = state.bucket.reserve(now)
+            if now + wait >= deadline:
+                state.bucket.refund()
+                raise DeadlineExceeded("Rate limit reached; the request could not be sent before its deadline.")
+            if wait:
+                with self._lock:
+                    self.queue_depth += 1
+                try:
+                    self._sleep(wait)
+                finally:
+                    with self._lock:
+                        self.queue_depth -= 1
+        except BaseException:
+            # A half-open trial that is never sent must not keep the circuit open
+            if state.breaker.trial_in_flight:
+                with self._lock:
+                    state.breaker.release_trial()
+            raise
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self.queue_depth,
+                'calls': self.calls,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'failures': self.failures,
+                'circuit_rejections': self.rejected,
+                'open_circuits': sum(1 for s in self._states.values() if s.breaker.opened_at is not None),
+            }
+
+
+def request_options(timeout):
+    """
+    Request options for a google.generativeai call made under the scheduler:
+    the remaining deadline as timeout, and no client-side retries of its own.
+    """
+    return {'timeout': max(0.1, timeout), 'retry': None}
+
+
+# Shared instance used by every session in this process
+scheduler = RequestScheduler()
@@ -0,0 +1,61 @@
+"""
+Run several workers of the app, one Streamlit process each on consecutive
+ports, for a proxy to spread users across.
+
+The workers share per-key rate limits and context cache names through
+SHARED_STATE_URL (a SQLite file on this host unless set), and conversations
+and cached responses through their SQLite files. A user's conversation is
+identified by the ?sid= parameter in the URL, so it is restored on whichever
+worker the page reconnects to.
+
+Usage: python serve.py [--workers 4] [--port 8501] [-- extra streamlit options]
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several workers of the CCMI assistant.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument('--port', type=int, default=8501, help="port of the first worker")
+    parser.add_argument('streamlit_args', nargs=argparse.REMAINDER, help="passed on to streamlit run")
+    args = parser.parse_args()
+    extra = [a for a in args.streamlit_args if a != '--']
+
+    env = dict(os.environ)
+    env.setdefault('SHARED_STATE_URL', 'sqlite://')
+    metrics_port = int(env.get('METRICS_PORT', 9464))
+    workers = []
+    for i in range(args.workers):
+        port = args.port + i
+        worker_env = dict(env, METRICS_PORT=str(metrics_port + i if metrics_port else 0))
+        workers.append(subprocess.Popen(
+            [sys.executable, '-m', 'streamlit', 'run', os.path.join(ROOT, 'main.py'),
+             '--server.port', str(port), '--server.headless', 'true'] + extra,
+            cwd=ROOT, env=worker_env,
+        ))
+        print(f"worker {i + 1}: http://localhost:{port}", file=sys.stderr)
+    print(f"shared state: {env['SHARED_STATE_URL']}", file=sys.stderr)
+
+    def stop(*_):
+        for worker in workers:
+            worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        stop()
+        for worker in workers:
+            worker.wait()
+    return max(worker.returncode or 0 for worker in workers)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+State shared between worker processes when several copies of the app run
+behind a proxy: per-key rate limits and server-side context cache names.
+(Conversations and cached responses already live in SQLite files that all
+workers on a host open.)
+
+Stores implement the small subset of the redis-py client used here: get,
+set with ex/nx, delete and lock. So a Redis server can be used as is, and a
+local store stands in for it when there is none.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Where shared state lives: '' keeps it in this process (a single worker),
+# 'sqlite://' or 'sqlite:///path/to/file' shares it between workers on one host,
+# 'redis://host:port/db' between hosts (needs the redis package). Conversations, cached
+# responses and attachments stay in SQLite files on each host either way
+SHARED_STATE_URL = os.environ.get('SHARED_STATE_URL', '')
+
+# Default SQLite file for 'sqlite://'
+SHARED_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'shared.sqlite3')
+
+
+class LockError(Exception):
+    """
+    Raised when a lock cannot be acquired within its blocking timeout.
+    """
+
+
+class _StoreLock:
+    """
+    Expiring lock held as a key with a random token, in the manner of
+    redis-py's Lock: an abandoned lock (crashed worker) frees itself after
+    `timeout` seconds.
+    """
+
+    def __init__(self, store, name, timeout, sleep, blocking_timeout):
+        self.store = store
+        self.name = name
+        self.timeout = timeout
+        self.sleep = sleep
+        self.blocking_timeout = blocking_timeout
+        self.token = None
+
+    def acquire(self):
+        token = uuid.uuid4().hex
+        stop = None if self.blocking_timeout is None else time.monotonic() + self.blocking_timeout
+        while not self.store.set(self.name, token, ex=self.timeout, nx=True):
+            if stop is not None and time.monotonic() >= stop:
+                return False
+            time.sleep(self.sleep)
+        self.token = token
+        return True
+
+    def release(self):
+        self.store._release(self.name, self.token)
+        self.token = None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise LockError(f"Could not acquire lock {self.name!r}")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class LocalStore:
+    """
+    In-process store: the default when the app runs as a single worker.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, name, now):
+        # Caller must hold self._lock
+        item = self._data.get(name)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[name]
+            return None
+        return item
+
+    def get(self, name):
+        with self._lock:
+            item = self._live(name, time.time())
+        return item[0] if item else None
+
+    def set(self, name, value, ex=None, nx=False):
+        now = time.time()
+        with self._lock:
+            if nx and self._live(name, now) is not None:
+                return None
+            self._data[name] = (_encode(value), now + ex if ex else None)
+            for key in [k for k, (_, expires) in self._data.items() if expires is not None and expires <= now]:
+                del self._data[key]
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    def lock(self, name, timeout=None, sleep=0.1, blocking_timeout=None):
+        return _StoreLock(self, name, timeout, sleep, blocking_timeout)
+
+    def _release(self, name, token):
+        with self._lock:
+            item = self._data.get(name)
+            if item is not None and item[0] == _encode(token):
+                del self._data[name]
+
+
+class SQLiteStore:
+    """
+    Store in a SQLite file in WAL mode, shared by every worker process on the host.
+    """
+
+    shared = True
+
+    def __init__(self, path=SHARED_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        # Caller must hold self._lock
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            # Durable enough for counters and cache names, and much faster to commit
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)'
+            )
+        return self._conn
+
+    def get(self, name):
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)', (name, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, name, value, ex=None, nx=False):
+        now = time.time()
+        expires = now + ex if ex else None
+        with self._lock:
+            conn = self._connect()
+            if nx:
+                # Insert, or take over a key that has expired
+                cursor = conn.execute(
+                    'INSERT INTO kv VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE'
+                    ' SET value = excluded.value, expires = excluded.expires'
+                    ' WHERE kv.expires IS NOT NULL AND kv.expires <= ?',
+                    (name, _encode(value), expires, now),
+                )
+            else:
+                cursor = conn.execute('INSERT OR REPLACE INTO kv VALUES (?, ?, ?)', (name, _encode(value), expires))
+            conn.commit()
+        return True if cursor.rowcount else None
+
+    def delete(self, *names):
+        with self._lock:
+            conn = self._connect()
+            deleted = conn.executemany('DELETE FROM kv WHERE key = ?', [(name,) for name in names]).rowcount
+            conn.commit()
+        return deleted
+
+    def lock(self, name, timeout=None, sleep=0.1, blocking_timeout=None):
+        return _StoreLock(self, name, timeout, sleep, blocking_timeout)
+
+    def _release(self, name, token):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM kv WHERE key = ? AND value = ?', (name, _encode(token)))
+            conn.commit()
+
+
+def _encode(value):
+    # Values come back as bytes, as they do from Redis
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+def connect(url=SHARED_STATE_URL):
+    """
+    Return the store for a SHARED_STATE_URL.
+    """
+    if not url:
+        return LocalStore()
+    if url.startswith('sqlite://'):
+        return SQLiteStore(url[len('sqlite://'):] or SHARED_STATE_PATH)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SHARED_STATE_URL points at Redis, but the redis package is not installed.")
+        store = redis.Redis.from_url(url)
+        store.shared = True
+        return store
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url!r}")
+
+
+# Shared instance used by every session in this process
+shared_state = connect()
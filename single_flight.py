@@ -0,0 +1,139 @@
+import os
+import threading
+
+from response_cache import RESPONSE_CACHE_SEMANTIC, RESPONSE_CACHE_SIMILARITY, embed, normalize_prompt
+
+# Let identical questions asked at the same time share one model call
+COALESCE_REQUESTS = os.environ.get('COALESCE_REQUESTS', '1') != '0'
+
+
+class Flight:
+    """
+    One model call in progress and the jobs waiting on its answer. The job
+    that made the call (the leader) publishes the text as it streams in;
+    the others (followers) mirror it.
+    """
+
+    def __init__(self, key, scope, job, embedding=None):
+        self.key = key
+        self.scope = scope
+        self.embedding = embedding
+        self.jobs = [job]
+        self.text = ''
+        # Set by the leader once it is finished: the answer as followers should see it, and its metrics
+        self.answer = None
+        self.metrics = {}
+        # How the call ended: 'complete', 'empty', 'stopped' or 'error'
+        self.outcome = None
+        self.tokens = 0
+        self.cost = 0.0
+        self.done = False
+        self._changed = threading.Condition()
+
+    @property
+    def followers(self):
+        return len(self.jobs) - 1
+
+    @property
+    def cancelled(self):
+        """
+        True once every job waiting on the answer has been stopped; only then is the model call stopped.
+        """
+        return all(job.cancelled for job in self.jobs)
+
+    def publish(self, text):
+        with self._changed:
+            self.text = text
+            self._changed.notify_all()
+
+    def wait(self, seen, timeout):
+        """
+        Wait until the text differs from `seen` or the flight is done; return (text, done).
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.done or self.text != seen, timeout)
+            return self.text, self.done
+
+    def _finish(self):
+        with self._changed:
+            self.done = True
+            self._changed.notify_all()
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent requests for the same answer: while a question is
+    being answered, the same question asked in the same context (the key of
+    the response cache) joins the call in progress instead of making its
+    own, and receives the same streamed text. With the similarity tier of
+    the response cache enabled, close rephrasings join as well.
+    """
+
+    def __init__(self, enabled=COALESCE_REQUESTS, semantic=RESPONSE_CACHE_SEMANTIC,
+                 similarity=RESPONSE_CACHE_SIMILARITY):
+        self.enabled = enabled
+        self.semantic = semantic
+        self.similarity = similarity
+        self.flights = 0
+        self.coalesced = 0
+        self.tokens_saved = 0
+        self.cost_saved = 0.0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, question, scope, job):
+        """
+        Return (flight, leader). The leader must answer and then call finish();
+        a follower waits on the flight.
+        """
+        question = normalize_prompt(question)
+        flight = Flight(f"{scope}\0{question}", scope, job, embed(question) if self.semantic else None)
+        with self._lock:
+            if self.enabled:
+                current = self._flights.get(flight.key) or self._similar(flight)
+                # A flight whose jobs have all stopped is about to end; start a new one instead
+                if current is not None and not current.cancelled:
+                    current.jobs.append(job)
+                    self.coalesced += 1
+                    return current, False
+                self._flights[flight.key] = flight
+            self.flights += 1
+        return flight, True
+
+    def _similar(self, flight):
+        # Caller must hold self._lock; only a handful of flights are in progress at any time
+        if not self.semantic:
+            return None
+        for current in self._flights.values():
+            if current.scope == flight.scope and current.embedding is not None:
+                if sum(a * b for a, b in zip(flight.embedding, current.embedding)) >= self.similarity:
+                    return current
+        return None
+
+    def finish(self, flight):
+        """
+        Mark the leader's flight as done, releasing its followers.
+        """
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            # No new followers can join from here on
+            self.tokens_saved += flight.followers * flight.tokens
+            self.cost_saved += flight.followers * flight.cost
+        flight._finish()
+
+    def stats(self):
+        with self._lock:
+            requests = self.flights + self.coalesced
+            return {
+                'in_flight': len(self._flights),
+                'flights': self.flights,
+                'coalesced': self.coalesced,
+                'coalesced_rate': self.coalesced / requests if requests else 0.0,
+                'tokens_saved': self.tokens_saved,
+                'cost_saved_usd': self.cost_saved,
+            }
+
+
+# Shared instance used by every session in this process
+single_flight = SingleFlight()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep rate limits in this process, whatever the environment points at
+os.environ['SHARED_STATE_URL'] = ''
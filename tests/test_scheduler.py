@@ -0,0 +1,280 @@
+"""
+RequestScheduler against the fake model backend, on a simulated clock: the
+scheduler's and the backend's sleeps advance the clock instead of waiting.
+"""
+import threading
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import scheduler as scheduler_module
+from backends import FakeBackend
+from scheduler import (
+    BACKOFF_BASE_SECONDS,
+    BACKOFF_MAX_SECONDS,
+    CIRCUIT_COOLDOWN_SECONDS,
+    CircuitOpen,
+    DeadlineExceeded,
+    RequestScheduler,
+)
+
+BACKEND_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only the scheduler module sees the simulated clock
+    monkeypatch.setattr(scheduler_module, 'time', clock)
+    # Take the longest backoff, so limits are reached deterministically
+    monkeypatch.setattr(scheduler_module.random, 'uniform', lambda low, high: high)
+    # Plenty of tokens unless a test is about the rate limit
+    monkeypatch.setattr(scheduler_module, 'RATE_LIMIT_RPM', 6000)
+    monkeypatch.setattr(scheduler_module, 'RATE_LIMIT_BURST', 1000)
+    return clock
+
+
+def fake_backend(clock, error_rate):
+    return FakeBackend(first_token_seconds=0.2, chunk_interval=0.01, chunks=4, error_rate=error_rate,
+                       connect_seconds=0.1, sleep=clock.advance)
+
+
+def ask(scheduler, backend, deadline=None, api_key='test-key'):
+    model, _ = backend.get_model(api_key, 'system prompt')
+    return scheduler.call(
+        api_key,
+        lambda timeout: model.generate_content('question', request_options=scheduler_module.request_options(timeout)),
+        deadline,
+    )
+
+
+def test_success_needs_no_retry(clock):
+    backend = fake_backend(clock, error_rate=0.0)
+    scheduler = RequestScheduler(sleep=clock.sleep)
+    assert ask(scheduler, backend).text
+    assert backend.calls == 1
+    assert scheduler.stats()['retries'] == 0
+    assert clock.sleeps == []
+
+
+def test_retries_stop_after_max_attempts_with_capped_backoff(clock):
+    backend = fake_backend(clock, error_rate=1.0)
+    scheduler = RequestScheduler(max_attempts=6, sleep=clock.sleep)
+    with pytest.raises(BACKEND_ERRORS):
+        ask(scheduler, backend)
+    assert backend.calls == 6
+    assert scheduler.stats()['retries'] == 5
+    assert clock.sleeps == [min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** i) for i in range(5)]
+
+
+def test_retries_recover_from_intermittent_errors(clock):
+    backend = fake_backend(clock, error_rate=0.5)
+    scheduler = RequestScheduler(max_attempts=10, sleep=clock.sleep)
+    for _ in range(5):
+        assert ask(scheduler, backend).text
+    assert backend.errors > 0
+    assert backend.calls == 5 + backend.errors
+
+
+def test_no_retry_past_the_deadline(clock):
+    backend = fake_backend(clock, error_rate=1.0)
+    scheduler = RequestScheduler(sleep=clock.sleep)
+    with pytest.raises(BACKEND_ERRORS):
+        # The first backoff (0.5 s) would end after the deadline
+        ask(scheduler, backend, deadline=clock.now + 0.6)
+    assert backend.calls == 1
+    assert clock.sleeps == []
+
+
+def test_each_attempt_gets_the_remaining_time(clock):
+    scheduler = RequestScheduler(sleep=clock.sleep)
+    timeouts = []
+
+    def attempt(timeout):
+        timeouts.append(timeout)
+        clock.advance(1.0)
+        if len(timeouts) < 3:
+            raise google_exceptions.ServiceUnavailable("down")
+        return 'ok'
+
+    assert scheduler.call('test-key', attempt, clock.now + 20) == 'ok'
+    assert timeouts == [20, 20 - 1.5, 20 - 3.5]
+
+
+def test_rate_limit_refuses_requests_that_cannot_start_before_the_deadline(clock, monkeypatch):
+    monkeypatch.setattr(scheduler_module, 'RATE_LIMIT_RPM', 6)
+    monkeypatch.setattr(scheduler_module, 'RATE_LIMIT_BURST', 1)
+    backend = fake_backend(clock, error_rate=0.0)
+    scheduler = RequestScheduler(sleep=clock.sleep)
+    ask(scheduler, backend)
+    # The next token is 10 s away
+    with pytest.raises(DeadlineExceeded):
+        ask(scheduler, backend, deadline=clock.now + 5)
+    assert backend.calls == 1
+    # The refused request gave its token back, so the next one waits for a single token, not two
+    ask(scheduler, backend, deadline=clock.now + 60)
+    assert backend.calls == 2
+    assert len(clock.sleeps) == 1 and 9 < clock.sleeps[0] <= 10
+
+
+def test_quota_errors_do_not_open_the_circuit(clock):
+    scheduler = RequestScheduler(max_attempts=1, sleep=clock.sleep)
+
+    def quota_exhausted(timeout):
+        raise google_exceptions.ResourceExhausted("quota")
+
+    for _ in range(20):
+        with pytest.raises(google_exceptions.ResourceExhausted):
+            scheduler.call('test-key', quota_exhausted)
+    assert scheduler.stats()['open_circuits'] == 0
+
+
+def test_circuit_opens_then_half_opens_and_closes(clock):
+    backend = fake_backend(clock, error_rate=1.0)
+    scheduler = RequestScheduler(max_attempts=1, sleep=clock.sleep)
+    # Half of the simulated failures are quota errors, which do not count
+    for _ in range(100):
+        try:
+            ask(scheduler, backend)
+        except BACKEND_ERRORS:
+            continue
+        except CircuitOpen:
+            break
+    else:
+        pytest.fail("the circuit never opened")
+    assert scheduler.stats()['open_circuits'] == 1
+
+    # While open, requests are refused without calling the model
+    calls = backend.calls
+    with pytest.raises(CircuitOpen):
+        ask(scheduler, backend)
+    assert backend.calls == calls
+
+    # After the cooldown a single trial request is let through; it succeeds and closes the circuit
+    clock.advance(CIRCUIT_COOLDOWN_SECONDS + 0.5)
+    backend.error_rate = 0.0
+    assert ask(scheduler, backend).text
+    assert backend.calls == calls + 1
+    assert scheduler.stats()['open_circuits'] == 0
+    assert ask(scheduler, backend).text
+
+
+def test_failed_trial_reopens_the_circuit(clock):
+    scheduler = RequestScheduler(max_attempts=1, sleep=clock.sleep)
+    attempts = []
+
+    def unavailable(timeout):
+        attempts.append(timeout)
+        raise google_exceptions.ServiceUnavailable("down")
+
+    for _ in range(scheduler_module.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            scheduler.call('test-key', unavailable)
+    with pytest.raises(CircuitOpen):
+        scheduler.call('test-key', unavailable)
+
+    clock.advance(CIRCUIT_COOLDOWN_SECONDS + 0.5)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        scheduler.call('test-key', unavailable)
+    # One failed trial is enough to open it again for a full cooldown
+    with pytest.raises(CircuitOpen):
+        scheduler.call('test-key', unavailable)
+    clock.advance(CIRCUIT_COOLDOWN_SECONDS - 1)
+    with pytest.raises(CircuitOpen):
+        scheduler.call('test-key', unavailable)
+    assert len(attempts) == scheduler_module.CIRCUIT_FAILURE_THRESHOLD + 1
+
+
+def test_only_one_trial_while_half_open(clock):
+    scheduler = RequestScheduler(max_attempts=1, sleep=clock.sleep)
+
+    def unavailable(timeout):
+        raise google_exceptions.ServiceUnavailable("down")
+
+    for _ in range(scheduler_module.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            scheduler.call('test-key', unavailable)
+    clock.advance(CIRCUIT_COOLDOWN_SECONDS + 0.5)
+
+    def trial(timeout):
+        # A second request arriving while the trial is in flight is refused
+        with pytest.raises(CircuitOpen):
+            scheduler.call('test-key', lambda timeout: 'second')
+        return 'trial'
+
+    assert scheduler.call('test-key', trial) == 'trial'
+    assert scheduler.call('test-key', lambda timeout: 'closed') == 'closed'
+
+
+def test_circuits_are_per_key(clock):
+    scheduler = RequestScheduler(max_attempts=1, sleep=clock.sleep)
+
+    def unavailable(timeout):
+        raise google_exceptions.ServiceUnavailable("down")
+
+    for _ in range(scheduler_module.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            scheduler.call('key-a', unavailable)
+    with pytest.raises(CircuitOpen):
+        scheduler.call('key-a', unavailable)
+    assert scheduler.call('key-b', lambda timeout: 'ok') == 'ok'
+
+def test_trial_refused_by_the_rate_limit_is_released(clock, monkeypatch):
+    # One token a minute, and just enough burst for the failures that open the circuit
+    monkeypatch.setattr(scheduler_module, 'RATE_LIMIT_RPM', 1)
+    monkeypatch.setattr(scheduler_module, 'RATE_LIMIT_BURST', scheduler_module.CIRCUIT_FAILURE_THRESHOLD)
+    scheduler = RequestScheduler(max_attempts=1, sleep=clock.sleep)
+
+    def unavailable(timeout):
+        raise google_exceptions.ServiceUnavailable("down")
+
+    for _ in range(scheduler_module.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            scheduler.call('test-key', unavailable)
+    clock.advance(CIRCUIT_COOLDOWN_SECONDS + 0.5)
+    # The trial is allowed by the breaker but cannot get a token before its deadline
+    with pytest.raises(DeadlineExceeded):
+        scheduler.call('test-key', lambda timeout: 'trial', clock.now + 5)
+    # The next request becomes the trial instead of the circuit staying open
+    assert scheduler.call('test-key', lambda timeout: 'trial', clock.now + 120) == 'trial'
+    assert scheduler.stats()['open_circuits'] == 0
+
+
+def test_abandoned_call_stops_retrying(clock):
+    scheduler = RequestScheduler(max_attempts=10, sleep=clock.sleep)
+    abandoned = threading.Event()
+    attempts = []
+
+    def unavailable(timeout):
+        attempts.append(timeout)
+        # The caller gives up while the first attempt is in flight
+        abandoned.set()
+        raise google_exceptions.ServiceUnavailable("down")
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        scheduler.call('test-key', unavailable, clock.now + 60, abandoned)
+    assert len(attempts) == 1
+    assert clock.sleeps == []
+    # Nothing is sent for a call given up on before it started
+    with pytest.raises(DeadlineExceeded):
+        scheduler.call('test-key', unavailable, clock.now + 60, abandoned)
+    assert len(attempts) == 1